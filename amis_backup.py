@@ -0,0 +1,297 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# ==========================================
+# 背景備份佇列 (防抖 + 合併觸發 + 一致性快照)
+# ==========================================
+
+BACKUP_TABLES = ("sentence_pairs", "vocabulary", "pos_tags")
+
+
+def git_blob_sha(data):
+    """與 GitHub contents API 的 sha 相同算法，用來判斷遠端檔案是否已是最新。"""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def snapshot_bytes(db_path):
+    """以 sqlite3 online backup API 取得一致的資料庫副本 (不受其他連線寫入/WAL 影響)。"""
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        src = sqlite3.connect(db_path, timeout=30)
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+            dst.execute("PRAGMA journal_mode = DELETE")  # 上傳的檔案不帶 WAL 狀態
+        finally:
+            dst.close()
+            src.close()
+        with open(tmp, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(tmp)
+
+
+def table_row_hashes(conn, table):
+    """每列內容 (不含會被重排的 id) -> 雜湊，用來算出列層級的差異。"""
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})") if r[1] != "id"]
+    out = {}
+    for row in conn.execute(f"SELECT {', '.join(cols)} FROM {table}"):
+        rec = dict(zip(cols, row))
+        out[hashlib.sha1(json.dumps(rec, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()] = rec
+    return out
+
+
+# ---------- 遠端 (可替換) ----------
+
+class BackupRemote:
+    """遠端介面：put(path, data, message) 寫入一個檔案；digest(path) 回傳遠端內容的 git blob sha (未知則 None)。"""
+    name = "remote"
+
+    def put(self, path, data, message):
+        raise NotImplementedError
+
+    def digest(self, path):
+        return None
+
+
+class GithubRemote(BackupRemote):
+    def __init__(self, token, user_name, repo_name):
+        self.token, self.user_name, self.repo_name = token, user_name, repo_name
+        self.name = f"GitHub {user_name}/{repo_name}"
+        self._repo = None
+
+    def repo(self):
+        if self._repo is None:
+            from github import Github
+            self._repo = Github(self.token).get_user(self.user_name).get_repo(self.repo_name)
+        return self._repo
+
+    def _contents(self, path):
+        from github import GithubException
+        try:
+            return self.repo().get_contents(path)
+        except GithubException as e:
+            if e.status == 404: return None
+            raise
+
+    def digest(self, path):
+        c = self._contents(path)
+        return c.sha if c else None
+
+    def put(self, path, data, message):
+        c = self._contents(path)
+        if c is None:
+            self.repo().create_file(path, message, data)
+        elif c.sha != git_blob_sha(data):
+            self.repo().update_file(c.path, message, data, c.sha)
+
+
+class DirectoryRemote(BackupRemote):
+    """本機資料夾 (測試或離線使用)。"""
+    def __init__(self, root):
+        self.root = root
+        self.name = f"dir:{root}"
+
+    def put(self, path, data, message):
+        full = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full) or self.root, exist_ok=True)
+        with open(full, "wb") as f:
+            f.write(data)
+
+    def digest(self, path):
+        full = os.path.join(self.root, path)
+        if not os.path.exists(full): return None
+        with open(full, "rb") as f:
+            return git_blob_sha(f.read())
+
+
+class GitRepoRemote(BackupRemote):
+    """本機 (bare) git 倉庫：以 plumbing 指令直接寫入 commit，不需要 working tree。"""
+    def __init__(self, git_dir, branch="main"):
+        self.git_dir, self.branch = git_dir, branch
+        self.name = f"git:{git_dir}"
+
+    def _git(self, *args, data=None, env=None):
+        res = subprocess.run(["git", "--git-dir", self.git_dir, *args], input=data,
+                             capture_output=True, check=True, env=env)
+        return res.stdout.decode().strip()
+
+    def _head(self):
+        try:
+            return self._git("rev-parse", "--verify", "-q", f"refs/heads/{self.branch}")
+        except subprocess.CalledProcessError:
+            return None
+
+    def digest(self, path):
+        head = self._head()
+        if not head: return None
+        try:
+            return self._git("rev-parse", f"{head}:{path}")
+        except subprocess.CalledProcessError:
+            return None
+
+    def put(self, path, data, message):
+        blob = self._git("hash-object", "-w", "--stdin", data=data)
+        head = self._head()
+        fd, index = tempfile.mkstemp(suffix=".index")
+        os.close(fd)
+        os.remove(index)
+        env = dict(os.environ, GIT_INDEX_FILE=index, GIT_AUTHOR_NAME="amis-backup", GIT_AUTHOR_EMAIL="backup@localhost",
+                   GIT_COMMITTER_NAME="amis-backup", GIT_COMMITTER_EMAIL="backup@localhost")
+        try:
+            if head: self._git("read-tree", head, env=env)
+            self._git("update-index", "--add", "--cacheinfo", f"100644,{blob},{path}", env=env)
+            tree = self._git("write-tree", env=env)
+            commit = self._git("commit-tree", tree, *(["-p", head] if head else []), "-m", message, env=env)
+            self._git("update-ref", f"refs/heads/{self.branch}", commit)
+        finally:
+            if os.path.exists(index): os.remove(index)
+
+
+# ---------- 背景工作者 ----------
+
+class BackupWorker:
+    """
+    【背景備份】
+    trigger() 只登記需求並立即返回；工作執行緒等到最後一次觸發後安靜 debounce 秒
+    (最長不超過 max_delay 秒) 才做一次備份，期間的多次觸發合併成一次。
+    mode:
+      - "snapshot": 上傳完整 .db (與 GitHub 部署的 amis_data.db 相容，內容沒變就略過)
+      - "gzip":     上傳壓縮快照 backups/amis_data.db.gz
+      - "delta":    首次上傳壓縮快照，之後只上傳列層級差異 backups/deltas/*.jsonl.gz
+    """
+
+    def __init__(self, db_path, remote, mode="snapshot", debounce=5.0, max_delay=60.0, remote_path="amis_data.db"):
+        self.db_path, self.remote, self.mode = db_path, remote, mode
+        self.debounce, self.max_delay, self.remote_path = debounce, max_delay, remote_path
+        self._cond = threading.Condition()
+        self._pending = []
+        self._first_at = self._last_at = None
+        self._running = False
+        self._seq = self._done_seq = 0
+        self._baseline = None
+        self._last_digest = None
+        self.stats = {"state": "idle", "runs": 0, "coalesced": 0, "skipped": 0, "last_ok": None,
+                      "last_error": None, "last_bytes": 0, "last_seconds": 0.0, "last_reasons": []}
+        self._thread = threading.Thread(target=self._loop, name="amis-backup", daemon=True)
+        self._thread.start()
+
+    def trigger(self, reason="update"):
+        with self._cond:
+            now = time.monotonic()
+            if not self._pending: self._first_at = now
+            self._pending.append(reason)
+            self._seq += 1
+            self._last_at = now
+            self.stats["state"] = "waiting"
+            self._cond.notify()
+
+    def flush(self, timeout=120):
+        """立即執行並等待完成 (手動備份按鈕)。回傳是否成功。"""
+        with self._cond:
+            self._pending.append("manual")
+            self._seq += 1
+            target = self._seq
+            self._first_at = self._last_at = time.monotonic() - self.max_delay
+            self.stats["state"] = "waiting"
+            self._cond.notify()
+            done = self._cond.wait_for(lambda: self._done_seq >= target, timeout=timeout)
+            return done and self.stats["last_error"] is None
+
+    def status(self):
+        with self._cond:
+            return dict(self.stats, queued=len(self._pending), remote=self.remote.name, mode=self.mode)
+
+    def _due_in(self):
+        now = time.monotonic()
+        return max(0.0, min(self._last_at + self.debounce, self._first_at + self.max_delay) - now)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending or self._due_in() > 0:
+                    self._cond.wait(timeout=self._due_in() if self._pending else None)
+                reasons, self._pending = self._pending, []
+                taken = self._seq
+                self._running = True
+                self.stats["state"] = "running"
+            started = time.monotonic()
+            error, size = None, 0
+            try:
+                size = self._run(reasons)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            with self._cond:
+                self._running = False
+                self._done_seq = taken
+                self.stats.update(runs=self.stats["runs"] + 1, coalesced=self.stats["coalesced"] + len(reasons) - 1,
+                                  last_error=error, last_seconds=round(time.monotonic() - started, 3),
+                                  last_reasons=reasons[-5:], state="waiting" if self._pending else "idle")
+                if error is None:
+                    self.stats.update(last_ok=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), last_bytes=size)
+                self._cond.notify_all()
+
+    def _run(self, reasons):
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        message = f"Mobile update: {datetime.now()} ({len(reasons)} 次變更)"
+        if self.mode == "delta" and self._baseline is not None:
+            return self._push_delta(stamp, message)
+        data = snapshot_bytes(self.db_path)
+        if self.mode == "snapshot":
+            digest = git_blob_sha(data)
+            if digest == self._last_digest or digest == self.remote.digest(self.remote_path):
+                self._last_digest = digest
+                self.stats["skipped"] += 1
+                return 0
+            self.remote.put(self.remote_path, data, message)
+            self._last_digest = digest
+            return len(data)
+        packed = gzip.compress(data)
+        path = "backups/amis_data.db.gz" if self.mode == "gzip" else f"backups/snapshot-{stamp}.db.gz"
+        self.remote.put(path, packed, message)
+        if self.mode == "delta":
+            self._baseline = self._snapshot_hashes(data)
+        return len(packed)
+
+    def _snapshot_hashes(self, data):
+        """基準線取自剛上傳的快照本身：快照之後才寫入的列不在快照裡，要留給下一次差異備份。"""
+        fd, tmp = tempfile.mkstemp(suffix=".db")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return self._hashes(tmp)
+        finally:
+            os.remove(tmp)
+
+    def _hashes(self, path=None):
+        """各備份表的列雜湊；path 預設為線上資料庫。"""
+        conn = sqlite3.connect(path or self.db_path, timeout=30)
+        try:
+            names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            return {t: table_row_hashes(conn, t) for t in BACKUP_TABLES if t in names}
+        finally:
+            conn.close()
+
+    def _push_delta(self, stamp, message):
+        current = self._hashes()
+        lines = []
+        for table in BACKUP_TABLES:
+            old, new = self._baseline.get(table, {}), current.get(table, {})
+            lines.extend(json.dumps({"table": table, "op": "-", "row": old[h]}, ensure_ascii=False, default=str) for h in old.keys() - new.keys())
+            lines.extend(json.dumps({"table": table, "op": "+", "row": new[h]}, ensure_ascii=False, default=str) for h in new.keys() - old.keys())
+        if not lines:
+            self.stats["skipped"] += 1
+            return 0
+        packed = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+        self.remote.put(f"backups/deltas/{stamp}.jsonl.gz", packed, message)
+        self._baseline = current
+        return len(packed)
@@ -0,0 +1,165 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# ==========================================
+# 批次翻譯 (有上限的執行緒池 + JSONL 續傳檢查點)
+# ==========================================
+
+BATCH_DIR = "batch_jobs"
+TEXT_FIELDS = ("text", "input", "sentence", "amis", "chinese", "中文", "阿美語")
+
+BATCH_INSTRUCTION = """
+【批次翻譯指令】
+請根據以上【檢索結果】翻譯下列句子。只輸出譯文本身，不要加標題、解釋或引號。
+"""
+
+
+def parse_batch_file(name, data):
+    """
+    上傳檔 -> 待翻譯文字列表 (空行略過)。
+    - .jsonl：每行一個物件，取 TEXT_FIELDS 中第一個有值的欄位 (或整行字串)
+    - .csv：有表頭時取 TEXT_FIELDS 中的欄位，否則取第一欄
+    - 其他：純文字，每行一句
+    """
+    text = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+    ext = os.path.splitext(name or "")[1].lower()
+    items = []
+    if ext == ".jsonl":
+        for line in text.splitlines():
+            if not line.strip(): continue
+            obj = json.loads(line)
+            if isinstance(obj, dict):
+                obj = next((obj[k] for k in TEXT_FIELDS if obj.get(k)), "")
+            items.append(str(obj))
+    elif ext == ".csv":
+        rows = list(csv.reader(io.StringIO(text)))
+        if rows:
+            header = [h.strip() for h in rows[0]]
+            col = next((header.index(k) for k in TEXT_FIELDS if k in header), None)
+            body = rows[1:] if col is not None else rows
+            items = [r[col or 0] for r in body if len(r) > (col or 0)]
+    else:
+        items = text.splitlines()
+    return [s.strip() for s in items if s and s.strip()]
+
+
+def job_id(items, model_name, direction):
+    """同一份內容、模型與方向得到同一個 id，重新上傳即可接續先前的進度。"""
+    h = hashlib.sha256(f"{model_name}\0{direction}\0".encode("utf-8"))
+    for s in items:
+        h.update(s.encode("utf-8") + b"\n")
+    return h.hexdigest()[:16]
+
+
+def checkpoint_path(jid, root=BATCH_DIR):
+    return os.path.join(root, f"{jid}.jsonl")
+
+
+def load_checkpoint(path):
+    """{index: record}；同一句有多筆時以最後一筆為準，中斷時寫了一半的最後一行會被忽略。"""
+    done = {}
+    if not os.path.exists(path): return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[rec["index"]] = rec
+    return done
+
+
+def ordered_jsonl(path):
+    """依原始順序輸出的 JSONL (供下載)。"""
+    recs = sorted(load_checkpoint(path).values(), key=lambda r: r["index"])
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs).encode("utf-8")
+
+
+class BatchTranslator:
+    """
+    【批次翻譯】
+    每一句：retrieve(text, direction) 取得 (full_trans, words, sentences, rag_prompt)；
+    有專家完整翻譯就直接採用，否則查回應快取，最後才經由 client (LLMClient，後端可替換) 呼叫模型。
+    同時進行的句數不超過 workers；額度則由 client 內共用的 RateLimiter 控管。
+    每完成一句立即追加到 JSONL 檢查點，中斷後以 run() 重跑會略過已成功的句子。
+    """
+
+    def __init__(self, client, model_name, retrieve, direction="AtoZ", workers=4, cache=None, corpus_version="",
+                 protocol=""):
+        self.client, self.model_name, self.retrieve = client, model_name, retrieve
+        self.direction, self.workers = direction, max(1, int(workers))
+        self.cache, self.corpus_version, self.protocol = cache, corpus_version, protocol
+        self._write_lock = threading.Lock()
+
+    def build_prompt(self, text, rag_prompt):
+        return f"{rag_prompt}\n\n{self.protocol}\n\n{BATCH_INSTRUCTION}\n\n使用者輸入: {text}"
+
+    def translate_one(self, index, text):
+        started = time.monotonic()
+        rec = {"index": index, "input": text, "output": None, "source": None, "error": None}
+        try:
+            full_trans, _, _, rag_prompt = self.retrieve(text, self.direction)
+            if full_trans:
+                rec.update(output=full_trans, source="expert")
+            else:
+                prompt = self.build_prompt(text, rag_prompt)
+                cached = self.cache.get(self.model_name, prompt, self.corpus_version) if self.cache else None
+                if cached is not None:
+                    rec.update(output=cached, source="cache")
+                else:
+                    out = self.client.generate(self.model_name, prompt, site="batch").strip()
+                    if self.cache and out: self.cache.put(self.model_name, prompt, out, self.corpus_version)
+                    rec.update(output=out, source="model")
+        except Exception as e:
+            rec.update(source="error", error=f"{type(e).__name__}: {e}")
+        rec["latency_s"] = round(time.monotonic() - started, 3)
+        return rec
+
+    def _work(self, path, index, text):
+        # 在工作執行緒內寫檢查點：呼叫端中途被打斷時，進行中的句子仍會被保存
+        rec = self.translate_one(index, text)
+        with self._write_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        return rec
+
+    def run(self, items, path, on_result=None, should_stop=None):
+        """
+        執行 (或接續) 批次。on_result(record, summary) 於每句完成時呼叫 (呼叫端執行緒)；
+        should_stop() 為 True 時不再送出新句子，等進行中的句子寫入檢查點後返回。
+        回傳 summary：total / done / ok / errors / skipped / stopped。
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        previous = load_checkpoint(path)
+        ok_before = {i for i, r in previous.items() if r.get("source") != "error" and i < len(items)}
+        todo = [(i, t) for i, t in enumerate(items) if i not in ok_before]
+        summary = {"total": len(items), "done": len(ok_before), "ok": len(ok_before), "errors": 0,
+                   "skipped": len(ok_before), "stopped": False}
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="amis-batch")
+        pending, queue = set(), iter(todo)
+        try:
+            while True:
+                # 只保持 workers 句在飛，停止時不會有一大串排隊中的工作
+                while len(pending) < self.workers and not summary["stopped"]:
+                    if should_stop and should_stop():
+                        summary["stopped"] = True
+                        break
+                    nxt = next(queue, None)
+                    if nxt is None: break
+                    pending.add(pool.submit(self._work, path, *nxt))
+                if not pending: break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    rec = fut.result()
+                    summary["done"] += 1
+                    summary["errors" if rec["source"] == "error" else "ok"] += 1
+                    if on_result: on_result(rec, summary)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return summary
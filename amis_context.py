@@ -0,0 +1,160 @@
+import re
+import threading
+
+import amis_db
+import amis_fts
+
+# ==========================================
+# Pangcah 全庫語境 (壓縮格式 + 版本化共用快取)
+# ==========================================
+# 格式定義：
+#   單詞區 (==V==)：Amis,Chinese,POS|Note
+#   句型區 (==S==)：Amis||Chinese|Note
+
+CONTEXT_HEADER = "Dataset:Amis-Note-Compressed\n"
+
+
+def vocab_line(amis, chinese, pos, note):
+    line = f"{amis or ''},{chinese or ''},{pos or ''}"
+    return f"{line}|{note}" if note else line  # 若無 note，省去分隔符
+
+
+def sentence_line(amis, chinese, note):
+    line = f"{amis or ''}||{chinese or ''}"
+    return f"{line}|{note}" if note else line
+
+
+def vocab_section(conn):
+    rows = conn.execute("SELECT amis, chinese, part_of_speech, note FROM vocabulary").fetchall()
+    if not rows: return ""
+    return "==V==\n" + "".join(vocab_line(*r) + "\n" for r in rows)
+
+
+def sentence_section(conn):
+    rows = conn.execute("SELECT output_sentencepattern_amis, output_sentencepattern_chinese, note FROM sentence_pairs").fetchall()
+    if not rows: return ""
+    return "==S==\n" + "".join(sentence_line(*r) + "\n" for r in rows)
+
+
+SECTIONS = (("vocabulary", vocab_section), ("sentence_pairs", sentence_section))
+
+
+class ContextCache:
+    """
+    【版本化語境快取】
+    全程序共用；單詞區與句型區各自以 table_versions 的版本號為鍵，
+    只有版本改變的區段才會重新序列化 (線性時間，一次 join)。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sections = {}
+        self.rebuilds = {t: 0 for t, _ in SECTIONS}
+
+    def get(self, db):
+        versions = amis_db.table_versions(db)
+        with self._lock:
+            parts = [CONTEXT_HEADER]
+            for table, build in SECTIONS:
+                cached = self._sections.get(table)
+                if cached is None or cached[0] != versions.get(table):
+                    cached = (versions.get(table), build(db.connection()))
+                    self._sections[table] = cached
+                    self.rebuilds[table] += 1
+                parts.append(cached[1])
+            return "".join(parts)
+
+    def version_key(self, db):
+        v = amis_db.table_versions(db)
+        return tuple(v.get(t) for t, _ in SECTIONS)
+
+
+# ==========================================
+# Token 預算語境 (依相關度挑選，取代整庫塞入)
+# ==========================================
+
+_CJK_CHAR_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """粗估 token 數：中日韓字元約 1 字 1 token，其餘約 4 字元 1 token。"""
+    cjk = len(_CJK_CHAR_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+_SOURCES = (("vocabulary", vocab_line, "SELECT amis, chinese, part_of_speech, note FROM vocabulary"),
+            ("sentence_pairs", sentence_line, "SELECT output_sentencepattern_amis, output_sentencepattern_chinese, note FROM sentence_pairs"))
+
+
+def _ranked_candidates(conn, user_input, limit):
+    """
+    回傳 [(relevance, table, line)]，relevance 介於 0~1。
+    優先用 FTS5 的 bm25 (各表以最佳分數正規化)；沒有 FTS5 (或影子表尚未建立) 時改用詞元重疊比例。
+    """
+    out = []
+    if amis_fts.ready(conn):
+        for table, to_line in (("vocabulary", vocab_line), ("sentence_pairs", sentence_line)):
+            rows = amis_fts.search(conn, table, None, user_input, limit=limit, with_score=True)
+            if not rows: continue
+            best = rows[0][-1] or -1.0
+            out.extend((r[-1] / best, table, to_line(*r[1:-1])) for r in rows)
+        return out
+    query = set(amis_fts.tokenize(user_input))
+    if not query: return out
+    for table, to_line, sql in _SOURCES:
+        for r in conn.execute(sql):
+            hit = len(query.intersection(amis_fts.tokenize(" ".join(str(v) for v in r if v))))
+            if hit: out.append((hit / len(query), table, to_line(*r)))
+    out.sort(key=lambda x: -x[0])
+    return out[:limit * 2]
+
+
+def _fill_rows(conn):
+    """兩表的列輪流產生 (table, line) (各依 rowid)，讓補位不會整份預算都給單詞。"""
+    cursors = [(table, to_line, conn.execute(sql)) for table, to_line, sql in _SOURCES]
+    while cursors:
+        for c in list(cursors):
+            r = c[2].fetchone()
+            if r is None: cursors.remove(c)
+            else: yield c[0], c[1](*r)
+
+
+_FILL_MISSES = 256  # 補位時連續這麼多列都放不下就停止 (預算已近用完，不必掃完整庫)
+
+
+def build_budgeted_context(db, user_input, budget_tokens, candidate_limit=5000):
+    """
+    【Token 預算語境】
+    依與 user_input 的相關度排序單詞/句型列，由高到低裝入；命中的列裝完後，
+    剩下的預算以未命中的列 (兩表輪流) 補滿，沒有命中的輸入也能拿到完整預算的語境。
+    輸出格式與全庫語境相同 (==V== / ==S== 壓縮格式)。
+    回傳 (ctx, info)，info 含 budget / used_tokens / kept / dropped / total。
+    """
+    conn = db.connection()
+    total = sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t, _ in SECTIONS)
+    used = estimate_tokens(CONTEXT_HEADER + "==V==\n==S==\n")
+    kept = {"vocabulary": [], "sentence_pairs": []}
+    seen = set()
+    for _, table, line in sorted(_ranked_candidates(conn, user_input, candidate_limit), key=lambda x: -x[0]):
+        if (table, line) in seen: continue
+        seen.add((table, line))
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens: continue  # 較短的下一列可能還放得下
+        kept[table].append(line)
+        used += cost
+    misses = 0
+    for table, line in _fill_rows(conn):
+        if misses >= _FILL_MISSES: break
+        if (table, line) in seen: continue
+        seen.add((table, line))
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens:
+            misses += 1
+            continue
+        kept[table].append(line)
+        used, misses = used + cost, 0
+    parts = [CONTEXT_HEADER]
+    if kept["vocabulary"]: parts.append("==V==\n" + "".join(l + "\n" for l in kept["vocabulary"]))
+    if kept["sentence_pairs"]: parts.append("==S==\n" + "".join(l + "\n" for l in kept["sentence_pairs"]))
+    n_kept = len(kept["vocabulary"]) + len(kept["sentence_pairs"])
+    return "".join(parts), {"budget": budget_tokens, "used_tokens": used, "kept": n_kept, "dropped": total - n_kept, "total": total}
@@ -0,0 +1,266 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import amis_db
+import amis_import
+import amis_retrieval
+from amis_batch import BATCH_INSTRUCTION
+from amis_context import ContextCache, build_budgeted_context, estimate_tokens
+from amis_db import Database
+from amis_dedup import NearDuplicateIndex
+from amis_index import CorpusIndex
+from amis_llm import CallLog, LLMClient, RateLimiter, ResponseCache, limits_for
+from amis_tm import TranslationMemory
+from amis_vectors import SentenceVectors
+from amis_writer import WriteQueue
+
+# ==========================================
+# 無介面核心 (檢索 + 翻譯管線，不依賴 Streamlit)
+# ==========================================
+# Streamlit 頁面、本機 HTTP API (amis_server) 與批次翻譯共用同一份：
+# 連線管理、寫入執行緒、倒排索引、句型向量、翻譯記憶、近似重複索引、全庫語境快取、回應快取、各模型的限流器與呼叫紀錄。
+# 所有方法都可以在多個執行緒同時呼叫 (各索引自帶鎖，SQLite 連線每執行緒一條)。
+# 檢索路徑只讀；索引的 pending 佇列一律由寫入執行緒 (writer) 追趕：啟動時一次、每批寫入提交後一次，
+# 以及查詢時發現語料版本 (例如其他程序寫入) 比上次維護新時排入一次。
+
+DIRECTIONS = ("AtoZ", "ZtoA")
+
+MISSING_WORD_PROTOCOL = """
+【特殊協議】
+1. 僅限使用提供的資料庫。
+2. 資料格式為壓縮版：
+   - 單詞區 (==V==): 阿美語,中文,詞性|備註
+   - 句型區 (==S==): 阿美語||中文|備註
+3. 若無對應詞，請保留原文。
+"""
+
+TRANSLATE_INSTRUCTION = """
+【排版指令】
+1. 使用 `### 🦅 翻譯結果` 作為標題。
+2. 關鍵句請用 `### :blue[...]` 包裹。
+3. 請參考資料庫中的 '備註' (|Note) 來增強翻譯準確度，但不一定要顯示出來。
+"""
+
+
+# ---------- 提示詞 ----------
+
+def translate_prompt(ctx, text):
+    """Pangcah 模式翻譯 (全庫或依預算裁剪的語境)。"""
+    return f"{ctx}\n\n{MISSING_WORD_PROTOCOL}\n\n{TRANSLATE_INSTRUCTION}\n\n使用者輸入: {text}"
+
+
+def chat_prompt(ctx, user_text, translation):
+    return f"""
+{ctx}
+【指令】
+使用者: "{user_text}"
+意思: "{translation}"
+請扮演阿美族耆老(Faki/Fayi)用阿美語回應(附中文)。
+排版：阿美語請用 `###` 加大。
+"""
+
+
+def analysis_prompt(rag_prompt, text):
+    return f"{rag_prompt}\n\n{MISSING_WORD_PROTOCOL}\n\n請根據以上提供的【阿美語語料庫】，對以下句子進行詳細語法與語意分析。\n\n使用者輸入: {text}"
+
+
+def rag_translate_prompt(rag_prompt, text):
+    """一般模式的單句翻譯 (檢索結果 + 只輸出譯文)，與批次翻譯同一份提示詞，回應快取可以共用。"""
+    return f"{rag_prompt}\n\n{MISSING_WORD_PROTOCOL}\n\n{BATCH_INSTRUCTION}\n\n使用者輸入: {text}"
+
+
+def pangcah_proxy_model(models, fallback="models/gemini-1.5-flash"):
+    """Pangcah 模式實際呼叫的模型：flash 優先，其次清單第一個。"""
+    flash = [m for m in models if 'flash' in m]
+    if flash: return flash[0]
+    return models[0] if models else fallback
+
+
+class AmisCore:
+    """
+    【無介面核心】每個程序一份，所有呼叫端共用同一組暖索引與快取。
+    - lookup()：RAG 檢索 (專家整句翻譯、相關單詞、例句、翻譯記憶)
+    - translate()：有專家翻譯直接回傳；否則查回應快取，最後才呼叫模型 (一般模式或 Pangcah 語境)
+    - analyze()：檢索結果 + 模型語法分析
+    backend：模型後端 (generate / stream(model_name, prompt))，可換成 amis_llm.FakeBackend；
+    各方法也可以另外傳 backend (例如 Streamlit 每個 session 用自己的 API key)。
+    rpm / tpm：覆寫所有模型的限流上限 (None = 依模型家族的預設值)。
+    retrieval_cache：檢索結果的 LRU 筆數 (鍵含語料版本，資料一異動就自然失效；0 = 不快取)。
+    writer：本程序唯一的寫入執行緒 (amis_writer.WriteQueue)，所有寫入與索引維護都排進這裡。
+    """
+
+    def __init__(self, db_path="amis_data.db", backend=None, cache_path="amis_cache.db", vectors_dir="amis_vectors",
+                 rpm=None, tpm=None, timeout=30, factory=sqlite3.Connection, retrieval_cache=256):
+        self.db = Database(db_path, timeout=timeout, factory=factory)
+        self.index = CorpusIndex()
+        self.vectors = SentenceVectors(vectors_dir) if vectors_dir else None
+        self.tm = TranslationMemory()
+        self.dedup = NearDuplicateIndex()
+        self.context_cache = ContextCache()
+        self.responses = ResponseCache(cache_path)
+        self.call_log = CallLog()
+        self.backend, self.rpm, self.tpm = backend, rpm, tpm
+        self._limiters = {}
+        self._retrieval, self.retrieval_cache = OrderedDict(), retrieval_cache
+        self.retrieval_stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._maintained, self._maintain_queued = None, False
+        self.writer = WriteQueue(self.db, after_batch=self.maintain)
+
+    # ---------- 資料與索引 ----------
+
+    def bootstrap(self):
+        """
+        建表、修復舊版主鍵結構、建立索引與版本追蹤觸發器，並追上各檢索索引
+        (每個程序做一次；資料庫還原後再呼叫一次)。在寫入執行緒上執行並等待完成。
+        """
+        self.writer.call(self._bootstrap)
+
+    def _bootstrap(self):
+        with self.db.transaction() as conn:
+            # 舊版 to_sql(replace) 弄掉的主鍵結構在這裡修復 (只會發生一次)
+            if amis_db.ensure_schema(conn): self.index.invalidate()
+            amis_db.ensure_vocab_index(conn)
+            amis_db.ensure_change_tracking(conn)
+            amis_import.drop_leftovers(conn)
+        self.maintain()
+
+    def maintain(self):
+        """
+        【索引維護】只在寫入執行緒上執行 (WriteQueue 的 after_batch 與 bootstrap)：
+        FTS 影子表、詞幹表、句型向量、翻譯記憶、近似重複索引的 pending 佇列，需要時整份重建。
+        查詢端從不寫入，只會看到稍舊的索引。
+        """
+        with self._lock:
+            self._maintain_queued = False
+        version = self.corpus_version()
+        amis_retrieval.maintain(self.db.connection(), self.vectors, self.tm, self.dedup)
+        self._maintained = version
+
+    def catch_up(self, version=None):
+        """語料版本比上次維護新 (例如其他程序寫入) 時排入一次維護；不等待，查詢照常使用現有索引。"""
+        if self._maintained == (version or self.corpus_version()): return
+        with self._lock:
+            if self._maintain_queued: return
+            self._maintain_queued = True
+        self.writer.submit(self.maintain)
+
+    def invalidate(self):
+        """資料庫被整個換掉 (還原備份) 後呼叫：清掉倒排索引與檢索快取 (還原後的版本號可能與舊的相同)。"""
+        self.index.invalidate()
+        with self._lock:
+            self._retrieval.clear()
+
+    def corpus_index(self):
+        """倒排索引，依各表的異動版本增量同步新寫入的資料列 (其他程序就地修改時整表重建)。"""
+        self.index.refresh(lambda sql, params: self.db.query(sql, params), amis_db.table_versions(self.db))
+        return self.index
+
+    def corpus_version(self):
+        """語料版本字串；任何單詞/句型異動都會讓舊的 AI 回應快取失效。"""
+        return str(self.context_cache.version_key(self.db))
+
+    def full_context(self):
+        """全庫壓縮語境 (以資料版本自動失效)。"""
+        return self.context_cache.get(self.db)
+
+    def pangcah_context(self, text, budget_tokens, use_full=False):
+        """Pangcah 提示語境：預設依相關度裁剪到 Token 預算內；use_full 時回傳整庫語境。回傳 (ctx, info)。"""
+        if use_full:
+            ctx = self.full_context()
+            tokens = estimate_tokens(ctx)
+            return ctx, {"budget": tokens, "used_tokens": tokens, "kept": None, "dropped": 0, "total": None}
+        return build_budgeted_context(self.db, text, budget_tokens)
+
+    def expert_knowledge(self, text, direction="AtoZ"):
+        """
+        amis_retrieval.expert_knowledge 的回傳 (full_trans, words, sentences, rag_prompt)。
+        同一語料版本下相同的查詢直接取 LRU 裡的結果 (多個呼叫端共用同一份物件，不要就地修改)。
+        索引落後時先排入維護，這次照常以現有索引檢索。
+        """
+        key = (text, direction, self.corpus_version())
+        fresh = self._maintained == key[2]
+        if not fresh: self.catch_up(key[2])
+        with self._lock:
+            hit = self._retrieval.get(key)
+            if hit is not None:
+                self._retrieval.move_to_end(key)
+                self.retrieval_stats["hits"] += 1
+                return hit
+            self.retrieval_stats["misses"] += 1
+        out = amis_retrieval.expert_knowledge(self.db, text, direction, index=self.corpus_index,
+                                              vectors=self.vectors, tm=self.tm)
+        if self.retrieval_cache and fresh:  # 索引還沒追上這個版本時的結果不快取
+            with self._lock:
+                self._retrieval[key] = out
+                while len(self._retrieval) > self.retrieval_cache: self._retrieval.popitem(last=False)
+        return out
+
+    # ---------- 模型 ----------
+
+    def limiter(self, model_name):
+        """同一模型的所有呼叫端共用一個限流器。"""
+        with self._lock:
+            if model_name not in self._limiters:
+                rpm, tpm = limits_for(model_name)
+                self._limiters[model_name] = RateLimiter(self.rpm or rpm, self.tpm or tpm)
+            return self._limiters[model_name]
+
+    def client(self, model_name, backend=None):
+        backend = backend or self.backend
+        if backend is None: raise ValueError("沒有設定模型後端")
+        return LLMClient(backend, self.limiter(model_name), log=self.call_log)
+
+    def complete(self, model_name, prompt, site="api", backend=None):
+        """先查回應快取，未命中才呼叫模型並寫回快取。回傳 (text, source)，source 為 "cache" 或 "model"。"""
+        version = self.corpus_version()
+        cached = self.responses.get(model_name, prompt, version)
+        if cached is not None: return cached, "cache"
+        text = self.client(model_name, backend).generate(model_name, prompt, site=site).strip()
+        if text: self.responses.put(model_name, prompt, text, version)
+        return text, "model"
+
+    # ---------- 對外操作 ----------
+
+    def lookup(self, text, direction="AtoZ"):
+        _check(text, direction)
+        full_trans, words, sentences, _ = self.expert_knowledge(text, direction)
+        return {"text": text, "direction": direction, "full_trans": full_trans, "words": words,
+                "sentences": sentences, "corpus_version": self.corpus_version()}
+
+    def translate(self, text, model_name, direction="AtoZ", pangcah=False, budget=30000, use_full=False, backend=None):
+        """
+        一般模式：專家整句翻譯優先，否則以檢索結果請模型只輸出譯文 (與批次翻譯相同)。
+        pangcah=True：依 Token 預算 (或全庫) 組語境，請模型翻譯並排版。
+        回傳 {"output", "source" (expert / cache / model), "model"}；Pangcah 模式另附 "context" (語境用量)。
+        """
+        _check(text, direction)
+        if pangcah:
+            ctx, info = self.pangcah_context(text, budget, use_full)
+            out, source = self.complete(model_name, translate_prompt(ctx, text), "translate", backend)
+            return {"text": text, "output": out, "source": source, "model": model_name, "context": info}
+        full_trans, _, _, rag_prompt = self.expert_knowledge(text, direction)
+        if full_trans: return {"text": text, "direction": direction, "output": full_trans, "source": "expert", "model": None}
+        out, source = self.complete(model_name, rag_translate_prompt(rag_prompt, text), "translate", backend)
+        return {"text": text, "direction": direction, "output": out, "source": source, "model": model_name}
+
+    def analyze(self, text, model_name, direction="AtoZ", backend=None):
+        _check(text, direction)
+        full_trans, words, sentences, rag_prompt = self.expert_knowledge(text, direction)
+        out, source = self.complete(model_name, analysis_prompt(rag_prompt, text), "analysis", backend)
+        return {"text": text, "direction": direction, "full_trans": full_trans, "words": words, "sentences": sentences,
+                "analysis": out, "source": source, "model": model_name}
+
+    def status(self):
+        with self._lock:
+            limiters = {m: l.status() for m, l in self._limiters.items()}
+            retrieval = dict(self.retrieval_stats, entries=len(self._retrieval))
+        return {"corpus_version": self.corpus_version(), "responses": self.responses.stats(), "retrieval": retrieval,
+                "limiters": limiters, "tm": self.tm.status(), "writer": self.writer.status(),
+                "model_calls": len(self.call_log.recent(10 ** 6))}
+
+
+def _check(text, direction):
+    if not isinstance(text, str) or not text.strip(): raise ValueError("text 不可為空")
+    if direction not in DIRECTIONS: raise ValueError(f"direction 必須是 {' / '.join(DIRECTIONS)}")
@@ -0,0 +1,421 @@
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==========================================
+# 連線管理層 (每執行緒一條持久連線 + WAL)
+# ==========================================
+
+DEFAULT_PRAGMAS = (
+    ("journal_mode", "WAL"),       # 讀寫不互斥，讀者不必排在寫者後面
+    ("synchronous", "NORMAL"),     # WAL 下的安全折衷，提交不必每次 fsync
+    ("cache_size", -16000),        # 約 16 MB page cache
+    ("mmap_size", 268435456),      # 256 MB 記憶體映射讀取
+    ("temp_store", "MEMORY"),
+)
+
+
+class Database:
+    """
+    【共用連線池】
+    - 每個執行緒 (Streamlit session) 保有自己的持久連線，避免每句 SQL 重新連線。
+    - 連線以 autocommit 模式開啟，寫入交易一律透過 transaction() 明確界定。
+    - sqlite3 內建的 statement cache 負責重用已編譯的 SQL (cached_statements)。
+    - 錯誤一律往外拋，不再吞掉。
+    - factory 可換成 sqlite3.Connection 的子類別 (例如 amis_metrics.TracedConnection 做效能監測)。
+    """
+
+    def __init__(self, path, timeout=30, pragmas=DEFAULT_PRAGMAS, cached_statements=256, factory=sqlite3.Connection):
+        self.path = path
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+        self._generation = 0
+
+    # ---------- 連線 ----------
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=self.cached_statements, factory=self.factory)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def connection(self):
+        """取得目前執行緒的連線 (必要時建立)。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._open()
+            self._local.conn, self._local.generation, self._local.depth = conn, self._generation, 0
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close_all(self):
+        """關閉所有執行緒的連線；各執行緒下次使用時會自動重連。"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._generation += 1
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    # ---------- 交易 ----------
+
+    @contextmanager
+    def transaction(self):
+        """
+        明確的交易範圍。最外層使用 BEGIN IMMEDIATE (一開始就取得寫入鎖，避免升級時死結)，
+        巢狀呼叫改用 SAVEPOINT；例外時回滾並重新拋出。
+        """
+        conn = self.connection()
+        depth = self._local.depth
+        name = f"sp_{depth}"
+        conn.execute("BEGIN IMMEDIATE" if depth == 0 else f"SAVEPOINT {name}")
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            if depth == 0:
+                conn.execute("ROLLBACK")
+            else:
+                conn.execute(f"ROLLBACK TO {name}")
+                conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            conn.execute("COMMIT" if depth == 0 else f"RELEASE {name}")
+        finally:
+            self._local.depth = depth
+
+    # ---------- 查詢 ----------
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        """單句寫入；不在交易中時由 autocommit 立即提交。回傳 cursor (可取 rowcount/lastrowid)。"""
+        return self.connection().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq)
+
+    # ---------- 維運 ----------
+
+    def checkpoint(self):
+        """把 WAL 內容寫回主檔，讓直接讀取 .db 檔 (例如備份上傳) 看到最新資料。"""
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def restore_from_bytes(self, data):
+        """以上傳的 .db 內容覆蓋目前資料庫 (透過 backup API，WAL 與其他連線皆保持一致)。"""
+        fd, tmp = tempfile.mkstemp(suffix=".db")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            src = sqlite3.connect(tmp)
+            try:
+                src.backup(self.connection())
+            finally:
+                src.close()
+        finally:
+            os.remove(tmp)
+        self.checkpoint()
+
+
+# ==========================================
+# 流水號 (id) 維護
+# ==========================================
+
+def ids_are_dense(conn, table):
+    """id 是否恰好為 1..N 且不重複 (不需重排)。"""
+    n, lo, hi, distinct = conn.execute(f"SELECT COUNT(*), MIN(id), MAX(id), COUNT(DISTINCT id) FROM {table}").fetchone()
+    return n == 0 or (lo == 1 and hi == n and distinct == n)
+
+
+def reorder_ids(db, table, if_needed=False):
+    """
+    【集合式重排】
+    以 ROW_NUMBER() OVER (ORDER BY created_at) 一次算出新編號，單一 UPDATE ... FROM 寫回，
+    只改動編號真的變了的列；全部在同一個交易內完成 (一次提交)。
+    if_needed=True 時，若 id 已經連續就直接略過。
+    """
+    with db.transaction() as conn:
+        n = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if not n: return 0
+        if if_needed and ids_are_dense(conn, table): return n
+        # 先寫成負數再翻正：id 為主鍵時，逐列更新不會在中途撞到尚未搬走的舊編號
+        conn.execute(f"""
+            UPDATE {table} SET id = -r.rn
+            FROM (SELECT rowid AS rid, ROW_NUMBER() OVER (ORDER BY created_at ASC, rowid ASC) AS rn FROM {table}) AS r
+            WHERE {table}.rowid = r.rid AND {table}.id IS NOT r.rn
+        """)
+        conn.execute(f"UPDATE {table} SET id = -id WHERE id < 0")
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, n))
+        return n
+
+
+def insert_dense(db, table, data):
+    """
+    追加一列並直接給它 MAX(id) + 1，讓 id 保持連續而不必整表重排。
+    (新資料的 created_at 為現在時間，本來就排在最後。) 回傳新列的 rowid。
+    """
+    cols = list(data)
+    with db.transaction() as conn:
+        cur = conn.execute(
+            f"INSERT INTO {table} (id, {', '.join(cols)}) SELECT COALESCE(MAX(id), 0) + 1, {', '.join('?' * len(cols))} FROM {table}",
+            [data[c] for c in cols])
+        return cur.lastrowid
+
+
+def table_columns(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _clean(value):
+    """data_editor / pandas 的 NaN、NaT 一律寫成 NULL。"""
+    if value is None: return None
+    try:
+        if value != value: return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def _unchanged(expected, rid, cols):
+    """樂觀鎖條件：該列目前的內容仍與讀取時相同 (id 會被重排，不比對)。回傳 (SQL 片段, 參數)。"""
+    base = {k: _clean(v) for k, v in (expected or {}).get(rid, {}).items() if k in cols and k not in ("id", "_rowid")}
+    return "".join(f" AND {k} IS ?" for k in base), list(base.values())
+
+
+def apply_edits(db, table, rowids, changes, defaults=None, expected=None):
+    """
+    【差異儲存】
+    把 st.data_editor 的編輯狀態 (edited_rows / added_rows / deleted_rows) 轉成單一交易內的
+    UPDATE / INSERT / DELETE，只動到被編輯的列；表結構、索引與觸發器都不受影響。
+    rowids[i] 為編輯器第 i 列對應的 rowid；defaults 為新增列缺值時的預設 (例如 created_at)。
+    expected：{rowid: {欄位: 讀取時的值}}。有提供時修改/刪除都附帶「內容未變」條件 (樂觀鎖)，
+    讀取之後已被別人改過或刪掉的列不會被覆寫，改列入 conflicts。
+    回傳 {"updated": [rowid], "inserted": [rowid], "deleted": [rowid], "conflicts": [rowid]}。
+    """
+    out = {"updated": [], "inserted": [], "deleted": [], "conflicts": []}
+    with db.transaction() as conn:
+        cols = set(table_columns(conn, table))
+        writable = cols - {"id"}
+        gone = {int(i) for i in changes.get("deleted_rows", [])}
+        for i in sorted(gone):
+            rid = rowids[i]
+            cond, params = _unchanged(expected, rid, cols)
+            if conn.execute(f"DELETE FROM {table} WHERE rowid = ?{cond}", [rid, *params]).rowcount: out["deleted"].append(rid)
+            else: out["conflicts"].append(rid)
+        for pos, vals in changes.get("edited_rows", {}).items():
+            vals = {k: _clean(v) for k, v in vals.items() if k in writable}
+            if not vals or int(pos) in gone: continue
+            rid = rowids[int(pos)]
+            cond, params = _unchanged(expected, rid, cols)
+            cur = conn.execute(f"UPDATE {table} SET {', '.join(f'{k} = ?' for k in vals)} WHERE rowid = ?{cond}", [*vals.values(), rid, *params])
+            if cur.rowcount: out["updated"].append(rid)
+            else: out["conflicts"].append(rid)
+        for row in changes.get("added_rows", []):
+            vals = {k: _clean(v) for k, v in row.items() if k in writable}
+            vals = {k: v for k, v in vals.items() if v is not None and v != ""}
+            if not vals: continue  # 編輯器裡按了新增但沒填內容
+            for k, v in (defaults or {}).items():
+                if k in writable: vals.setdefault(k, v)
+            if "id" in cols:
+                out["inserted"].append(insert_dense(db, table, vals))
+            else:
+                cur = conn.execute(f"INSERT INTO {table} ({', '.join(vals)}) VALUES ({', '.join('?' * len(vals))})", list(vals.values()))
+                out["inserted"].append(cur.lastrowid)
+    return out
+
+
+# ==========================================
+# 伺服器端分頁 (keyset on id)
+# ==========================================
+
+def _like(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def where_clause(filters=None, search="", search_cols=()):
+    """
+    篩選條件 -> (WHERE 子句, 參數)。
+    filters: {欄位: 值}，值為 list 時用 IN，空值略過；search 以空白切成多個關鍵字，
+    每個關鍵字須出現在 search_cols 任一欄 (LIKE 不分大小寫)。
+    """
+    parts, params = [], []
+    for col, val in (filters or {}).items():
+        if val is None or val == "" or val == []: continue
+        if isinstance(val, (list, tuple)):
+            parts.append(f"{col} IN ({', '.join('?' * len(val))})")
+            params.extend(val)
+        else:
+            parts.append(f"{col} = ?")
+            params.append(val)
+    for term in (search or "").split():
+        parts.append("(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in search_cols) + ")")
+        params.extend([_like(term)] * len(search_cols))
+    return (" WHERE " + " AND ".join(parts)) if parts else "", params
+
+
+def fetch_page(db, table, where="", params=(), after_id=None, page_size=50):
+    """
+    依 id 由新到舊取一頁 (keyset：id < 上一頁最後一列的 id，走主鍵，不必 OFFSET 掃過前面的列)。
+    回傳 (rows, columns, has_next)；每列開頭附上 _rowid。
+    """
+    if after_id is not None:
+        where = f"{where} AND id < ?" if where else " WHERE id < ?"
+        params = [*params, after_id]
+    cur = db.connection().execute(f"SELECT rowid AS _rowid, * FROM {table}{where} ORDER BY id DESC LIMIT ?", [*params, page_size + 1])
+    cols = [d[0] for d in cur.description]
+    rows = cur.fetchall()
+    return rows[:page_size], cols, len(rows) > page_size
+
+
+def count_rows(db, table, where="", params=()):
+    return db.query_one(f"SELECT COUNT(*) FROM {table}{where}", params)[0]
+
+
+# ==========================================
+# 表結構 (宣告結構 + 舊資料庫修復)
+# ==========================================
+
+DECLARED_SCHEMA = {
+    "sentence_pairs": ("CREATE TABLE {name} (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TIMESTAMP, "
+                       "output_sentencepattern_amis TEXT, output_sentencepattern_chinese TEXT, note TEXT)", "id"),
+    "vocabulary": ("CREATE TABLE {name} (id INTEGER PRIMARY KEY AUTOINCREMENT, amis TEXT, chinese TEXT, english TEXT, "
+                   "part_of_speech TEXT, note TEXT, created_at TIMESTAMP)", "id"),
+    "pos_tags": ("CREATE TABLE {name} (tag_name TEXT PRIMARY KEY, description TEXT, sort_order INTEGER DEFAULT 0)", "tag_name"),
+}
+
+
+def ensure_schema(conn):
+    """
+    建立缺少的表。舊版以 to_sql(replace) 儲存過的表會失去主鍵 (id 變成 REAL)：
+    依宣告結構重建並搬回資料 (多出的欄位保留)，id 依 created_at 重新連續編號。
+    觸發器與索引隨舊表刪除，由 ensure_vocab_index / FTS / 版本追蹤在下次使用時補建。回傳修復的表。
+    """
+    fixed = []
+    for table, (ddl, key) in DECLARED_SCHEMA.items():
+        info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+        if not info:
+            conn.execute(ddl.format(name=table))
+            continue
+        if any(r[1] == key and r[5] == 1 for r in info): continue
+        tmp = f"{table}__rebuild"
+        conn.execute(f"DROP TABLE IF EXISTS {tmp}")
+        conn.execute(ddl.format(name=tmp))
+        declared = table_columns(conn, tmp)
+        old = [r[1] for r in info]
+        for col in old:
+            if col not in declared: conn.execute(f'ALTER TABLE {tmp} ADD COLUMN "{col}"')
+        shared = [c for c in old if c != key or key != "id"]
+        cols = ", ".join(f'"{c}"' for c in shared)
+        if key == "id":
+            order = "created_at ASC, rowid ASC" if "created_at" in old else "rowid ASC"
+            conn.execute(f"INSERT INTO {tmp} (id, {cols}) SELECT ROW_NUMBER() OVER (ORDER BY {order}), {cols} FROM {table}")
+        else:
+            conn.execute(f"INSERT OR IGNORE INTO {tmp} ({cols}) SELECT {cols} FROM {table} WHERE {key} IS NOT NULL ORDER BY rowid")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+        fixed.append(table)
+    return fixed
+
+
+# ==========================================
+# 句型 -> 單詞庫同步 (批次)
+# ==========================================
+
+def ensure_vocab_index(conn):
+    """LOWER(amis) 運算式索引；to_sql(replace) 會連同舊表刪掉索引，所以每次同步前確認。"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vocabulary_amis_lower ON vocabulary (LOWER(amis))")
+
+
+def sentence_words(sentence):
+    return re.findall(r"\w+", (sentence or "").lower())
+
+
+def sync_vocabulary_bulk(db, sentences, chunk=500):
+    """
+    【批次同步】
+    所有句子只切詞一次並去重，以 LOWER(amis) IN (...) 走索引一次查出已存在的詞，
+    缺少的詞用一次 executemany 寫入 (同一交易、id 連續)。回傳新增的詞數。
+    """
+    first_seen = {}
+    for sentence in sentences:
+        for word in sentence_words(sentence):
+            first_seen.setdefault(word, sentence)
+    if not first_seen: return 0
+    words = list(first_seen)
+    with db.transaction() as conn:
+        ensure_vocab_index(conn)
+        existing = set()
+        for i in range(0, len(words), chunk):
+            part = words[i:i + chunk]
+            existing.update(r[0] for r in conn.execute(
+                f"SELECT LOWER(amis) FROM vocabulary WHERE LOWER(amis) IN ({', '.join('?' * len(part))})", part))
+        missing = [w for w in words if w not in existing]
+        if not missing: return 0
+        base = conn.execute("SELECT COALESCE(MAX(id), 0) FROM vocabulary").fetchone()[0]
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn.executemany("INSERT INTO vocabulary (id, amis, note, created_at) VALUES (?, ?, ?, ?)",
+                         [(base + i + 1, w, f"來自句型: {first_seen[w]}", now) for i, w in enumerate(missing)])
+        return len(missing)
+
+
+def sync_vocabulary(db, sentence):
+    """單句版本 (新增句型時使用)。"""
+    return sync_vocabulary_bulk(db, [sentence])
+
+
+# ==========================================
+# 資料版本 (異動計數器)
+# ==========================================
+
+TRACKED_TABLES = ("vocabulary", "sentence_pairs", "pos_tags")
+
+
+def _untracked_tables(conn):
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    if "table_versions" not in existing: return [t for t in TRACKED_TABLES if t in existing]
+    return [t for t in TRACKED_TABLES if t in existing and not all(f"{t}_ver_{op}" in existing for op in ("ai", "au", "ad"))]
+
+
+def ensure_change_tracking(conn):
+    """
+    table_versions 記錄每張表的異動次數，由純 SQL 觸發器在任何連線寫入時遞增。
+    to_sql(replace) 會連同舊表刪掉觸發器：偵測到遺失時重建觸發器並遞增版本 (整表已被換掉)。
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS table_versions (tbl TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    for table in _untracked_tables(conn):
+        conn.execute("INSERT OR IGNORE INTO table_versions (tbl, version) VALUES (?, 0)", (table,))
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            name = f"{table}_ver_a{op[0].lower()}"
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"CREATE TRIGGER {name} AFTER {op} ON {table} BEGIN UPDATE table_versions SET version = version + 1 WHERE tbl = '{table}'; END")
+        conn.execute("UPDATE table_versions SET version = version + 1 WHERE tbl = ?", (table,))
+
+
+def table_versions(db):
+    """{table: version}；任一表資料有變動，其版本號必定改變。觸發器齊全時只是一次唯讀查詢。"""
+    conn = db.connection()
+    if _untracked_tables(conn) or not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'table_versions'").fetchone():
+        with db.transaction() as c:
+            ensure_change_tracking(c)
+    return dict(conn.execute("SELECT tbl, version FROM table_versions").fetchall())
@@ -0,0 +1,322 @@
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+
+from amis_tm import tm_key
+
+# ==========================================
+# 近似重複偵測 (MinHash + LSH 分段)
+# ==========================================
+# 每個句型取兩側正規化鍵 (去掉空白) 的字元 gram：阿美語 3-gram、中文 2-gram，
+# 以 num_perm 個雜湊函數算 MinHash 簽章，切成 bands 段、每段 rows 個值合成一個桶鍵。
+# 兩句只要有任一段桶鍵相同就是候選，再以實際的 Jaccard 相似度確認 —— 不必兩兩比對 O(n²)。
+# 預設 16 段 × 8 列：Jaccard 0.8 的句對約 95% 會成為候選，0.3 以下幾乎不會；確認門檻預設 0.9
+# (0.8 時同一動詞的不同語法變化也常被歸成一組)。
+
+GRAMS = (("amis", 3), ("chinese", 2))
+_FNV = np.uint64(1099511628211)
+
+
+def pair_keys(amis, chinese):
+    """比對用的兩側鍵：tm_key 正規化後再去掉空白 (空白/斷詞差異不影響相似度)。"""
+    return tm_key(amis).replace(" ", ""), tm_key(chinese).replace(" ", "")
+
+
+def shingles(amis, chinese):
+    """句對的 gram 集合 (兩側各自加邊界符號，gram 前綴側別)，用來計算實際的 Jaccard。"""
+    out = set()
+    for (side, q), key in zip(GRAMS, pair_keys(amis, chinese)):
+        padded = "\x02" + key + "\x03"
+        out.update(side[0] + padded[i:i + q] for i in range(len(padded) - q + 1))
+    return out
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def _gram_hashes(keys, q, salt):
+    """一批字串的所有 q-gram 雜湊 (向量化 FNV)，回傳 (hashes, 所屬列)。"""
+    text = "\x00".join("\x02" + k + "\x03" for k in keys)
+    cp = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    row = np.repeat(np.arange(len(keys)), [len(k) + 3 for k in keys])[:len(cp)]
+    n = len(cp) - q + 1
+    if n <= 0: return np.zeros(0, np.uint64), np.zeros(0, np.int64)
+    h = np.full(n, np.uint64(salt))
+    valid = np.ones(n, dtype=bool)
+    with np.errstate(over="ignore"):
+        for j in range(q):
+            part = cp[j:j + n]
+            h = (h ^ part) * _FNV
+            valid &= part != 0
+    return h[valid], row[:n][valid]
+
+
+def _splitmix(z):
+    """splitmix64 的混合函數 (uint64 溢位即取模)：輸入差一個位元，輸出約一半位元翻轉。"""
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class MinHasher:
+    """
+    num_perm 個雜湊函數 h_i(x) = (splitmix64(x) ⊕ s_i) · m_i mod 2^64 (m_i 為奇數，種子固定、跨程序一致)：
+    gram 雜湊只混合一次，每個函數只多一次 XOR 與一次乘法。num_perm 必須是 bands 的整數倍。
+    """
+
+    def __init__(self, num_perm=128, bands=16, seed=20240501):
+        if num_perm % bands: raise ValueError("num_perm 必須是 bands 的整數倍")
+        self.num_perm, self.bands, self.rows = num_perm, bands, num_perm // bands
+        rng = np.random.default_rng(seed)
+        self.seeds = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+        self.mults = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self.mix = rng.integers(1, 1 << 63, self.rows, dtype=np.uint64) | np.uint64(1)
+
+    def band_keys(self, pairs, chunk=128):
+        """[(amis_key, chinese_key)] -> (n, bands) uint64 桶鍵。兩側都空白的列回傳全 0 (不參與比對)。"""
+        out = np.zeros((len(pairs), self.bands), dtype=np.uint64)
+        for lo in range(0, len(pairs), chunk):
+            part = pairs[lo:lo + chunk]
+            hs, rows = [], []
+            for i, (side, q) in enumerate(GRAMS):
+                h, r = _gram_hashes([p[i] for p in part], q, 14695981039346656037 + i)
+                hs.append(h)
+                rows.append(r)
+            h, r = np.concatenate(hs), np.concatenate(rows)
+            order = np.argsort(r, kind="stable")
+            h, r = h[order], r[order]
+            with np.errstate(over="ignore"):
+                # (num_perm, grams)：每個函數的值連續存放，reduceat 沿最後一軸取各列最小值
+                sig_all = (self.seeds[:, None] ^ _splitmix(h)[None, :]) * self.mults[:, None]
+                present = np.unique(r)
+                starts = np.searchsorted(r, present)
+                sig = np.minimum.reduceat(sig_all, starts, axis=1).T
+                keys = np.zeros((len(sig), self.bands), dtype=np.uint64)
+                for j in range(self.rows):
+                    keys = keys * np.uint64(31) + sig[:, j::self.rows] * self.mix[j]
+            keys[keys == 0] = 1
+            empty = np.array([not (a or c) for a, c in part])
+            keys[empty[present]] = 0
+            out[lo + present] = keys
+        return out
+
+
+# ---------- 待處理佇列與觸發器 ----------
+
+_TRIGGERS = ("sentence_pairs_dup_ai", "sentence_pairs_dup_au_id", "sentence_pairs_dup_ad")
+_LEGACY_TRIGGERS = ("sentence_pairs_dup_au",)  # 舊版的 UPDATE 觸發器沒有監看 id：換名稱讓既有資料庫重建一次
+
+
+def ensure_schema(conn):
+    """dup_pending、dup_state 與觸發器；回傳是否新建 (需要整批重算)。"""
+    conn.execute("CREATE TABLE IF NOT EXISTS dup_pending (rid INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS dup_state (name TEXT PRIMARY KEY, build TEXT, seq INTEGER NOT NULL DEFAULT 0)")
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    if all(t in existing for t in _TRIGGERS): return False
+    ai, au, ad = _TRIGGERS
+    for t in _TRIGGERS + _LEGACY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {t}")
+    conn.execute(f"CREATE TRIGGER {ai} AFTER INSERT ON sentence_pairs BEGIN INSERT OR IGNORE INTO dup_pending VALUES (NEW.rowid); END")
+    # id 是 rowid 的別名：重排編號也要重新對應
+    conn.execute(f"CREATE TRIGGER {au} AFTER UPDATE OF id, output_sentencepattern_amis, output_sentencepattern_chinese ON sentence_pairs BEGIN "
+                 f"INSERT OR IGNORE INTO dup_pending VALUES (OLD.rowid); INSERT OR IGNORE INTO dup_pending VALUES (NEW.rowid); END")
+    conn.execute(f"CREATE TRIGGER {ad} AFTER DELETE ON sentence_pairs BEGIN INSERT OR IGNORE INTO dup_pending VALUES (OLD.rowid); END")
+    return True
+
+
+class NearDuplicateIndex:
+    """
+    【近似重複索引】全程序共用，桶鍵矩陣放在記憶體 (每句 bands 個 uint64)。
+    - similar()：新句對 (尚未寫入) 的近似重複，儲存前提醒
+    - clusters()：全庫 (或只看指定列) 的近似重複群組，每個頻段排序一次找相同桶鍵，線性時間
+    - merge()：保留一句、刪除其餘，備註合併到保留的那句
+    資料庫被還原或由其他程序修改時 (dup_state 不一致) 整批重算。
+    """
+
+    def __init__(self, threshold=0.9, num_perm=128, bands=16):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, bands)
+        self._lock = threading.RLock()
+        self.state = None
+        self._reset()
+
+    def _reset(self):
+        self.keys = np.zeros((0, self.hasher.bands), dtype=np.uint64)
+        self.rids = np.zeros(0, dtype=np.int64)
+        self.row_of = {}
+
+    # ---------- 同步 ----------
+
+    def _put(self, rows):
+        """rows: [(rid, amis, chinese)]；已存在的列就地覆寫，新列追加在矩陣尾端。"""
+        if not rows: return
+        keys = self.hasher.band_keys([pair_keys(r[1], r[2]) for r in rows])
+        new = [i for i, r in enumerate(rows) if r[0] not in self.row_of]
+        for i, r in enumerate(rows):
+            if r[0] in self.row_of: self.keys[self.row_of[r[0]]] = keys[i]
+        if new:
+            base = len(self.rids)
+            self.keys = np.concatenate([self.keys, keys[new]])
+            self.rids = np.concatenate([self.rids, np.array([rows[i][0] for i in new], dtype=np.int64)])
+            for j, i in enumerate(new):
+                self.row_of[rows[i][0]] = base + j
+
+    def _drop(self, rid):
+        row = self.row_of.pop(rid, None)
+        if row is not None:
+            self.keys[row] = 0
+            self.rids[row] = -1
+
+    def _load(self, conn):
+        self._reset()
+        rows = conn.execute("SELECT rowid, output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs ORDER BY rowid").fetchall()
+        self._put(rows)
+
+    def sync(self, conn):
+        """處理 dup_pending (單一 SAVEPOINT)；快速路徑只有兩句唯讀查詢。"""
+        with self._lock:
+            try:
+                state = conn.execute(f"SELECT build, seq, (SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(_TRIGGERS))})) "
+                                     "FROM dup_state WHERE name = 'sentence_pairs'", _TRIGGERS).fetchone()
+            except sqlite3.OperationalError:
+                state = None
+            if (state is not None and state[:2] == self.state and state[2] == len(_TRIGGERS)
+                    and not conn.execute("SELECT 1 FROM dup_pending LIMIT 1").fetchone()):
+                return
+            conn.execute("SAVEPOINT dup_sync")
+            try:
+                created = ensure_schema(conn)
+                state = conn.execute("SELECT build, seq FROM dup_state WHERE name = 'sentence_pairs'").fetchone()
+                if created or state is None:
+                    conn.execute("DELETE FROM dup_pending")
+                    state = (uuid.uuid4().hex, 0)
+                    conn.execute("INSERT OR REPLACE INTO dup_state (name, build, seq) VALUES ('sentence_pairs', ?, 0)", (state[0],))
+                    self._load(conn)
+                elif tuple(state) != self.state:
+                    self._load(conn)
+                rids = [r[0] for r in conn.execute("SELECT rid FROM dup_pending")]
+                if rids:
+                    for i in range(0, len(rids), 500):
+                        chunk = rids[i:i + 500]
+                        rows = conn.execute(f"SELECT rowid, output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs "
+                                            f"WHERE rowid IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+                        alive = {r[0] for r in rows}
+                        for rid in chunk:
+                            if rid not in alive: self._drop(rid)
+                        self._put(rows)
+                    state = (state[0], state[1] + 1)
+                    conn.execute("UPDATE dup_state SET seq = ? WHERE name = 'sentence_pairs'", (state[1],))
+                    conn.execute("DELETE FROM dup_pending")
+                self.state = tuple(state)
+            except BaseException:
+                self.state = None
+                conn.execute("ROLLBACK TO dup_sync")
+                conn.execute("RELEASE dup_sync")
+                raise
+            conn.execute("RELEASE dup_sync")
+
+    # ---------- 查詢 ----------
+
+    def _rows(self, conn, rids):
+        rows = {}
+        rids = list(rids)
+        for i in range(0, len(rids), 500):
+            chunk = rids[i:i + 500]
+            for r in conn.execute(f"SELECT rowid, id, output_sentencepattern_amis, output_sentencepattern_chinese, note, created_at FROM sentence_pairs "
+                                  f"WHERE rowid IN ({', '.join('?' * len(chunk))})", chunk):
+                rows[r[0]] = {"rid": r[0], "id": r[1], "amis": r[2], "chinese": r[3], "note": r[4], "created_at": r[5]}
+        return rows
+
+    def similar(self, conn, amis, chinese, threshold=None, limit=10, exclude=None):
+        """尚未寫入的句對與既有句型的近似重複：[{"rid", "id", "amis", "chinese", "note", "jaccard"}]，由高到低。"""
+        threshold = self.threshold if threshold is None else threshold
+        keys = self.hasher.band_keys([pair_keys(amis, chinese)])[0]
+        if not keys.any(): return []
+        with self._lock:
+            hit = np.flatnonzero((self.keys == keys[None, :]).any(axis=1))
+            cand = [int(r) for r in self.rids[hit] if r >= 0 and r != exclude]
+        if not cand: return []
+        mine = shingles(amis, chinese)
+        out = []
+        for row in self._rows(conn, cand).values():
+            j = jaccard(mine, shingles(row["amis"], row["chinese"]))
+            if j >= threshold: out.append(dict(row, jaccard=round(j, 3)))
+        out.sort(key=lambda r: (-r["jaccard"], r["rid"]))
+        return out[:limit]
+
+    def clusters(self, conn, threshold=None, only=None):
+        """
+        近似重複群組：[[row, ...], ...]，每組依 id 排序，組間依大小由大到小。
+        每個頻段把桶鍵排序後取相同鍵的連續區段，區段內每列只和區段第一列驗證 (星狀)，
+        再以 union-find 合併成群組。only (rowid 集合) 有值時只回傳包含其中任一列的群組 (例如剛匯入的列)。
+        """
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            keys, rids = self.keys.copy(), self.rids.copy()
+        alive = rids >= 0
+        keys, rids = keys[alive], rids[alive]
+        pairs = set()
+        for b in range(keys.shape[1]):
+            col = keys[:, b]
+            order = np.argsort(col, kind="stable")
+            sc = col[order]
+            same = (sc[1:] == sc[:-1]) & (sc[1:] != 0)
+            if not same.any(): continue
+            # 每個相同鍵區段的第一列
+            head = np.maximum.accumulate(np.where(np.concatenate([[True], ~same]), np.arange(len(sc)), 0))
+            idx = np.flatnonzero(np.concatenate([[False], same]))
+            pairs.update(zip(rids[order[head[idx]]].tolist(), rids[order[idx]].tolist()))
+        if only is not None:
+            only = set(only)
+            pairs = {p for p in pairs if p[0] in only or p[1] in only}
+        if not pairs: return []
+        rows = self._rows(conn, {r for p in pairs for r in p})
+        cache = {}
+        def sh(rid):
+            if rid not in cache: cache[rid] = shingles(rows[rid]["amis"], rows[rid]["chinese"])
+            return cache[rid]
+        parent = {}
+        def find(x):
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+        score = {}
+        for a, b in pairs:
+            if a not in rows or b not in rows: continue
+            j = jaccard(sh(a), sh(b))
+            if j < threshold: continue
+            score[a] = max(score.get(a, 0), j)
+            score[b] = max(score.get(b, 0), j)
+            ra, rb = find(a), find(b)
+            if ra != rb: parent[max(ra, rb)] = min(ra, rb)
+        groups = {}
+        for rid in score:
+            groups.setdefault(find(rid), []).append(dict(rows[rid], jaccard=round(score[rid], 3)))
+        out = [sorted(g, key=lambda r: (r["id"] is None, r["id"], r["rid"])) for g in groups.values()]
+        out.sort(key=lambda g: (-len(g), g[0]["rid"]))
+        return out
+
+    def status(self):
+        with self._lock:
+            return {"rows": len(self.row_of), "bands": self.hasher.bands, "rows_per_band": self.hasher.rows, "threshold": self.threshold}
+
+
+def merge(db, keep_rid, drop_rids):
+    """
+    保留 keep_rid，刪除 drop_rids；被刪句子的備註 (不重複的) 併到保留句的備註後面。
+    回傳刪除的列數。(id 留下空號，由 reorder_ids 依需要重排。)
+    """
+    drop_rids = [r for r in drop_rids if r != keep_rid]
+    if not drop_rids: return 0
+    with db.transaction() as conn:
+        keep = conn.execute("SELECT note FROM sentence_pairs WHERE rowid = ?", (keep_rid,)).fetchone()
+        if keep is None: raise ValueError(f"要保留的句型 (rowid {keep_rid}) 已不存在")
+        ph = ", ".join("?" * len(drop_rids))
+        notes = [keep[0]] + [r[0] for r in conn.execute(f"SELECT note FROM sentence_pairs WHERE rowid IN ({ph}) ORDER BY rowid", drop_rids)]
+        merged = "；".join(dict.fromkeys(n.strip() for n in notes if n and n.strip())) or None
+        if merged != keep[0]: conn.execute("UPDATE sentence_pairs SET note = ? WHERE rowid = ?", (merged, keep_rid))
+        return conn.execute(f"DELETE FROM sentence_pairs WHERE rowid IN ({ph})", drop_rids).rowcount
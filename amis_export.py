@@ -0,0 +1,189 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+
+import amis_fts
+
+# ==========================================
+# 串流匯出 (游標分批讀取，只在使用者要求時產生)
+# ==========================================
+
+EXPORT_DIR = "exports"
+EXPORT_FORMATS = {"jsonl": "JSON Lines", "csv": "CSV (Excel)", "parquet": "Parquet", "arrow": "Arrow IPC"}
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+
+def peak_rss_mb():
+    """程序的常駐記憶體峰值 (MB)；平台不支援時回傳 None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1e6 if os.uname().sysname == "Darwin" else 1e3), 1)
+
+
+def _measure(stats, started, rss_before):
+    rss = peak_rss_mb()
+    stats.update(seconds=round(time.perf_counter() - started, 3), peak_rss_mb=rss,
+                 rss_growth_mb=round(rss - rss_before, 1) if rss is not None and rss_before is not None else None)
+    return stats
+
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def iter_batches(conn, sql, params=(), batch_rows=5000):
+    """逐批 (columns, rows) 讀取查詢結果；同一時間只有一批在記憶體中。"""
+    cur = conn.execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    while True:
+        rows = cur.fetchmany(batch_rows)
+        if not rows: break
+        yield cols, rows
+
+
+def _write_jsonl(f, batches):
+    n = 0
+    for cols, rows in batches:
+        f.write("".join(json.dumps(dict(zip(cols, r)), ensure_ascii=False, default=str) + "\n" for r in rows).encode("utf-8"))
+        n += len(rows)
+    return n
+
+
+def _write_csv(f, batches):
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="", write_through=True)
+    writer, n = csv.writer(text), 0
+    for cols, rows in batches:
+        if n == 0: writer.writerow(cols)
+        writer.writerows(rows)
+        n += len(rows)
+    text.detach()
+    return n
+
+
+def _write_columnar(f, batches, fmt):
+    import pyarrow as pa
+    writer, n = None, 0
+    try:
+        for cols, rows in batches:
+            # SQLite 欄位沒有固定型別 (同一欄可能混著數字與文字)，一律轉成字串以保持 schema 一致
+            data = {c: [None if r[i] is None else str(r[i]) for r in rows] for i, c in enumerate(cols)}
+            batch = pa.RecordBatch.from_pydict(data, schema=pa.schema([(c, pa.string()) for c in cols]))
+            if writer is None:
+                if fmt == "parquet":
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(f, batch.schema, compression="zstd")
+                else:
+                    writer = pa.ipc.new_file(f, batch.schema)
+            if fmt == "parquet": writer.write_batch(batch)
+            else: writer.write(batch)
+            n += len(rows)
+    finally:
+        if writer is not None: writer.close()
+    return n
+
+
+def export_query(conn, sql, fmt, path, params=(), batch_rows=5000):
+    """
+    【串流匯出】把查詢結果分批寫到 path，回傳 {path, rows, bytes, seconds, peak_rss_mb, rss_growth_mb}。
+    同一時間只有 batch_rows 列在 Python 記憶體中 (RSS 另含 SQLite mmap 讀取的頁面，上限為 mmap_size)。
+    """
+    if fmt not in EXPORT_FORMATS: raise ValueError(f"未知的匯出格式: {fmt}")
+    if fmt in COLUMNAR_FORMATS and not arrow_available(): raise RuntimeError("需要安裝 pyarrow 才能輸出 Parquet/Arrow")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    started, rss_before = time.perf_counter(), peak_rss_mb()
+    batches = iter_batches(conn, sql, params, batch_rows)
+    with open(path, "wb") as f:
+        if fmt == "jsonl": rows = _write_jsonl(f, batches)
+        elif fmt == "csv": rows = _write_csv(f, batches)
+        else: rows = _write_columnar(f, batches, fmt)
+    return _measure({"path": path, "rows": rows, "bytes": os.path.getsize(path)}, started, rss_before)
+
+
+def export_table(db, table, fmt, stem=None, root=EXPORT_DIR, batch_rows=5000):
+    path = os.path.join(root, f"{stem or table}.{fmt}")
+    order = " ORDER BY id" if any(r[1] == "id" for r in db.connection().execute(f"PRAGMA table_info({table})")) else ""
+    return export_query(db.connection(), f"SELECT * FROM {table}{order}", fmt, path, batch_rows=batch_rows)
+
+
+# ==========================================
+# 微調資料集 (指令/回應對 + 決定性切分)
+# ==========================================
+
+SENTENCE_TEMPLATES = (
+    ("a2z", "請將以下阿美語句子翻譯成中文：\n{amis}", "{chinese}"),
+    ("z2a", "請將以下中文句子翻譯成阿美語：\n{chinese}", "{amis}"),
+)
+VOCAB_TEMPLATE = ("gloss", "阿美語單詞「{amis}」是什麼意思？", "{gloss}")
+
+
+def _clean(text):
+    return " ".join(str(text).split()) if text is not None else ""
+
+
+def split_bucket(source_key, val_ratio, seed="amis-ft"):
+    """
+    以來源文字 (正規化阿美語) 的雜湊決定 train / validation：同一資料庫內容每次切分都一樣，
+    同一句的兩個翻譯方向必定落在同一邊，驗證集不會洩漏訓練內容。
+    """
+    h = int.from_bytes(hashlib.sha256(f"{seed}\0{source_key}".encode("utf-8")).digest()[:8], "big")
+    return "validation" if h / 2 ** 64 < val_ratio else "train"
+
+
+def iter_examples(conn, include_vocab=True, batch_rows=5000):
+    """產生 (source_key, example)；example 為 {instruction, response, task}。"""
+    sql = "SELECT output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs ORDER BY id"
+    for _, rows in iter_batches(conn, sql, batch_rows=batch_rows):
+        for amis, chinese in rows:
+            amis, chinese = _clean(amis), _clean(chinese)
+            if not amis or not chinese: continue
+            key = amis_fts.normalize_text(amis).rstrip(".?!。？！ ")
+            for task, ins, resp in SENTENCE_TEMPLATES:
+                yield key, {"instruction": ins.format(amis=amis, chinese=chinese), "response": resp.format(amis=amis, chinese=chinese), "task": task}
+    if not include_vocab: return
+    sql = "SELECT amis, chinese, part_of_speech, note FROM vocabulary ORDER BY id"
+    task, ins, resp = VOCAB_TEMPLATE
+    for _, rows in iter_batches(conn, sql, batch_rows=batch_rows):
+        for amis, chinese, pos, note in rows:
+            amis, chinese = _clean(amis), _clean(chinese)
+            if not amis or not chinese: continue  # 自動同步進來、還沒有中文的詞不收
+            gloss = chinese + (f" ({_clean(pos)})" if _clean(pos) else "") + (f"；{_clean(note)}" if _clean(note) and not _clean(note).startswith("來自句型") else "")
+            yield amis_fts.normalize_text(amis), {"instruction": ins.format(amis=amis), "response": resp.format(gloss=gloss), "task": task}
+
+
+def build_finetune_dataset(db, out_dir=EXPORT_DIR, val_ratio=0.1, seed="amis-ft", include_vocab=True):
+    """
+    寫出 finetune_train.jsonl / finetune_validation.jsonl。
+    去重以 (正規化指令, 正規化回應) 的 16 位元組摘要判斷，記憶體只隨不重複的筆數成長。
+    回傳 {train, validation, duplicates, by_task, paths, seconds, peak_rss_mb, rss_growth_mb}。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    started, rss_before = time.perf_counter(), peak_rss_mb()
+    paths = {s: os.path.join(out_dir, f"finetune_{s}.jsonl") for s in ("train", "validation")}
+    stats = {"train": 0, "validation": 0, "duplicates": 0, "by_task": {}}
+    seen = set()
+    files = {s: open(p, "w", encoding="utf-8") for s, p in paths.items()}
+    try:
+        for key, ex in iter_examples(db.connection(), include_vocab):
+            digest = hashlib.blake2b(f"{amis_fts.normalize_text(ex['instruction'])}\0{amis_fts.normalize_text(ex['response'])}".encode("utf-8"), digest_size=16).digest()
+            if digest in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(digest)
+            split = split_bucket(key, val_ratio, seed)
+            files[split].write(json.dumps(ex, ensure_ascii=False) + "\n")
+            stats[split] += 1
+            stats["by_task"][ex["task"]] = stats["by_task"].get(ex["task"], 0) + 1
+    finally:
+        for f in files.values(): f.close()
+    stats["paths"] = paths
+    return _measure(stats, started, rss_before)
@@ -0,0 +1,190 @@
+import re
+import sqlite3
+import unicodedata
+
+# ==========================================
+# FTS5 全文檢索 (中文雙字元切分 + 阿美語喉塞音詞元)
+# ==========================================
+# SQLite 的 Python 介面無法註冊自訂 FTS5 tokenizer，
+# 因此在 Python 端先切好詞元 (以空白分隔) 再寫入影子表，
+# 影子表本身只用 unicode61 依空白切分，並把 ' 與 ^ 視為字元。
+
+FTS_TABLES = {
+    "vocabulary": ("vocabulary_fts", ("amis", "chinese", "note"), ("amis", "chinese", "part_of_speech", "note")),
+    "sentence_pairs": ("sentence_pairs_fts", ("output_sentencepattern_amis", "output_sentencepattern_chinese", "note"),
+                       ("output_sentencepattern_amis", "output_sentencepattern_chinese", "note")),
+}
+# 影子表欄位名稱 (縮短以便撰寫 MATCH 條件)
+FTS_COLUMNS = {"vocabulary": ("amis", "chinese", "note"), "sentence_pairs": ("amis", "chinese", "note")}
+
+# 各種喉塞音/撇號寫法統一為 '
+APOSTROPHES = "'’‘ʼ`´ʻ"
+_APOS_RE = re.compile(f"[{APOSTROPHES}]")
+_HAN_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_AMIS_RE = re.compile(r"[0-9a-zÀ-ɏ'^]+")
+
+
+def normalize_text(text):
+    """NFC + 小寫 + 撇號統一。"""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return _APOS_RE.sub("'", text)
+
+
+def han_grams(run):
+    """中文連續字串 -> 單字 + 重疊雙字 (bigram)。"""
+    grams = list(run)
+    grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return grams
+
+
+def amis_tokens(text):
+    """
+    阿美語詞元：連字號視為詞素邊界 (Mi-'isal -> mi, 'isal)，
+    保留詞首/詞尾的喉塞音，並另外輸出去除撇號的寫法以容忍省略喉塞音的輸入。
+    """
+    out = []
+    for tok in _AMIS_RE.findall(_HAN_RE.sub(" ", normalize_text(text))):
+        if not tok.strip("'^"): continue
+        out.append(tok)
+        bare = tok.replace("'", "")
+        if bare and bare != tok: out.append(bare)
+    return out
+
+
+def tokenize(text):
+    """寫入影子表用的詞元 (中文 bigram + 阿美語詞元)。"""
+    norm = normalize_text(text)
+    toks = amis_tokens(norm)
+    for run in _HAN_RE.findall(norm):
+        toks.extend(han_grams(run))
+    return toks
+
+
+def _quote(tok):
+    return '"' + tok.replace('"', '""') + '"'
+
+
+def match_expr(text, prefix=True):
+    """
+    將查詢字串轉成 FTS5 MATCH 運算式 (各詞元以 OR 連接，由 bm25 排序)。
+    長度 >= 3 的阿美語詞元使用前綴比對，對應原本 LIKE '%w%' 的容錯度。
+    """
+    norm = normalize_text(text)
+    terms = []
+    for tok in amis_tokens(norm):
+        terms.append(_quote(tok) + ("*" if prefix and len(tok) >= 3 else ""))
+    for run in _HAN_RE.findall(norm):
+        terms.extend(_quote(g) for g in han_grams(run))
+    terms = list(dict.fromkeys(terms))
+    return " OR ".join(terms)
+
+
+def is_available():
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+FTS5_AVAILABLE = is_available()
+
+# ---------- 影子表結構與觸發器 ----------
+
+def _trigger_names(table):
+    return [f"{table}_fts_ai", f"{table}_fts_au", f"{table}_fts_ad"]
+
+
+def ensure_schema(conn):
+    """
+    建立影子表、待同步佇列與觸發器。
+    觸發器只記錄異動的 rowid (純 SQL，任何連線寫入皆可觸發)，由 sync() 在 Python 端切詞後寫入。
+    回傳需要整表重建的表 (新建或觸發器遺失，例如被 to_sql(replace) 連同舊表刪除)。
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS fts_pending (tbl TEXT NOT NULL, rid INTEGER NOT NULL, PRIMARY KEY (tbl, rid)) WITHOUT ROWID")
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    rebuild = []
+    for table, (fts, _, _) in FTS_TABLES.items():
+        if table not in existing: continue
+        if fts not in existing:
+            cols = ", ".join(FTS_COLUMNS[table])
+            conn.execute(f"""CREATE VIRTUAL TABLE {fts} USING fts5({cols}, tokenize="unicode61 remove_diacritics 0 tokenchars '''^'")""")
+        if not all(t in existing for t in _trigger_names(table)) or fts not in existing:
+            ai, au, ad = _trigger_names(table)
+            conn.execute(f"DROP TRIGGER IF EXISTS {ai}")
+            conn.execute(f"DROP TRIGGER IF EXISTS {au}")
+            conn.execute(f"DROP TRIGGER IF EXISTS {ad}")
+            conn.execute(f"CREATE TRIGGER {ai} AFTER INSERT ON {table} BEGIN INSERT OR IGNORE INTO fts_pending VALUES ('{table}', NEW.rowid); END")
+            conn.execute(f"CREATE TRIGGER {au} AFTER UPDATE ON {table} BEGIN INSERT OR IGNORE INTO fts_pending VALUES ('{table}', OLD.rowid); INSERT OR IGNORE INTO fts_pending VALUES ('{table}', NEW.rowid); END")
+            conn.execute(f"CREATE TRIGGER {ad} AFTER DELETE ON {table} BEGIN INSERT OR IGNORE INTO fts_pending VALUES ('{table}', OLD.rowid); END")
+            rebuild.append(table)
+    return rebuild
+
+
+def _row_tokens(values):
+    return [" ".join(tokenize(v)) if isinstance(v, str) else "" for v in values]
+
+
+def rebuild(conn, table):
+    fts, src_cols, _ = FTS_TABLES[table]
+    conn.execute(f"DELETE FROM {fts}")
+    conn.execute("DELETE FROM fts_pending WHERE tbl = ?", (table,))
+    cur = conn.execute(f"SELECT rowid, {', '.join(src_cols)} FROM {table}")
+    ph = ", ".join("?" * (len(src_cols) + 1))
+    while True:
+        batch = cur.fetchmany(1000)
+        if not batch: break
+        conn.executemany(f"INSERT INTO {fts} (rowid, {', '.join(FTS_COLUMNS[table])}) VALUES ({ph})",
+                         [(r[0], *_row_tokens(r[1:])) for r in batch])
+
+
+def ready(conn):
+    """影子表與觸發器都在 (唯讀檢查)：可以直接查詢，只是可能還有尚未寫入影子表的異動。"""
+    if not FTS5_AVAILABLE: return False
+    names = [n for table, (fts, _, _) in FTS_TABLES.items() for n in (fts, *_trigger_names(table))]
+    return conn.execute(f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join('?' * len(names))})", names).fetchone()[0] == len(names)
+
+
+def sync(conn):
+    """
+    確保結構存在並把 fts_pending 中的異動寫入影子表 (單一 SAVEPOINT，可巢狀於外部交易)。
+    會寫入資料庫：只在寫入執行緒上呼叫 (amis_retrieval.maintain)，查詢端用 ready() 判斷。
+    """
+    if not FTS5_AVAILABLE: return False
+    conn.execute("SAVEPOINT fts_sync")
+    try:
+        for table in ensure_schema(conn):
+            rebuild(conn, table)
+        pending = conn.execute("SELECT tbl, rid FROM fts_pending").fetchall()
+        for table, (fts, src_cols, _) in FTS_TABLES.items():
+            rids = [rid for tbl, rid in pending if tbl == table]
+            if not rids: continue
+            conn.executemany(f"DELETE FROM {fts} WHERE rowid = ?", [(r,) for r in rids])
+            ph = ", ".join("?" * (len(src_cols) + 1))
+            for i in range(0, len(rids), 500):
+                chunk = rids[i:i + 500]
+                rows = conn.execute(f"SELECT rowid, {', '.join(src_cols)} FROM {table} WHERE rowid IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+                conn.executemany(f"INSERT INTO {fts} (rowid, {', '.join(FTS_COLUMNS[table])}) VALUES ({ph})",
+                                 [(r[0], *_row_tokens(r[1:])) for r in rows])
+        if pending: conn.execute("DELETE FROM fts_pending")
+    except BaseException:
+        conn.execute("ROLLBACK TO fts_sync")
+        conn.execute("RELEASE fts_sync")
+        raise
+    conn.execute("RELEASE fts_sync")
+    return True
+
+
+def search(conn, table, column, text, limit=20, prefix=True, with_score=False):
+    """
+    BM25 排序的全文檢索。column 為影子表欄位 (amis/chinese/note)，None 表示全部欄位。
+    回傳 (rowid, *FTS_TABLES[table][2]) 列，最相關者在前；with_score=True 時最後附上 bm25 分數 (越小越相關)。
+    """
+    expr = match_expr(text, prefix=prefix)
+    if not expr: return []
+    fts, _, out_cols = FTS_TABLES[table]
+    sel = ", ".join(f"b.{c}" for c in out_cols)
+    score = f", bm25({fts})" if with_score else ""
+    sql = (f"SELECT b.rowid, {sel}{score} FROM {fts} f JOIN {table} b ON b.rowid = f.rowid "
+           f"WHERE {fts} MATCH ? ORDER BY bm25({fts}) LIMIT ?")
+    return conn.execute(sql, (f"{column} : ({expr})" if column else expr, limit)).fetchall()
@@ -0,0 +1,238 @@
+import csv
+import io
+import re
+import uuid
+from datetime import datetime
+
+import amis_db
+import amis_fts
+
+# ==========================================
+# 串流 CSV 匯入 (分塊驗證 + 批次交易 + 追加/合併/取代)
+# ==========================================
+
+IMPORT_SPECS = {
+    "sentence_pairs": {
+        "key": "output_sentencepattern_amis",
+        "required": ("output_sentencepattern_amis", "output_sentencepattern_chinese"),
+        "non_empty": ("output_sentencepattern_amis", "output_sentencepattern_chinese"),
+        "columns": ("output_sentencepattern_amis", "output_sentencepattern_chinese", "note", "created_at"),
+    },
+    "vocabulary": {
+        "key": "amis",
+        "required": ("amis", "chinese", "part_of_speech"),
+        "non_empty": ("amis",),
+        "columns": ("amis", "chinese", "english", "part_of_speech", "note", "created_at"),
+    },
+}
+MODES = ("append", "upsert", "replace")
+MAX_FIELD_CHARS = 5000
+
+
+def normalize_key(text):
+    """合併用的鍵：NFC、小寫、撇號統一、壓縮空白並去掉句尾標點 (Mi'isal. == mi’isal)。"""
+    text = re.sub(r"\s+", " ", amis_fts.normalize_text(text)).strip()
+    return text.rstrip(".?!。？！ ")
+
+
+def open_csv(fileobj):
+    """以 csv 模組逐列讀取 (不把整個檔案載入記憶體) 的 DictReader；fieldnames 為表頭 (空檔案為 None)。"""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="") if not isinstance(fileobj, io.TextIOBase) else fileobj
+    return csv.DictReader(text)
+
+
+def iter_chunks(reader, chunk_rows=5000):
+    """每 chunk_rows 列輸出一次 (起始行號, [dict])。"""
+    chunk, start = [], 2
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield start, chunk
+            start += len(chunk)
+            chunk = []
+    if chunk: yield start, chunk
+
+
+def check_header(fieldnames, table):
+    missing = [c for c in IMPORT_SPECS[table]["required"] if c not in (fieldnames or [])]
+    if missing: raise ValueError(f"CSV 缺少必要欄位: {missing}")
+
+
+def validate_row(row, spec, now):
+    """回傳 (record, None) 或 (None, 拒絕原因)。"""
+    if None in row: return None, "欄位數多於表頭"
+    rec = {}
+    for col in spec["columns"]:
+        val = row.get(col)
+        val = val.strip() if isinstance(val, str) else None
+        if val and len(val) > MAX_FIELD_CHARS: return None, f"{col} 超過 {MAX_FIELD_CHARS} 字"
+        rec[col] = val or None
+    for col in spec["non_empty"]:
+        if not rec[col]: return None, f"{col} 為空"
+    rec["created_at"] = rec["created_at"] or now
+    return rec, None
+
+WORK_PREFIX = "import_work_"  # 匯入用的鍵表 / 暫存表名稱前綴
+
+
+def drop_leftovers(conn):
+    """刪除程序中斷時沒被 finally 清掉的匯入暫存表 (啟動時、尚無匯入進行中呼叫)。回傳刪除的數量。"""
+    names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ?",
+                                        (len(WORK_PREFIX), WORK_PREFIX))]
+    for name in names: conn.execute(f"DROP TABLE IF EXISTS {name}")
+    return len(names)
+
+
+class CsvImporter:
+    """
+    【串流匯入】
+    - append：全部新增
+    - upsert：以正規化阿美語 (normalize_key) 比對，已存在就更新有填值的欄位，否則新增
+    - replace：所有分塊先驗證並寫進暫存表，全部合格後才以一個短交易清空原表、從暫存表整批搬入；
+      只要有任何一列被拒絕或發生錯誤，原表完全不動
+    append / upsert 每個分塊一個交易 (中途失敗時，已完成的分塊保留)。
+    合併用的鍵表與取代用的暫存表是主資料庫裡的一般表 (每次匯入一個名稱，結束時在 finally 刪除)：
+    資料寫在磁碟上，不放進 temp_store=MEMORY 的 TEMP 表，記憶體用量與檔案大小無關。
+    runner：執行寫入的函式 (例如 WriteQueue.call)；每個分塊各排一次短工作，讀檔與驗證留在呼叫端執行緒。
+    """
+
+    def __init__(self, db, table, mode="append", chunk_rows=5000, max_rejects=1000, sync_vocab=True, runner=None):
+        if mode not in MODES: raise ValueError(f"未知的匯入模式: {mode}")
+        self.db, self.table, self.mode = db, table, mode
+        self.runner = runner
+        tag = uuid.uuid4().hex[:8]  # 同時進行的匯入各用各的暫存表
+        self.keys_table, self.stage_table = f"{WORK_PREFIX}keys_{tag}", f"{WORK_PREFIX}stage_{tag}"
+        self.spec = IMPORT_SPECS[table]
+        self.chunk_rows, self.max_rejects = chunk_rows, max_rejects
+        self.sync_vocab = sync_vocab and table == "sentence_pairs"
+        self.stats = {"read": 0, "inserted": 0, "updated": 0, "rejected": 0, "new_words": 0, "rolled_back": False}
+        self.rejects = []
+
+    def _reject(self, line, reason, row):
+        self.stats["rejected"] += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append({"line": line, "reason": reason, **{k: v for k, v in row.items() if k is not None}})
+
+    def _load_keys(self, conn):
+        conn.execute(f"DROP TABLE IF EXISTS {self.keys_table}")
+        conn.execute(f"CREATE TABLE {self.keys_table} (k TEXT PRIMARY KEY, rid INTEGER) WITHOUT ROWID")
+        cur = conn.execute(f"SELECT rowid, {self.spec['key']} FROM {self.table} ORDER BY rowid")
+        while True:
+            batch = cur.fetchmany(5000)
+            if not batch: break
+            conn.executemany(f"INSERT OR IGNORE INTO {self.keys_table} VALUES (?, ?)",
+                             [(normalize_key(v), rid) for rid, v in batch if v])
+
+    def _create_stage(self):
+        conn = self.db.connection()
+        conn.execute(f"DROP TABLE IF EXISTS {self.stage_table}")
+        conn.execute(f"CREATE TABLE {self.stage_table} ({', '.join(self.spec['columns'])})")
+
+    def _swap(self):
+        """取代模式唯一一個寫入原表的工作：清空後從暫存表依匯入順序整批搬入。"""
+        cols = ", ".join(self.spec["columns"])
+        with self.db.transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone():
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (self.table,))
+            conn.execute(f"INSERT INTO {self.table} ({cols}) SELECT {cols} FROM {self.stage_table} ORDER BY rowid")
+
+    def _staged_keys(self, after, limit):
+        """暫存表 rowid > after 的 (rowid, 阿美語句子)，供換入後分塊同步單詞。"""
+        return self.db.connection().execute(f"SELECT rowid, output_sentencepattern_amis FROM {self.stage_table} "
+                                            f"WHERE rowid > ? ORDER BY rowid LIMIT ?", (after, limit)).fetchall()
+
+    def _write(self, conn, records):
+        cols = self.spec["columns"]
+        target = self.stage_table if self.mode == "replace" else self.table
+        insert_sql = f"INSERT INTO {target} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        if self.mode != "upsert":
+            conn.executemany(insert_sql, [[r[c] for c in cols] for r in records])
+            self.stats["inserted"] += len(records)
+            return
+        for rec in records:
+            key = normalize_key(rec[self.spec["key"]])
+            hit = conn.execute(f"SELECT rid FROM {self.keys_table} WHERE k = ?", (key,)).fetchone()
+            if hit:
+                # 只覆寫有填值的欄位，空白儲存格不會清掉既有資料；created_at 保留原值
+                vals = {c: rec[c] for c in cols if rec[c] is not None and c != "created_at"}
+                conn.execute(f"UPDATE {self.table} SET {', '.join(f'{c} = ?' for c in vals)} WHERE rowid = ?", [*vals.values(), hit[0]])
+                self.stats["updated"] += 1
+            else:
+                rid = conn.execute(insert_sql, [rec[c] for c in cols]).lastrowid
+                conn.execute(f"INSERT INTO {self.keys_table} VALUES (?, ?)", (key, rid))
+                self.stats["inserted"] += 1
+
+    def _validate(self, start, rows, now):
+        """在呼叫端執行緒驗證一個分塊，回傳合格的 records。"""
+        self.stats["read"] += len(rows)
+        good = []
+        for i, row in enumerate(rows):
+            rec, reason = validate_row(row, self.spec, now)
+            if reason: self._reject(start + i, reason, row)
+            else: good.append(rec)
+        if self.mode == "replace" and self.stats["rejected"]:
+            raise ValueError(f"第 {self.rejects[0]['line']} 行被拒絕 ({self.rejects[0]['reason']})，取代模式不做部分匯入")
+        return good
+
+    def _store(self, conn, records):
+        self._write(conn, records)
+        if self.sync_vocab and self.mode != "replace":
+            self.stats["new_words"] += amis_db.sync_vocabulary_bulk(self.db, [r["output_sentencepattern_amis"] for r in records])
+
+    def run(self, fileobj, on_progress=None):
+        """on_progress(stats) 於每個分塊寫入 (取代模式為寫進暫存表) 後呼叫。回傳 stats。"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        reader = open_csv(fileobj)
+        check_header(reader.fieldnames, self.table)  # 只有表頭 (沒有資料列) 的檔案也要先檢查欄位
+        chunks = iter_chunks(reader, self.chunk_rows)
+        if self.mode == "replace": return self._replace(chunks, now, on_progress)
+        if self.mode == "upsert":
+            self._run_write(self._in_transaction, self._load_keys)
+        try:
+            for start, rows in chunks:
+                good = self._validate(start, rows, now)
+                if good: self._run_write(self._in_transaction, self._store, good)
+                if on_progress: on_progress(self.stats)
+        finally:
+            if self.mode == "upsert": self._run_write(self._drop, self.keys_table)
+        return self.stats
+
+    def _replace(self, chunks, now, on_progress):
+        """驗證並暫存所有分塊 (每塊一個短工作，不碰原表)，全部合格才以一個工作整批換入。"""
+        self._run_write(self._create_stage)
+        try:
+            try:
+                for start, rows in chunks:
+                    good = self._validate(start, rows, now)
+                    if good: self._run_write(self._in_transaction, self._write, good)
+                    if on_progress: on_progress(self.stats)
+                if not self.stats["read"]: return self.stats  # 只有表頭的檔案不清空原表
+                self._run_write(self._swap)
+            except Exception:
+                self.stats["rolled_back"] = True
+                raise
+            if self.sync_vocab: self._sync_staged()
+        finally:
+            self._run_write(self._drop, self.stage_table)
+        return self.stats
+
+    def _sync_staged(self):
+        """單詞同步只會新增缺少的詞：換入之後才分塊進行 (每塊一個工作)，不拉長換入的交易。"""
+        after = 0
+        while True:
+            batch = self._run_write(self._staged_keys, after, self.chunk_rows)
+            if not batch: break
+            after = batch[-1][0]
+            self.stats["new_words"] += self._run_write(amis_db.sync_vocabulary_bulk, self.db, [r[1] for r in batch])
+
+    def _in_transaction(self, fn, *args):
+        with self.db.transaction() as conn:
+            return fn(conn, *args)
+
+    def _drop(self, name):
+        self.db.connection().execute(f"DROP TABLE IF EXISTS {name}")
+
+    def _run_write(self, fn, *args):
+        """直接執行 fn(*args)，或交給 runner (例如 WriteQueue.call，在寫入執行緒上執行)。"""
+        return fn(*args) if self.runner is None else self.runner(fn, *args)
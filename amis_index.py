@@ -0,0 +1,148 @@
+import threading
+from collections import defaultdict
+
+# ==========================================
+# 記憶體倒排索引 (取代逐字 LIKE '%w%' 全表掃描)
+# ==========================================
+
+# 每張表要建索引的欄位 (依 SELECT 順序，rowid 另外保存)
+INDEXED_FIELDS = {
+    "vocabulary": ("amis", "chinese", "part_of_speech", "note"),
+    "sentence_pairs": ("output_sentencepattern_amis", "output_sentencepattern_chinese", "note"),
+}
+SEARCHABLE_FIELDS = {
+    "vocabulary": ("amis", "chinese", "note"),
+    "sentence_pairs": ("output_sentencepattern_amis", "output_sentencepattern_chinese"),
+}
+
+
+def _grams(text):
+    """單字元 + 雙字元 gram，足以回答任意長度的子字串查詢。"""
+    gs = set(text)
+    gs.update(text[i:i + 2] for i in range(len(text) - 1))
+    return gs
+
+
+class CorpusIndex:
+    """
+    【倒排索引】
+    以 rowid 為鍵，將單詞與句型欄位拆成 1/2-gram posting list。
+    子字串查詢 = posting 交集 + 實際比對，結果依 rowid 排序 (與 SQLite LIKE 無 ORDER BY 時一致)。
+    比對一律轉小寫 (對應 SQLite LIKE 不分大小寫)。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rows = {t: {} for t in INDEXED_FIELDS}
+        self._lower = {t: {} for t in INDEXED_FIELDS}
+        self._postings = {t: {f: defaultdict(set) for f in SEARCHABLE_FIELDS[t]} for t in INDEXED_FIELDS}
+        self._max_rowid = {t: 0 for t in INDEXED_FIELDS}
+        self._versions = {t: None for t in INDEXED_FIELDS}
+        self._dirty = set(INDEXED_FIELDS)
+
+    # ---------- 維護 ----------
+
+    def invalidate(self, table=None):
+        """整表重寫 (data_editor 儲存、CSV 匯入、資料庫還原) 後呼叫，下次 refresh 會重建。"""
+        with self._lock:
+            self._dirty.update([table] if table else INDEXED_FIELDS)
+
+    def refresh(self, fetch, versions=None):
+        """
+        fetch(sql, params) -> rows；versions：amis_db.table_versions() 的 {table: 異動次數}。
+        版本沒變的表不再查詢。觸發器每異動一列遞增一次，所以版本增加量剛好等於新追加的列數 (且筆數對得上)
+        時只追加 rowid 大於已知最大值的新列；其他情況 (任何連線/程序就地 UPDATE、刪除、整表換掉) 整表重建。
+        沒有 versions 時退回比對 COUNT/MAX(rowid) (偵測不到就地修改)。
+        """
+        with self._lock:
+            for table, fields in INDEXED_FIELDS.items():
+                version = versions.get(table) if versions is not None else None
+                if table not in self._dirty:
+                    known = self._versions[table]
+                    if version is not None and version == known: continue
+                    stat = fetch(f"SELECT COUNT(*), MAX(rowid) FROM {table}", ())
+                    count, max_rowid = stat[0] if stat else (0, None)
+                    if version is None and count == len(self._rows[table]) and (max_rowid or 0) == self._max_rowid[table]:
+                        continue
+                    appended = self._count_after(fetch, table)
+                    if count != len(self._rows[table]) + appended or (version is not None and (known is None or version - known != appended)):
+                        self._dirty.add(table)
+                if table in self._dirty:
+                    self._clear(table)
+                cols = ", ".join(fields)
+                new_rows = fetch(f"SELECT rowid, {cols} FROM {table} WHERE rowid > ? ORDER BY rowid", (self._max_rowid[table],))
+                for r in new_rows:
+                    self._add(table, r[0], r[1:])
+                self._versions[table] = version
+                self._dirty.discard(table)
+
+    def _count_after(self, fetch, table):
+        res = fetch(f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (self._max_rowid[table],))
+        return res[0][0] if res else 0
+
+    def _clear(self, table):
+        self._rows[table].clear()
+        self._lower[table].clear()
+        for p in self._postings[table].values():
+            p.clear()
+        self._max_rowid[table] = 0
+
+    def _add(self, table, rowid, values):
+        fields = INDEXED_FIELDS[table]
+        record = dict(zip(fields, values))
+        self._rows[table][rowid] = values
+        lowered = {}
+        for f in SEARCHABLE_FIELDS[table]:
+            text = (record[f] or "").lower() if isinstance(record[f], str) else ""
+            lowered[f] = text
+            for g in _grams(text):
+                self._postings[table][f][g].add(rowid)
+        self._lower[table][rowid] = lowered
+        if rowid > self._max_rowid[table]:
+            self._max_rowid[table] = rowid
+
+    def upsert(self, table, rowid, values):
+        """單列新增或修改 (values 依 INDEXED_FIELDS 順序)。"""
+        with self._lock:
+            self.remove(table, rowid)
+            self._add(table, rowid, tuple(values))
+
+    def remove(self, table, rowid):
+        with self._lock:
+            lowered = self._lower[table].pop(rowid, None)
+            if lowered is None: return
+            self._rows[table].pop(rowid, None)
+            for f, text in lowered.items():
+                for g in _grams(text):
+                    s = self._postings[table][f].get(g)
+                    if s is not None:
+                        s.discard(rowid)
+                        if not s: del self._postings[table][f][g]
+
+    # ---------- 查詢 ----------
+
+    def contains(self, table, field, needle, limit=None):
+        """等同 `WHERE LOWER(field) LIKE '%needle%' LIMIT n`，回傳 (rowid, *INDEXED_FIELDS) 列。"""
+        needle = (needle or "").lower()
+        if not needle: return []
+        with self._lock:
+            postings = self._postings[table][field]
+            keys = {needle} if len(needle) == 1 else {needle[i:i + 2] for i in range(len(needle) - 1)}
+            sets = [postings.get(k) for k in keys]
+            if not all(sets): return []
+            sets.sort(key=len)
+            cands = set(sets[0])
+            for s in sets[1:]:
+                cands &= s
+                if not cands: return []
+            out = []
+            lower, rows = self._lower[table], self._rows[table]
+            for rid in sorted(cands):
+                if len(needle) > 2 and needle not in lower[rid][field]: continue
+                out.append((rid,) + tuple(rows[rid]))
+                if limit and len(out) >= limit: break
+            return out
+
+    def stats(self):
+        with self._lock:
+            return {t: len(r) for t, r in self._rows.items()}
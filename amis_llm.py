@@ -0,0 +1,446 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from amis_context import estimate_tokens
+from amis_db import Database
+
+# ==========================================
+# LLM 回應快取 (模型 + 提示詞雜湊)
+# ==========================================
+
+
+def normalize_prompt(prompt):
+    """NFC、去除每行首尾空白並壓縮連續空白，讓排版差異不影響快取命中。"""
+    text = unicodedata.normalize("NFC", prompt or "")
+    lines = [re.sub(r"[ \t　]+", " ", l).strip() for l in text.splitlines()]
+    return "\n".join(l for l in lines if l)
+
+
+def prompt_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    【持久化回應快取】
+    存在獨立的 SQLite 檔 (不隨 amis_data.db 備份上傳)。
+    - 鍵：模型名稱 + 正規化提示詞的 SHA-256
+    - 失效：超過 TTL、或語料版本 (corpus_version) 與寫入時不同
+    - 淘汰：超過 max_entries 時刪除最久未使用 (LRU) 的項目
+    """
+
+    def __init__(self, path="amis_cache.db", max_entries=2000, ttl_seconds=7 * 24 * 3600):
+        self.db = Database(path)
+        self.max_entries, self.ttl = max_entries, ttl_seconds
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "writes": 0}
+        with self.db.transaction() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY, model TEXT, corpus_version TEXT, response TEXT,
+                created_at REAL, last_used REAL, hits INTEGER DEFAULT 0)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def get(self, model_name, prompt, corpus_version=""):
+        key = prompt_key(model_name, prompt)
+        row = self.db.query_one("SELECT response, corpus_version, created_at FROM llm_cache WHERE key = ?", (key,))
+        now = time.time()
+        if row is None:
+            self._count("misses")
+            return None
+        if row[1] != str(corpus_version) or now - row[2] > self.ttl:
+            self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._count("stale")
+            self._count("misses")
+            return None
+        self.db.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self._count("hits")
+        return row[0]
+
+    def put(self, model_name, prompt, response, corpus_version=""):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache (key, model, corpus_version, response, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+                         (prompt_key(model_name, prompt), model_name, str(corpus_version), response, now, now))
+            over = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if over > 0:
+                conn.execute("DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used ASC LIMIT ?)", (over,))
+                self._count("evictions", over)
+        self._count("writes")
+
+    def purge_expired(self):
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+
+    def clear(self):
+        self.db.execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+        size = self.db.query_one("SELECT COUNT(*), COALESCE(SUM(LENGTH(response)), 0) FROM llm_cache")
+        lookups = out["hits"] + out["misses"]
+        out.update(entries=size[0], chars=size[1], hit_rate=round(out["hits"] / lookups, 3) if lookups else 0.0)
+        return out
+
+
+# ==========================================
+# 共用限流排程器 (取代 429 時固定 sleep 60 秒)
+# ==========================================
+
+# 各模型家族的預設上限 (每分鐘請求數, 每分鐘 token 數)；可由呼叫端覆寫
+MODEL_LIMITS = {"flash": (15, 1_000_000), "pro": (2, 32_000)}
+DEFAULT_LIMITS = (10, 250_000)
+
+
+def limits_for(model_name):
+    for family, limits in MODEL_LIMITS.items():
+        if family in (model_name or ""): return limits
+    return DEFAULT_LIMITS
+
+
+class RateLimitExceeded(RuntimeError):
+    """重試預算用完仍被限流。"""
+
+
+def is_rate_limited(exc):
+    name = type(exc).__name__
+    return "429" in str(exc) or name in ("ResourceExhausted", "TooManyRequests") or getattr(exc, "code", None) == 429
+
+
+_RETRY_PATTERNS = (
+    re.compile(r"retry[_ ]delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)", re.I),
+    re.compile(r"retry in\s*(\d+(?:\.\d+)?)\s*s", re.I),
+    re.compile(r"retry-after:?\s*(\d+(?:\.\d+)?)", re.I),
+)
+
+
+def retry_after_hint(exc):
+    """從例外取出伺服器建議的等待秒數 (retry_after 屬性或錯誤訊息中的 retry_delay)。"""
+    value = getattr(exc, "retry_after", None)
+    if value is not None:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    for pat in _RETRY_PATTERNS:
+        m = pat.search(str(exc))
+        if m: return float(m.group(1))
+    return None
+
+
+class RateLimiter:
+    """
+    【全程序 Token Bucket】
+    同一模型的所有 session 共用：RPM 與 TPM 兩個桶，依到達順序 (FIFO 票號) 放行。
+    pause() 讓伺服器的 retry-after 對所有等待者生效，避免大家同時再撞一次 429。
+    """
+
+    def __init__(self, rpm, tpm, clock=time.monotonic):
+        self.rpm, self.tpm, self.clock = rpm, tpm, clock
+        self._cond = threading.Condition()
+        self._req, self._tok = float(rpm), float(tpm)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._next_ticket = self._serving = 0
+        self._abandoned = set()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed, self._updated = now - self._updated, now
+        self._req = min(self.rpm, self._req + elapsed * self.rpm / 60.0)
+        self._tok = min(self.tpm, self._tok + elapsed * self.tpm / 60.0)
+        return now
+
+    def _wait_for(self, tokens, now):
+        tokens = min(tokens, self.tpm)
+        waits = [self._paused_until - now,
+                 (1 - self._req) * 60.0 / self.rpm,
+                 (tokens - self._tok) * 60.0 / self.tpm]
+        return max(0.0, *waits)
+
+    def _advance(self):
+        self._serving += 1
+        while self._serving in self._abandoned:
+            self._abandoned.discard(self._serving)
+            self._serving += 1
+        self._cond.notify_all()
+
+    def acquire(self, tokens=1, on_wait=None, poll=0.5):
+        """
+        取得一次呼叫額度；必要時等待。on_wait(position, seconds) 回報排隊位置 (0 = 下一個) 與預估等待秒數。
+        回傳實際等待秒數。
+        """
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+        started = self.clock()
+        done = False
+        try:
+            while True:
+                with self._cond:
+                    now = self._refill()
+                    position = ticket - self._serving
+                    wait = self._wait_for(tokens, now)
+                    if position == 0 and wait <= 0:
+                        self._req -= 1
+                        self._tok -= min(tokens, self.tpm)
+                        self._advance()
+                        done = True
+                        return self.clock() - started
+                if on_wait: on_wait(position, wait + position * 60.0 / self.rpm)
+                with self._cond:
+                    self._cond.wait(timeout=min(poll, wait) if position == 0 and wait > 0 else poll)
+        finally:
+            if not done:  # 呼叫端中斷 (例如 Streamlit rerun)：讓出票號，避免卡住後面的人
+                with self._cond:
+                    if ticket == self._serving: self._advance()
+                    elif ticket > self._serving: self._abandoned.add(ticket)
+
+    def pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+            self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            now = self._refill()
+            return {"queued": self._next_ticket - self._serving, "rpm": self.rpm, "tpm": self.tpm,
+                    "requests_left": round(self._req, 2), "tokens_left": int(self._tok),
+                    "paused_for": round(max(0.0, self._paused_until - now), 1)}
+
+
+# ---------- 模型後端 (可替換) ----------
+
+class GeminiBackend:
+    """google-generativeai 後端 (延遲載入套件)。"""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def generate(self, model_name, prompt):
+        return "".join(self.stream(model_name, prompt))
+
+    def stream(self, model_name, prompt):
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        blocked, emitted = None, False
+        for chunk in genai.GenerativeModel(model_name).generate_content(prompt, stream=True):
+            try:
+                text = getattr(chunk, "text", "")
+            except ValueError as e:  # 被安全設定擋下或沒有文字的分段，.text 會拋 ValueError：略過
+                blocked = e
+                continue
+            if text:
+                emitted = True
+                yield text
+        if blocked is not None and not emitted: raise blocked  # 整個回應都被擋下：回報原因，不要靜默回傳空字串
+
+
+# ---------- 模型清單 (磁碟快取 + 背景更新) ----------
+
+FALLBACK_MODELS = ["models/gemini-1.5-flash"]
+
+
+def list_gemini_models(api_key):
+    """向 API 取得支援 generateContent 的模型 (flash 優先、pro 其次)。網路呼叫，失敗時拋出例外。"""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    ms = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+    ms.sort(key=lambda x: 0 if 'flash' in x else (1 if 'pro' in x else 2))
+    return ms
+
+
+class ModelCatalog:
+    """
+    【模型清單快取】
+    清單以 API Key 的雜湊為鍵存在磁碟 JSON (不存 Key 本身)，程序重啟後仍可直接使用。
+    - 未過期：直接回傳
+    - 已過期：先回傳舊清單，同時在背景執行緒重新抓取 (同一個 Key 同時只有一個)
+    - 沒有紀錄：同步抓取一次；失敗時回傳 FALLBACK_MODELS，retry_after 秒內不再重試
+    """
+
+    def __init__(self, path="amis_models.json", ttl_seconds=24 * 3600, fetch=list_gemini_models, retry_after=60):
+        self.path, self.ttl, self.fetch, self.retry_after = path, ttl_seconds, fetch, retry_after
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._failed = {}
+        self.last_error = None
+        self._entries = self._load()
+
+    @staticmethod
+    def key_id(api_key):
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.path)
+
+    def _fetch(self, api_key, kid):
+        try:
+            models = self.fetch(api_key) or list(FALLBACK_MODELS)
+        except Exception as e:
+            with self._lock:
+                self._failed[kid] = time.time()
+                self.last_error = f"{type(e).__name__}: {e}"
+            return None
+        with self._lock:
+            self._entries[kid] = {"models": models, "fetched_at": time.time()}
+            self._failed.pop(kid, None)
+            self._save()
+        return models
+
+    def _background(self, api_key, kid):
+        try:
+            self._fetch(api_key, kid)
+        finally:
+            with self._lock:
+                self._refreshing.discard(kid)
+
+    def get(self, api_key):
+        if not api_key: return []
+        kid = self.key_id(api_key)
+        with self._lock:
+            entry = self._entries.get(kid)
+            failed_at = self._failed.get(kid)
+            stale = entry is not None and time.time() - entry["fetched_at"] > self.ttl
+            recently_failed = failed_at is not None and time.time() - failed_at < self.retry_after
+            if stale and not recently_failed and kid not in self._refreshing:
+                self._refreshing.add(kid)
+                threading.Thread(target=self._background, args=(api_key, kid), name="amis-model-list", daemon=True).start()
+        if entry is not None: return list(entry["models"])
+        if recently_failed: return list(FALLBACK_MODELS)
+        return self._fetch(api_key, kid) or list(FALLBACK_MODELS)
+
+    def status(self, api_key):
+        kid = self.key_id(api_key or "")
+        with self._lock:
+            entry = self._entries.get(kid)
+            return {"age_s": round(time.time() - entry["fetched_at"]) if entry else None,
+                    "refreshing": kid in self._refreshing, "last_error": self.last_error}
+
+
+class FakeRateLimitError(Exception):
+    def __init__(self, message="429 Resource has been exhausted", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FakeBackend:
+    """測試用後端：前 fail_times 次丟出 429，之後回傳 reply(model, prompt) 的結果。"""
+
+    def __init__(self, reply=None, fail_times=0, retry_after=None, latency=0.0):
+        self.reply = reply or (lambda model, prompt: f"[{model}] {prompt[:40]}")
+        self.fail_times, self.retry_after, self.latency = fail_times, retry_after, latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, model_name, prompt):
+        return "".join(self.stream(model_name, prompt))
+
+    def stream(self, model_name, prompt, chunk_size=8):
+        with self._lock:
+            self.calls += 1
+            fail = self.calls <= self.fail_times
+        if self.latency: time.sleep(self.latency)
+        if fail: raise FakeRateLimitError(retry_after=self.retry_after)
+        text = self.reply(model_name, prompt)
+        for i in range(0, len(text), chunk_size):
+            yield text[i:i + chunk_size]
+
+
+class CallLog:
+    """每次模型呼叫的計時紀錄 (首字時間 TTFT、總時間、字數、結果)，保留最近 maxlen 筆。"""
+
+    def __init__(self, maxlen=500):
+        self._items = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, **entry):
+        entry.setdefault("at", time.time())
+        with self._lock:
+            self._items.append(entry)
+
+    def recent(self, n=20):
+        with self._lock:
+            return list(self._items)[-n:]
+
+
+class LLMClient:
+    """
+    【共用呼叫包裝】
+    先向共用 RateLimiter 取得額度，429 時依 retry-after (沒有則指數退避 + 抖動) 等待後重試，
+    重試次數與總等待秒數都有上限，超過就拋出 RateLimitExceeded。
+    """
+
+    def __init__(self, backend, limiter, max_retries=4, base_delay=2.0, max_delay=60.0, retry_budget=120.0,
+                 sleep=time.sleep, rng=None, token_estimator=estimate_tokens, log=None):
+        self.backend, self.limiter, self.log = backend, limiter, log
+        self.max_retries, self.base_delay, self.max_delay, self.retry_budget = max_retries, base_delay, max_delay, retry_budget
+        self.sleep, self.rng = sleep, rng or random.Random()
+        self.estimate = token_estimator
+
+    def backoff(self, attempt, exc):
+        hint = retry_after_hint(exc)
+        if hint is not None: return min(self.max_delay, hint)
+        return min(self.max_delay, self.base_delay * (2 ** attempt)) * self.rng.uniform(0.5, 1.5)
+
+    def generate(self, model_name, prompt, on_wait=None, on_retry=None, site=""):
+        """on_wait(position, seconds) 來自排隊；on_retry(attempt, seconds, exc) 來自 429 退避。"""
+        return "".join(self.stream(model_name, prompt, on_wait=on_wait, on_retry=on_retry, site=site))
+
+    def stream(self, model_name, prompt, on_wait=None, on_retry=None, site=""):
+        """
+        逐段產生回應文字。只有在尚未輸出任何內容前遇到 429 才會重試 (已輸出的內容無法收回)。
+        呼叫端提前關閉 generator (停止生成) 時記錄為 stopped。
+        """
+        tokens = self.estimate(prompt)
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            queued = self.limiter.acquire(tokens, on_wait=on_wait)
+            started = time.monotonic()
+            ttft, chars, outcome, ended = None, 0, "stopped", None
+            try:
+                for chunk in self.backend.stream(model_name, prompt):
+                    if ttft is None: ttft = time.monotonic() - started
+                    chars += len(chunk)
+                    yield chunk
+                outcome = "ok"
+                return
+            except Exception as e:
+                ended = time.monotonic()
+                outcome = f"error: {type(e).__name__}"
+                if ttft is not None or not is_rate_limited(e): raise
+                outcome = "429"
+                delay = self.backoff(attempt, e)
+                if attempt == self.max_retries or waited + delay > self.retry_budget:
+                    raise RateLimitExceeded(f"429：已重試 {attempt} 次 (等待 {waited:.0f} 秒) 仍被限流") from e
+                self.limiter.pause(delay)
+                if on_retry: on_retry(attempt + 1, delay, e)
+                self.sleep(delay)
+                waited += delay
+            finally:
+                if self.log is not None:
+                    self.log.record(site=site, model=model_name, attempt=attempt, queued_s=round(queued, 3),
+                                    ttft_s=round(ttft, 3) if ttft is not None else None,
+                                    total_s=round((ended or time.monotonic()) - started, 3), chars=chars,
+                                    prompt_tokens=tokens, outcome=outcome)
@@ -0,0 +1,276 @@
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# ==========================================
+# 效能監測 (每次重跑 × 每個呼叫點：SQL 數、回傳列數、耗時)
+# ==========================================
+# 每次 Streamlit 重跑在腳本執行緒上開一個 RunRecorder；span() 標出呼叫點
+# (檢索、語境、提示詞組裝、模型呼叫…)，期間執行的 SQL 都記在最內層的呼叫點上。
+# 沒有進行中的紀錄時 (背景備份、批次工作執行緒)，所有掛鉤都只是一次屬性查詢。
+
+_local = threading.local()
+IMPORTED_AT = time.time()  # 本模組第一次載入的時間 (Streamlit 重跑不會重新載入)
+
+
+def process_started():
+    """程序啟動時間 (epoch 秒)。Linux 讀 /proc；其他平台以本模組第一次載入的時間代替。"""
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            btime = next(int(l.split()[1]) for l in f if l.startswith("btime"))
+        return btime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration, AttributeError):
+        return IMPORTED_AT
+
+
+def current():
+    """目前執行緒上進行中的 RunRecorder (沒有則為 None)。"""
+    return getattr(_local, "run", None)
+
+
+def _site():
+    return {"calls": 0, "ms": 0.0, "sql": 0, "rows": 0, "sql_ms": 0.0}
+
+
+class RunRecorder:
+    """一次重跑的紀錄。只在建立它的執行緒上寫入，不需要鎖。"""
+
+    def __init__(self, label="", meta=None):
+        self.label, self.meta = label, dict(meta or {})
+        self.started, self.at = time.perf_counter(), time.time()
+        self.sites = {"rerun": _site()}
+        self.stack = ["rerun"]
+        self.profile = None
+
+    @contextmanager
+    def span(self, name):
+        """計時一個呼叫點；巢狀時時間各自計入 (含子呼叫點)，SQL 只計入最內層。"""
+        s = self.sites.setdefault(name, _site())
+        self.stack.append(name)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s["calls"] += 1
+            s["ms"] += (time.perf_counter() - t0) * 1000
+            self.stack.pop()
+
+    def sql(self, seconds, statements=0, rows=0):
+        s = self.sites[self.stack[-1]]
+        s["sql"] += statements
+        s["rows"] += rows
+        s["sql_ms"] += seconds * 1000
+
+    def note(self, site, **values):
+        """附加呼叫點的量測值 (提示詞大小、模型延遲…)；數值累加，其他值覆寫。"""
+        s = self.sites.setdefault(site, _site())
+        for k, v in values.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and isinstance(s.get(k), (int, float)): s[k] += v
+            else: s[k] = v
+
+    def finish(self):
+        total = (time.perf_counter() - self.started) * 1000
+        self.sites["rerun"]["calls"], self.sites["rerun"]["ms"] = 1, total
+        sites = {k: {f: round(v, 2) if isinstance(v, float) else v for f, v in s.items()} for k, s in self.sites.items()}
+        rec = {"at": datetime.fromtimestamp(self.at).strftime("%Y-%m-%d %H:%M:%S"), "label": self.label,
+               "total_ms": round(total, 2), "sql": sum(s["sql"] for s in self.sites.values()),
+               "rows": sum(s["rows"] for s in self.sites.values()),
+               "sql_ms": round(sum(s["sql_ms"] for s in self.sites.values()), 2), "sites": sites, **self.meta}
+        if self.profile is not None: rec["profile"] = self.profile
+        return rec
+
+
+def start_run(label="", meta=None):
+    _local.run = RunRecorder(label, meta)
+    return _local.run
+
+
+def end_run():
+    """結束目前執行緒的紀錄並回傳結果 dict (沒有進行中的紀錄時回傳 None)。"""
+    run, _local.run = current(), None
+    return run.finish() if run is not None else None
+
+
+def set_label(label):
+    run = current()
+    if run is not None: run.label = label
+
+
+def span(name):
+    run = current()
+    return run.span(name) if run is not None else nullcontext()
+
+
+def note(site, **values):
+    run = current()
+    if run is not None: run.note(site, **values)
+
+
+# ---------- SQLite 掛鉤 ----------
+
+class TracedCursor(sqlite3.Cursor):
+    """把 execute 與 fetch 的耗時、回傳列數記到目前的呼叫點。"""
+
+    def execute(self, sql, params=()):
+        run = current()
+        if run is None: return super().execute(sql, params)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            run.sql(time.perf_counter() - t0, statements=1)
+
+    def executemany(self, sql, seq):
+        run = current()
+        if run is None: return super().executemany(sql, seq)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            run.sql(time.perf_counter() - t0, statements=1)
+
+    def _fetched(self, fn, *args):
+        run = current()
+        if run is None: return fn(*args)
+        t0 = time.perf_counter()
+        out = fn(*args)
+        n = len(out) if isinstance(out, list) else int(out is not None)
+        run.sql(time.perf_counter() - t0, rows=n)
+        return out
+
+    def fetchone(self):
+        return self._fetched(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetched(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetched(super().fetchall)
+
+    def __next__(self):
+        run = current()
+        if run is None: return super().__next__()
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            run.sql(time.perf_counter() - t0)
+            raise
+        run.sql(time.perf_counter() - t0, rows=1)
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    """Database(factory=TracedConnection)：連線上所有 execute/cursor 都改用 TracedCursor。"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+
+# ---------- 取樣分析器 ----------
+
+class SamplingProfiler:
+    """
+    【取樣分析器】
+    背景執行緒每 interval 秒讀一次目標執行緒的呼叫堆疊 (sys._current_frames)，
+    統計每個函式位於堆疊頂端 (self) 與出現在堆疊中 (total) 的次數。目標執行緒不受任何插樁影響。
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=40):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval, self.max_depth = interval, max_depth
+        self.samples, self.self_counts, self.total_counts = 0, {}, {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="amis-profiler", daemon=True)
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None: continue
+            self.samples += 1
+            # 停在 TracedCursor 裡代表正在等 SQLite：記到發出 SQL 的那一行
+            sql = False
+            while frame.f_back is not None and frame.f_code.co_filename == __file__:
+                frame, sql = frame.f_back, True
+            leaf = ("SQL ← " if sql else "") + f"{self._label(frame)}:{frame.f_lineno}"
+            self.self_counts[leaf] = self.self_counts.get(leaf, 0) + 1
+            seen, depth = set(), 0
+            while frame is not None and depth < self.max_depth:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.total_counts[label] = self.total_counts.get(label, 0) + 1
+                frame, depth = frame.f_back, depth + 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, top=20):
+        """停止取樣並回傳 {"interval_ms", "samples", "self": [...], "total": [...]}，各取前 top 名。"""
+        self._stop.set()
+        self._thread.join()
+        n = max(1, self.samples)
+        rank = lambda counts: [{"func": k, "samples": v, "pct": round(100 * v / n, 1)}
+                               for k, v in sorted(counts.items(), key=lambda kv: -kv[1])[:top]]
+        return {"interval_ms": self.interval * 1000, "samples": self.samples,
+                "self": rank(self.self_counts), "total": rank(self.total_counts)}
+
+
+# ---------- 紀錄保存與匯出 ----------
+
+def deployment_meta():
+    """跨部署比較用的識別資訊。"""
+    return {"host": socket.gethostname(), "pid": os.getpid(), "python": sys.version.split()[0],
+            "deploy": os.environ.get("AMIS_DEPLOY_ID", "")}
+
+
+class RunHistory:
+    """
+    全程序共用的重跑紀錄 (保留最近 maxlen 筆)。
+    指定 path 時每筆同時以 JSON Lines 追加寫入檔案，可跨部署彙整趨勢。
+    """
+
+    def __init__(self, maxlen=500, path=None):
+        self._items = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.path = path
+
+    def add(self, rec):
+        line = json.dumps(rec, ensure_ascii=False, default=str)
+        with self._lock:
+            self._items.append(rec)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+    def recent(self, n=20, session=None):
+        with self._lock:
+            items = list(self._items)
+        if session is not None: items = [r for r in items if r.get("session") == session]
+        return items[-n:]
+
+    def to_jsonl(self):
+        with self._lock:
+            items = list(self._items)
+        return "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in items).encode("utf-8")
@@ -0,0 +1,223 @@
+import re
+
+import amis_fts
+
+# ==========================================
+# 阿美語構詞分析 + 詞幹索引 (取代 LIKE 候選 + is_linguistically_relevant 後過濾)
+# ==========================================
+# 每個單詞在寫入時拆解出所有可能的詞幹 (前綴、後綴、中綴、重疊)，存進 vocab_stems；
+# 以連字號/空白分開的複合詞 (wawa to fa'inay-an、si-kaen) 另外把每個詞素當成詞幹拆解。
+# 查詢時把輸入詞同樣拆解，每個詞幹走一次主鍵查找即可找到相關詞條，並附上比對理由；
+# 再併入詞幹前綴與子字串 (原本 LIKE '%w%' + is_linguistically_relevant) 的命中，召回率不低於舊的搜尋。
+
+VOWELS = set("aeiouə")
+PREFIXES = ("mi", "ma", "pa", "ka", "sa", "pi", "si", "ci", "ni", "ki", "mali", "maka", "mala", "paka", "pina", "sapi", "saka")
+SUFFIXES = ("an", "ay", "en", "aw")
+INFIXES = ("um", "em")
+MAX_DEPTH = 3          # 最多連續拆掉幾層詞綴 (ka-…-an 再加重疊)
+MIN_STEM = 3           # 詞幹 (不計撇號) 至少幾個字母，避免拆出 "an"、"ka" 之類的碎片
+PREFIX_FALLBACK_MIN = 3
+SUBSTRING_MIN = 2      # 子字串比對的最短輸入 (單一字母不比對，與舊的 is_linguistically_relevant 相同)
+ANALYZER_VERSION = 2   # 詞綴表或拆解規則改變時遞增：既有的詞幹表會由寫入執行緒整份重建
+
+
+def normalize_word(word):
+    """NFC + 小寫 + 撇號統一，去掉連字號 (ka-lalo'od-an -> kalalo'odan)。"""
+    return re.sub(r"[-^\s]", "", amis_fts.normalize_text(word))
+
+
+def morphemes(word):
+    """以連字號/空白分開的詞素 (wawa to fa'inay-an -> wawa, to, fa'inay, an)。"""
+    return [m for m in re.split(r"[-\s]+", amis_fts.normalize_text(word).replace("^", "")) if m]
+
+
+def _ok(stem):
+    bare = stem.replace("'", "")
+    return len(bare) >= MIN_STEM and any(c in VOWELS for c in bare)
+
+
+def _steps(word):
+    """單層拆解：回傳 [(詞幹, 詞綴標記)]。"""
+    out = []
+    for p in PREFIXES:
+        if word.startswith(p) and _ok(word[len(p):]): out.append((word[len(p):], f"{p}-"))
+    for s in SUFFIXES:
+        if word.endswith(s) and _ok(word[:-len(s)]): out.append((word[:-len(s)], f"-{s}"))
+    if word and word[0] not in VOWELS and word[0] != "'":
+        for i in INFIXES:
+            if word[1:3] == i and _ok(word[0] + word[3:]): out.append((word[0] + word[3:], f"-{i}-"))
+    for n in (2, 3, 4):
+        if word[:n] == word[n:2 * n] and _ok(word[n:]): out.append((word[n:], "重疊"))
+    return out
+
+
+def _analyze(word):
+    best, frontier = {word: ()}, [word]
+    for _ in range(MAX_DEPTH):
+        nxt = []
+        for w in frontier:
+            for stem, affix in _steps(w):
+                if stem not in best:
+                    best[stem] = best[w] + (affix,)
+                    nxt.append(stem)
+        frontier = nxt
+    return best
+
+
+def analyze(word):
+    """
+    {詞幹: 詞綴鏈}；包含原形 (空鏈)。以廣度優先搜尋，每個詞幹只保留最短的拆解路徑。
+    複合詞的每個詞素 (夠長的) 也各自拆解，鏈以「複合詞」開頭；另外加入去掉撇號的寫法，容忍省略喉塞音的輸入。
+    """
+    parts = morphemes(word)
+    word = normalize_word(word)
+    if not word: return {}
+    best = _analyze(word)
+    if len(parts) > 1:
+        for part in parts:
+            if not _ok(part): continue
+            for stem, chain in _analyze(part).items():
+                chain = ("複合詞",) + chain
+                if stem not in best or len(chain) < len(best[stem]): best[stem] = chain
+    for stem, chain in list(best.items()):
+        bare = stem.replace("'", "")
+        if bare and bare not in best: best[bare] = chain + ("省略喉塞音",)
+    return best
+
+
+def describe(chain):
+    return " + ".join(chain) if chain else "原形"
+
+
+def match_reason(stem, query_chain, entry_chain):
+    if not query_chain and not entry_chain: return "完全相同"
+    parts = []
+    if query_chain: parts.append(f"輸入 {describe(query_chain)}")
+    if entry_chain: parts.append(f"詞條 {describe(entry_chain)}")
+    return f"詞幹 {stem} (" + "；".join(parts) + ")"
+
+
+# ---------- 詞幹表與觸發器 ----------
+
+_TRIGGERS = ("vocabulary_stem_ai", "vocabulary_stem_au", "vocabulary_stem_ad")
+
+
+def ensure_schema(conn):
+    """
+    建立 vocab_stems、待分析佇列 stem_pending、版本表 stem_state 與觸發器 (純 SQL，只記錄異動的 rowid)。
+    回傳是否需要整表重建 (新建、觸發器遺失，或詞幹表由舊版拆解規則建立)。
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS vocab_stems (stem TEXT NOT NULL, vid INTEGER NOT NULL, affixes TEXT NOT NULL, "
+                 "depth INTEGER NOT NULL, PRIMARY KEY (stem, vid)) WITHOUT ROWID")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vocab_stems_vid ON vocab_stems (vid)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stem_pending (rid INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stem_state (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    row = conn.execute("SELECT version FROM stem_state WHERE name = 'vocabulary'").fetchone()
+    outdated = row is None or row[0] != ANALYZER_VERSION
+    if outdated: conn.execute("INSERT OR REPLACE INTO stem_state (name, version) VALUES ('vocabulary', ?)", (ANALYZER_VERSION,))
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    if all(t in existing for t in _TRIGGERS): return outdated
+    ai, au, ad = _TRIGGERS
+    for t in _TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {t}")
+    conn.execute(f"CREATE TRIGGER {ai} AFTER INSERT ON vocabulary BEGIN INSERT OR IGNORE INTO stem_pending VALUES (NEW.rowid); END")
+    # id 是 rowid 的別名：重排編號也要重新對應
+    conn.execute(f"CREATE TRIGGER {au} AFTER UPDATE OF id, amis ON vocabulary BEGIN INSERT OR IGNORE INTO stem_pending VALUES (OLD.rowid); INSERT OR IGNORE INTO stem_pending VALUES (NEW.rowid); END")
+    conn.execute(f"CREATE TRIGGER {ad} AFTER DELETE ON vocabulary BEGIN INSERT OR IGNORE INTO stem_pending VALUES (OLD.rowid); END")
+    return True
+
+
+def _stem_rows(rid, amis):
+    return [(stem, rid, describe(chain), len(chain)) for stem, chain in analyze(amis or "").items()]
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM vocab_stems")
+    conn.execute("DELETE FROM stem_pending")
+    cur = conn.execute("SELECT rowid, amis FROM vocabulary")
+    while True:
+        batch = cur.fetchmany(1000)
+        if not batch: break
+        conn.executemany("INSERT OR IGNORE INTO vocab_stems VALUES (?, ?, ?, ?)", [row for r in batch for row in _stem_rows(*r)])
+
+
+def ready(conn):
+    """詞幹表與觸發器都在 (唯讀檢查)；尚未建立時查詢端改走一般檢索。"""
+    names = ("vocab_stems",) + _TRIGGERS
+    return conn.execute(f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join('?' * len(names))})", names).fetchone()[0] == len(names)
+
+
+def sync(conn):
+    """把 stem_pending 中的異動重新分析寫入 vocab_stems (單一 SAVEPOINT，可巢狀於外部交易；只在寫入執行緒上呼叫)。"""
+    conn.execute("SAVEPOINT stem_sync")
+    try:
+        if ensure_schema(conn):
+            rebuild(conn)
+        rids = [r[0] for r in conn.execute("SELECT rid FROM stem_pending")]
+        for i in range(0, len(rids), 500):
+            chunk = rids[i:i + 500]
+            ph = ", ".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM vocab_stems WHERE vid IN ({ph})", chunk)
+            rows = conn.execute(f"SELECT rowid, amis FROM vocabulary WHERE rowid IN ({ph})", chunk).fetchall()
+            conn.executemany("INSERT OR IGNORE INTO vocab_stems VALUES (?, ?, ?, ?)", [row for r in rows for row in _stem_rows(*r)])
+        if rids: conn.execute("DELETE FROM stem_pending")
+    except BaseException:
+        conn.execute("ROLLBACK TO stem_sync")
+        conn.execute("RELEASE stem_sync")
+        raise
+    conn.execute("RELEASE stem_sync")
+
+
+# ---------- 查詢 ----------
+
+def relevant_substring(needle, target):
+    """舊版 is_linguistically_relevant 的規則 (target 已包含 needle)：兩個字母只接受詞首/詞尾，三個以上任意位置。"""
+    return len(needle) >= SUBSTRING_MIN and (len(needle) > 2 or target.startswith(needle) or target.endswith(needle))
+
+
+def _substring_hits(conn, needle, limit, index=None):
+    """LOWER(amis) 包含 needle 的詞條 rowid (依 rowid)；有 CorpusIndex 時走倒排索引，否則掃表。"""
+    if index is not None:
+        rows = [(r[0], r[1]) for r in index.contains("vocabulary", "amis", needle, limit=limit)]
+    else:
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", needle) + "%"
+        rows = conn.execute("SELECT rowid, amis FROM vocabulary WHERE LOWER(amis) LIKE ? ESCAPE '\\' LIMIT ?", (pattern, limit)).fetchall()
+    return [rid for rid, amis in rows if relevant_substring(needle, (amis or "").lower())]
+
+
+def lookup(conn, word, limit=50, index=None):
+    """
+    拆解輸入詞，以詞幹在 vocab_stems 上做索引查找 (一次 IN 查詢)，
+    再一律併入詞幹前綴的範圍查找 (同樣走索引) 與子字串命中 (index：CorpusIndex，可省略)。
+    回傳 (rowid, amis, chinese, part_of_speech, note, reason) 列：詞幹命中依拆解層數 (越少越相關) 在前，
+    其次前綴、子字串，同分依 rowid 排序。
+    """
+    query = analyze(word)
+    if not query: return []
+    best = {}
+
+    def hit(vid, score, reason):
+        if vid not in best or score < best[vid][0]: best[vid] = (score, reason)
+
+    stems = list(query)
+    for i in range(0, len(stems), 500):
+        part = stems[i:i + 500]
+        sql = f"SELECT stem, vid, affixes, depth FROM vocab_stems WHERE stem IN ({', '.join('?' * len(part))})"
+        for stem, vid, affixes, depth in conn.execute(sql, part):
+            entry_chain = tuple(affixes.split(" + ")) if depth else ()
+            hit(vid, len(query[stem]) + depth, match_reason(stem, query[stem], entry_chain))
+    base = normalize_word(word)
+    if len(base) >= PREFIX_FALLBACK_MIN:
+        for stem, vid, depth in conn.execute("SELECT stem, vid, depth FROM vocab_stems WHERE stem >= ? AND stem < ? LIMIT ?",
+                                             (base, base + "\U0010ffff", limit * 4)):
+            hit(vid, 10 + depth, f"前綴 {base}… (詞幹 {stem})")
+    needle = amis_fts.normalize_text(word).strip()
+    if len(needle) >= SUBSTRING_MIN:
+        for vid in _substring_hits(conn, needle, limit * 2, index):
+            hit(vid, 20, f"包含 {needle}")
+    if not best: return []
+    ranked = sorted(best.items(), key=lambda kv: (kv[1][0], kv[0]))[:limit]
+    ids = [vid for vid, _ in ranked]
+    rows = {r[0]: r for r in conn.execute(
+        f"SELECT rowid, amis, chinese, part_of_speech, note FROM vocabulary WHERE rowid IN ({', '.join('?' * len(ids))})", ids)}
+    return [rows[vid] + (reason,) for vid, (_, reason) in ranked if vid in rows]
@@ -0,0 +1,203 @@
+import logging
+import re
+import sqlite3
+
+import amis_fts
+import amis_morph
+
+log = logging.getLogger(__name__)
+
+# ==========================================
+# 標準 RAG 檢索 (不依賴 Streamlit，可供基準測試/批次/API 使用)
+# ==========================================
+# 檢索只讀：FTS 影子表、詞幹表、句型向量、翻譯記憶、近似重複索引的 pending 佇列
+# 一律由寫入執行緒以 maintain() 追趕 (啟動時一次、每批寫入提交後一次)，查詢容許索引稍舊。
+
+
+def maintain(conn, vectors=None, tm=None, dedup=None):
+    """
+    【索引維護】只在寫入執行緒上呼叫 (conn 為寫入執行緒的連線，通常已在交易內)：
+    各索引的結構遺失時整份重建，否則只處理 pending 佇列；沒有異動時每個索引只有幾句唯讀查詢。
+    """
+    amis_fts.sync(conn)
+    amis_morph.sync(conn)
+    for idx in (vectors, tm, dedup):
+        if idx is not None: idx.sync(conn)
+
+
+def ranked_lookup(conn, use_fts, table, column, text, limit, index=None):
+    """
+    FTS5 + BM25 排序檢索 (column: amis / chinese)；
+    若 SQLite 未編入 FTS5 則退回倒排索引的子字串比對。
+    """
+    if use_fts:
+        return [r[1:] for r in amis_fts.search(conn, table, column, text, limit=limit)]
+    field = column if table == "vocabulary" else f"output_sentencepattern_{column}"
+    return [r[1:] for r in index().contains(table, field, text, limit=limit)]
+
+
+def relevant_word(word, amis):
+    """阿美語單詞的相關性 (舊版 is_linguistically_relevant)：整詞相同，或符合 amis_morph.relevant_substring 的子字串。"""
+    k, t = word.lower().strip(), (amis or "").lower().strip()
+    return k == t or (k in t and amis_morph.relevant_substring(k, t))
+
+
+def semantic_sentences(conn, vectors, probes, limit=15, k=10):
+    """
+    以句型向量索引做一次批次相似度搜尋，回傳 [(amis, chinese, score)]，分數由高到低。
+    同一句被多個探針命中時取最高分。
+    """
+    best = {}
+    for hits in vectors.search(probes, k=k):
+        for rid, score in hits:
+            if score > best.get(rid, -1.0): best[rid] = score
+    if not best: return []
+    ranked = sorted(best.items(), key=lambda kv: -kv[1])[:limit * 2]
+    ids = [rid for rid, _ in ranked]
+    rows = {r[0]: r[1:] for r in conn.execute(
+        f"SELECT rowid, output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs WHERE rowid IN ({', '.join('?' * len(ids))})", ids)}
+    return [rows[rid] + (score,) for rid, score in ranked if rid in rows]
+
+
+def expert_knowledge(db, query_text, direction="AtoZ", index=None, vectors=None, tm=None):
+    """
+    【標準 RAG 模式】
+    這裡也必須加入 Note 的讀取，讓一般查詢也能看到備註。
+    index：無參數函式，回傳已同步的 CorpusIndex (沒有 FTS5、影子表尚未建立或查詢失敗時使用)。
+    vectors：SentenceVectors (可省略)。已建立時語意例句改用向量相似度，整句與各詞釋義一次批次搜尋；
+    沒有時退回以釋義做全文檢索。
+    tm：TranslationMemory (可省略)。已由寫入執行緒同步過時，整句翻譯改用正規化鍵的索引精確比對，
+    另附模糊比對 (編輯距離相似度 >= 70%) 的句型，排在例句最前面並附 pct。
+    回傳 (full_trans, words_data, sentences_data, rag_prompt)；語意例句附 score (餘弦相似度)。
+    """
+    if not query_text: return None, [], [], ""
+    full_trans, tm_matches = None, []
+    use_tm = tm is not None and tm.ready()
+    if use_tm:
+        # 只讀：tm_pending 的追趕由寫入執行緒負責 (AmisCore.maintain)，這裡容許稍舊的索引
+        try:
+            full_trans, tm_matches = tm.lookup(db.connection(), query_text, direction)
+        except sqlite3.OperationalError as e:
+            log.warning("翻譯記憶查詢失敗，改用 SQL 精確比對：%s", e)
+            use_tm = False
+    if not use_tm:
+        clean_q = query_text.strip().rstrip('.?!')
+        if direction == "AtoZ":
+            sql = "SELECT output_sentencepattern_chinese FROM sentence_pairs WHERE LOWER(REPLACE(output_sentencepattern_amis, '.', '')) = ? LIMIT 1"
+        else:
+            sql = "SELECT output_sentencepattern_amis FROM sentence_pairs WHERE LOWER(output_sentencepattern_chinese) = ? LIMIT 1"
+        sentence_match = db.query(sql, (clean_q.lower(),))
+        full_trans = sentence_match[0][0] if sentence_match else None
+
+    if direction == "AtoZ":
+        # 保留詞中/詞首的喉塞音 (mi'isal、'isal)，交給構詞分析拆解
+        query_words = re.findall(r"'?\w+(?:'\w+)*", amis_fts.normalize_text(query_text))
+    else:
+        query_words = re.findall(r"\w+", query_text.lower())
+    words_data, sentences_data, rag_context_parts = [], [], []
+    # 翻譯記憶的模糊比對：最接近整句的既有翻譯，放在最前面
+    tm_pairs = set()
+    for m in tm_matches:
+        amis_s, chinese_s = (m["source"], m["target"]) if direction == "AtoZ" else (m["target"], m["source"])
+        sentences_data.append({"amis": amis_s, "chinese": chinese_s, "pct": m["pct"]})
+        tm_pairs.add((amis_s, chinese_s))
+        rag_context_parts.append(f"[翻譯記憶 {m['pct']:.0f}%] {amis_s} || {chinese_s}")
+    conn = db.connection()
+    use_fts = amis_fts.ready(conn)
+    use_morph = direction == "AtoZ" and amis_morph.ready(conn)
+    if vectors is not None and not vectors.ready(): vectors = None
+    mark = (len(words_data), len(sentences_data), len(rag_context_parts))
+    for attempt in (0, 1):
+        del words_data[mark[0]:], sentences_data[mark[1]:], rag_context_parts[mark[2]:]
+        try:
+            corpus = index() if use_morph and index is not None else None  # 詞幹查詢併入子字串命中用
+            sent_column = "amis" if direction == "AtoZ" else "chinese"
+            # 向量探針：整句 (同一側找改寫/相近句) + 各詞的釋義 (中文側)
+            probes = [(sent_column, query_text)]
+            for word in query_words:
+                matched_definitions = []
+                should_use_semantic = True
+                if len(word) == 1: should_use_semantic = False
+
+                # 阿美語：詞幹索引 (構詞拆解，附比對理由)；中文 (或詞幹表尚未建立)：FTS5 雙字元 + BM25 排序
+                if use_morph:
+                    res_vocab = [r[1:] for r in amis_morph.lookup(conn, word, limit=50, index=corpus)]
+                else:
+                    column = "amis" if direction == "AtoZ" else "chinese"
+                    res_vocab = [r + (None,) for r in ranked_lookup(conn, use_fts, "vocabulary", column, word, 100, index)]
+                    if direction == "AtoZ": res_vocab = [r for r in res_vocab if relevant_word(word, r[0])]
+
+                valid_vocab_count = 0
+                for w in res_vocab:
+                    if valid_vocab_count >= 50: break
+
+                    note_content = w[3] if w[3] else ""
+                    words_data.append({"amis": w[0], "chinese": w[1], "pos": w[2], "match": w[4]})
+
+                    # 提示詞包含備註與構詞比對理由
+                    rag_str = f"[單詞] {w[0]} : {w[1]} ({w[2]})"
+                    if w[4] and w[4] != "完全相同":
+                        rag_str += f" [構詞: {w[4]}]"
+                    if note_content:
+                        rag_str += f" [備註: {note_content}]"
+                    rag_context_parts.append(rag_str)
+
+                    if w[1] and should_use_semantic: matched_definitions.append(w[1])
+                    if note_content and should_use_semantic: matched_definitions.append(note_content)
+                    valid_vocab_count += 1
+
+                # 句型檢索 (維持原樣，但增加數量限制以防爆掉)
+                res_sent_direct = [r[:2] for r in ranked_lookup(conn, use_fts, "sentence_pairs", sent_column, word, 20, index)]
+
+                res_sent_semantic = []
+                # ... (語意搜尋邏輯) ...
+                if direction == "AtoZ" and matched_definitions and should_use_semantic:
+                    for distinct_def in list(dict.fromkeys(matched_definitions))[:2]: # 限制語意搜尋次數
+                        core_def = distinct_def.split('(')[0].split('（')[0].strip()
+                        if len(core_def) > 0:
+                            if vectors is not None:
+                                probes.append(("chinese", core_def))
+                                continue
+                            found = [r[:2] for r in ranked_lookup(conn, use_fts, "sentence_pairs", "chinese", core_def, 10, index)]
+                            res_sent_semantic.extend(found)
+
+                all_raw_sents = res_sent_direct + res_sent_semantic
+                valid_sent_count, processed_sents = 0, set()
+                for s in all_raw_sents:
+                    amis_s, chinese_s = s[0], s[1]
+                    if (amis_s, chinese_s) in processed_sents: continue
+                    processed_sents.add((amis_s, chinese_s))
+                    # ... (相關性檢查邏輯略，保持簡潔) ...
+
+                    # 直接加入
+                    if {"amis": amis_s, "chinese": chinese_s} not in sentences_data and (amis_s, chinese_s) not in tm_pairs:
+                        if valid_sent_count >= 15: break
+                        sentences_data.append({"amis": amis_s, "chinese": chinese_s})
+                        rag_context_parts.append(f"[例句] {amis_s} || {chinese_s}")
+                        valid_sent_count += 1
+
+            # 語意例句：所有探針一次矩陣乘法，附相似度
+            if vectors is not None:
+                seen, added = {(d["amis"], d["chinese"]) for d in sentences_data}, 0
+                for amis_s, chinese_s, score in semantic_sentences(conn, vectors, probes):
+                    if (amis_s, chinese_s) in seen: continue
+                    seen.add((amis_s, chinese_s))
+                    sentences_data.append({"amis": amis_s, "chinese": chinese_s, "score": score})
+                    rag_context_parts.append(f"[例句] {amis_s} || {chinese_s} (相似度 {score:.2f})")
+                    added += 1
+                    if added >= 15: break
+            break
+        except sqlite3.OperationalError as e:
+            # 影子表/詞幹表是選用的加速結構 (例如剛還原的資料庫還沒維護)：記錄後改用記憶體倒排索引重做一次；
+            # 不用索引也失敗就原樣拋出，不回傳看似「查無資料」的空結果
+            if attempt or not (use_fts or use_morph) or index is None: raise
+            log.warning("FTS/詞幹索引查詢失敗，改用記憶體倒排索引：%s", e)
+            use_fts = use_morph = False
+
+    # RAG 結果截斷保護
+    if len(rag_context_parts) > 60:
+        rag_context_parts = rag_context_parts[:60]
+        rag_context_parts.append("(System: 參考資料過多，已智慧截取)")
+    # 去重但保留 BM25 排序
+    rag_prompt = "\n【檢索結果 (RAG)】:\n" + "\n".join(dict.fromkeys(rag_context_parts)) if rag_context_parts else ""
+    return full_trans, words_data, sentences_data, rag_prompt
@@ -0,0 +1,227 @@
+"""
+【本機 HTTP API】
+在 amis_core 之上的 asyncio HTTP/1.1 服務 (只用標準函式庫)，供其他工具呼叫與負載測試：
+
+    python -m amis_server                                   # Gemini 後端 (環境變數 GOOGLE_API_KEY)
+    python -m amis_server --fake --fake-latency 0.5         # 假後端，不呼叫任何外部服務
+    python -m amis_server --port 8765 --workers 32 --model models/gemini-1.5-flash
+
+    POST /lookup     {"text", "direction"}                         檢索 (不呼叫模型)
+    POST /translate  {"text", "direction", "model", "pangcah", "budget", "use_full"}
+    POST /analyze    {"text", "direction", "model"}
+    GET  /health、GET /status
+
+請求與回應都是 JSON。內容完全相同的請求同時在處理中時只執行一次 (其餘等待同一個結果)；
+檢索與模型呼叫在執行緒池裡進行，所有請求共用同一份 AmisCore (暖索引、回應快取、限流器)。
+錯誤：參數不合格 400、被限流且重試用盡 429、其他 500，內容為 {"error": "..."}。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from amis_core import AmisCore
+from amis_llm import FALLBACK_MODELS, FakeBackend, GeminiBackend, RateLimitExceeded
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class Coalescer:
+    """
+    【在飛請求合併】同一個鍵已經在執行時，後來的呼叫直接等待同一個結果 (成功或例外都共用)。
+    結果不保留：執行結束後下一個相同請求會重新執行 (持久的重複由回應快取負責)。
+    等待中的呼叫端斷線只取消自己的等待，不會取消共用的工作。
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.stats = {"started": 0, "coalesced": 0}
+
+    async def run(self, key, make):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+            self.stats["started"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def inflight(self):
+        return len(self._inflight)
+
+
+class ApiServer:
+    """
+    core：AmisCore；model：請求沒有指定 model 時使用的模型。
+    workers：執行緒池大小 (同時進行的檢索 + 模型呼叫數；模型額度另由 core 的限流器控管)。
+    coalesce=False 時關閉在飛合併 (負載測試比較用)。
+    """
+
+    def __init__(self, core, model=FALLBACK_MODELS[0], workers=16, coalesce=True, max_body=1 << 20):
+        self.core, self.model, self.coalesce, self.max_body = core, model, coalesce, max_body
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="amis-api")
+        self.coalescer = Coalescer()
+        self.stats = {"requests": 0, "errors": 0, "active": 0, "connections": 0}
+        self.started_at = time.time()
+        self._server = None
+        self.routes = {"/lookup": self.lookup, "/translate": self.translate, "/analyze": self.analyze}
+
+    # ---------- 操作 ----------
+
+    def _args(self, body, *extra):
+        text, direction = body.get("text"), body.get("direction", "AtoZ")
+        if "model" in body and not (isinstance(body["model"], str) and body["model"]): raise ValueError("model 必須是非空字串")
+        return (text, direction) + tuple(body.get(k, v) for k, v in extra)
+
+    def lookup(self, body):
+        text, direction = self._args(body)
+        return self.core.lookup, (text, direction)
+
+    def translate(self, body):
+        text, direction, model, pangcah, budget, use_full = self._args(body, ("model", self.model), ("pangcah", False), ("budget", 30000), ("use_full", False))
+        if not isinstance(budget, int) or budget <= 0: raise ValueError("budget 必須是正整數")
+        return self.core.translate, (text, model, direction, bool(pangcah), budget, bool(use_full))
+
+    def analyze(self, body):
+        text, direction, model = self._args(body, ("model", self.model))
+        return self.core.analyze, (text, model, direction)
+
+    async def call(self, path, body):
+        """在執行緒池裡執行對應的核心操作；內容相同的在飛請求共用一次執行。"""
+        fn, args = self.routes[path](body)
+        run = lambda: asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        if not self.coalesce: return await run()
+        return await self.coalescer.run((path, json.dumps(args, ensure_ascii=False)), run)
+
+    def status(self):
+        return dict(self.stats, uptime_s=round(time.time() - self.started_at, 1), inflight=self.coalescer.inflight(),
+                    coalescer=dict(self.coalescer.stats), model=self.model, core=self.core.status())
+
+    # ---------- HTTP ----------
+
+    async def dispatch(self, method, path, body):
+        if path == "/health": return 200, {"ok": True}
+        if path == "/status": return 200, await asyncio.get_running_loop().run_in_executor(self.pool, self.status)
+        if path not in self.routes: return 404, {"error": f"沒有這個路徑：{path}"}
+        if method != "POST": return 405, {"error": "請使用 POST"}
+        try:
+            data = json.loads(body or b"{}")
+            if not isinstance(data, dict): raise ValueError("請求內容必須是 JSON 物件")
+            return 200, await self.call(path, data)
+        except (ValueError, TypeError) as e:
+            return 400, {"error": str(e)}
+        except RateLimitExceeded as e:
+            return 429, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader, writer):
+        """一條連線可以連續送多個請求 (HTTP/1.1 keep-alive)；不支援 chunked 請求內容。"""
+        self.stats["connections"] += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {"error": "請求列格式錯誤"}, False)
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""): break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                size = headers.get("content-length") or "0"
+                if not size.isdigit():
+                    await self._send(writer, 400, {"error": "Content-Length 格式錯誤"}, False)
+                    break
+                size = int(size)
+                if size > self.max_body:
+                    await self._send(writer, 413, {"error": f"請求內容超過 {self.max_body} bytes"}, False)
+                    break
+                body = await reader.readexactly(size) if size else b""
+                self.stats["requests"] += 1
+                self.stats["active"] += 1
+                try:
+                    status, payload = await self.dispatch(method.upper(), urlsplit(target).path.rstrip("/") or "/", body)
+                finally:
+                    self.stats["active"] -= 1
+                if status >= 400: self.stats["errors"] += 1
+                await self._send(writer, status, payload, keep)
+                if not keep: break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, keep):
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self._server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Amis AI 本機 HTTP API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--db", default="amis_data.db")
+    ap.add_argument("--model", default=FALLBACK_MODELS[0], help="請求沒有指定 model 時使用")
+    ap.add_argument("--workers", type=int, default=16, help="同時進行的檢索/模型呼叫數")
+    ap.add_argument("--rpm", type=int, default=None, help="覆寫每個模型的每分鐘請求數")
+    ap.add_argument("--tpm", type=int, default=None, help="覆寫每個模型的每分鐘 token 數")
+    ap.add_argument("--fake", action="store_true", help="使用假後端 (不呼叫外部服務)")
+    ap.add_argument("--fake-latency", type=float, default=0.2, help="假後端每次呼叫的延遲 (秒)")
+    ap.add_argument("--no-coalesce", action="store_true", help="關閉在飛請求合併")
+    args = ap.parse_args(argv)
+
+    if args.fake: backend = FakeBackend(latency=args.fake_latency)
+    else:
+        key = os.environ.get("GOOGLE_API_KEY")
+        if not key: ap.error("請設定環境變數 GOOGLE_API_KEY，或改用 --fake")
+        backend = GeminiBackend(key)
+    core = AmisCore(args.db, backend=backend, rpm=args.rpm, tpm=args.tpm)
+    core.bootstrap()
+    server = ApiServer(core, args.model, args.workers, coalesce=not args.no_coalesce)
+
+    async def serve():
+        port = await server.start(args.host, args.port)
+        print(f"Amis API 已啟動：http://{args.host}:{port} (模型 {args.model}，{'假後端' if args.fake else 'Gemini'})", flush=True)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+import uuid
+from array import array
+
+import numpy as np
+
+import amis_fts
+
+# ==========================================
+# 翻譯記憶 (CAT 工具式：正規化精確比對 + q-gram 模糊比對)
+# ==========================================
+# tm_keys 存每個句型兩側的正規化鍵 (有索引，精確比對是一次 B-tree 查找)；
+# 模糊比對在記憶體中以雙字元 q-gram 的 posting list 計數過濾，再用帶狀編輯距離驗證，
+# 相似度 = 1 - 編輯距離 / 較長者長度。異動沿用觸發器 + 待處理佇列 (tm_pending)。
+
+SIDES = {"amis": 0, "chinese": 1}
+SOURCE_COLUMNS = ("output_sentencepattern_amis", "output_sentencepattern_chinese")
+KEY_COLUMNS = ("amis_key", "chinese_key")
+Q = 2
+_HAN = "㐀-䶿一-鿿豈-﫿"
+_HAN_GAP_RE = re.compile(f"(?<=[{_HAN}]) (?=[{_HAN}])")
+
+
+class _KeyTable(dict):
+    """str.translate 用的字元對照表，第一次遇到某個字元時依 Unicode 類別決定並快取。"""
+
+    def __missing__(self, cp):
+        ch = chr(cp)
+        if ch == "'": v = ch
+        elif ch in "-‐‑–": v = None
+        elif ch.isspace() or unicodedata.category(ch)[0] in "PSZC": v = " "
+        else: v = ch
+        self[cp] = v
+        return v
+
+
+_KEY_TABLE = _KeyTable()
+
+
+def tm_key(text):
+    """
+    正規化鍵：NFC、小寫、撇號/喉塞音寫法統一；連字號去掉 (sa-pi-codad == sapicodad)；
+    其他標點、符號與空白一律壓成單一空白，中文字之間的空白也去掉。
+    """
+    return _HAN_GAP_RE.sub("", " ".join(amis_fts.normalize_text(text).translate(_KEY_TABLE).split()))
+
+
+def qgrams(key):
+    """前後補邊界符號的雙字元 gram；重複出現的 gram 加上序號，讓多重集合的計數過濾可以用集合運算。"""
+    padded = "\x02" + key + "\x03"
+    seen, out = {}, []
+    for i in range(len(padded) - Q + 1):
+        g = padded[i:i + Q]
+        seen[g] = seen.get(g, 0) + 1
+        out.append(g if seen[g] == 1 else f"{g}\x00{seen[g]}")
+    return out
+
+
+def levenshtein(a, b, max_dist):
+    """
+    編輯距離 (Myers/Hyyrö 位元平行法：以 Python 大整數當位元向量，每個字元只需常數次整數運算)；
+    超過 max_dist 時提早回傳 None。
+    """
+    if abs(len(a) - len(b)) > max_dist: return None
+    if not a or not b: return max(len(a), len(b))
+    if len(a) > len(b): a, b = b, a
+    peq = {}
+    for i, ch in enumerate(a):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    mask, top = (1 << len(a)) - 1, 1 << (len(a) - 1)
+    pv, mv, score = mask, 0, len(a)
+    for j, ch in enumerate(b):
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & top: score += 1
+        elif mh & top: score -= 1
+        # 剩下每個字元最多讓距離減 1
+        if score - (len(b) - j - 1) > max_dist: return None
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score if score <= max_dist else None
+
+
+# ---------- 鍵表與觸發器 ----------
+
+_TRIGGERS = ("sentence_pairs_tm_ai", "sentence_pairs_tm_au", "sentence_pairs_tm_ad")
+
+
+def ensure_schema(conn):
+    """建立 tm_keys (兩個鍵欄位各有索引)、tm_pending、tm_state 與觸發器；回傳是否需要重建鍵表。"""
+    conn.execute("CREATE TABLE IF NOT EXISTS tm_keys (rid INTEGER PRIMARY KEY, amis_key TEXT, chinese_key TEXT)")
+    for col in KEY_COLUMNS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_tm_keys_{col} ON tm_keys ({col})")
+    conn.execute("CREATE TABLE IF NOT EXISTS tm_pending (rid INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS tm_state (name TEXT PRIMARY KEY, build TEXT, seq INTEGER NOT NULL DEFAULT 0)")
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    if all(t in existing for t in _TRIGGERS): return False
+    ai, au, ad = _TRIGGERS
+    for t in _TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {t}")
+    conn.execute(f"CREATE TRIGGER {ai} AFTER INSERT ON sentence_pairs BEGIN INSERT OR IGNORE INTO tm_pending VALUES (NEW.rowid); END")
+    conn.execute(f"CREATE TRIGGER {au} AFTER UPDATE OF id, {', '.join(SOURCE_COLUMNS)} ON sentence_pairs BEGIN "
+                 f"INSERT OR IGNORE INTO tm_pending VALUES (OLD.rowid); INSERT OR IGNORE INTO tm_pending VALUES (NEW.rowid); END")
+    conn.execute(f"CREATE TRIGGER {ad} AFTER DELETE ON sentence_pairs BEGIN INSERT OR IGNORE INTO tm_pending VALUES (OLD.rowid); END")
+    return True
+
+
+def _key_rows(rows):
+    return [(r[0], tm_key(r[1]), tm_key(r[2])) for r in rows]
+
+
+class TranslationMemory:
+    """
+    【翻譯記憶】全程序共用。
+    - exact()：以正規化鍵走 tm_keys 的索引 (O(log n))
+    - fuzzy()：q-gram posting list 以 numpy bincount 計數，依長度與 gram 數下限過濾後，
+      只對最有希望的候選計算帶狀編輯距離
+    記憶體索引與資料庫的 tm_state (build/seq) 對照：資料庫被還原或由其他程序修改時從 tm_keys 重新載入。
+    sync() 會寫入資料庫，只在寫入執行緒上呼叫；查詢只讀，容許索引稍舊。
+    """
+
+    def __init__(self, max_verify=60):
+        self.max_verify = max_verify
+        self._lock = threading.RLock()
+        self.state = None
+        self._reset()
+
+    def _reset(self):
+        self.keys = [{}, {}]                              # side -> {rid: key}
+        self.postings = [{}, {}]                          # side -> {gram: array('i') of rid}
+        self.lens = [np.full(0, -1, dtype=np.int32) for _ in SIDES]
+
+    # ---------- 記憶體索引 ----------
+
+    def _put(self, side, rid, key):
+        old = self.keys[side].get(rid)
+        if old == key: return
+        lens = self.lens[side]
+        if rid >= len(lens):
+            grown = np.full(max(1024, 2 * (rid + 1)), -1, dtype=np.int32)
+            grown[:len(lens)] = lens
+            self.lens[side] = lens = grown
+        if not key:
+            self.keys[side].pop(rid, None)
+            lens[rid] = -1
+            return
+        # 只追加新出現的 gram；已不存在的 gram 留在 posting 中，計數偏高只會多放行候選，由編輯距離把關
+        old_grams = set(qgrams(old)) if old else set()
+        post = self.postings[side]
+        for g in qgrams(key):
+            if g not in old_grams: post.setdefault(g, array("i")).append(rid)
+        self.keys[side][rid] = key
+        lens[rid] = len(key)
+
+    def _drop(self, rid):
+        for side in (0, 1):
+            if self.keys[side].pop(rid, None) is not None: self.lens[side][rid] = -1
+
+    def _load(self, conn):
+        self._reset()
+        cur = conn.execute(f"SELECT rid, {', '.join(KEY_COLUMNS)} FROM tm_keys")
+        while True:
+            batch = cur.fetchmany(5000)
+            if not batch: break
+            for rid, a, c in batch:
+                self._put(0, rid, a)
+                self._put(1, rid, c)
+
+    # ---------- 同步 ----------
+
+    def _rebuild_keys(self, conn):
+        conn.execute("DELETE FROM tm_keys")
+        conn.execute("DELETE FROM tm_pending")
+        cur = conn.execute(f"SELECT rowid, {', '.join(SOURCE_COLUMNS)} FROM sentence_pairs")
+        while True:
+            batch = cur.fetchmany(5000)
+            if not batch: break
+            conn.executemany("INSERT INTO tm_keys VALUES (?, ?, ?)", _key_rows(batch))
+        build = uuid.uuid4().hex
+        conn.execute("INSERT OR REPLACE INTO tm_state (name, build, seq) VALUES ('sentence_pairs', ?, 0)", (build,))
+        return (build, 0)
+
+    def sync(self, conn):
+        """
+        處理 tm_pending (單一 SAVEPOINT，可巢狀於外部交易)。
+        快速路徑：觸發器齊全、狀態一致且沒有待處理異動時只有兩句唯讀查詢。
+        """
+        with self._lock:
+            try:
+                state = conn.execute(f"SELECT build, seq, (SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(_TRIGGERS))})) "
+                                     "FROM tm_state WHERE name = 'sentence_pairs'", _TRIGGERS).fetchone()
+            except sqlite3.OperationalError:
+                state = None
+            if (state is not None and state[:2] == self.state and state[2] == len(_TRIGGERS)
+                    and not conn.execute("SELECT 1 FROM tm_pending LIMIT 1").fetchone()):
+                return
+            conn.execute("SAVEPOINT tm_sync")
+            try:
+                created = ensure_schema(conn)
+                state = conn.execute("SELECT build, seq FROM tm_state WHERE name = 'sentence_pairs'").fetchone()
+                if created or state is None:
+                    state = self._rebuild_keys(conn)
+                    self._load(conn)
+                elif tuple(state) != self.state:
+                    self._load(conn)
+                rids = [r[0] for r in conn.execute("SELECT rid FROM tm_pending")]
+                if rids:
+                    for i in range(0, len(rids), 500):
+                        chunk = rids[i:i + 500]
+                        ph = ", ".join("?" * len(chunk))
+                        rows = _key_rows(conn.execute(f"SELECT rowid, {', '.join(SOURCE_COLUMNS)} FROM sentence_pairs WHERE rowid IN ({ph})", chunk).fetchall())
+                        conn.execute(f"DELETE FROM tm_keys WHERE rid IN ({ph})", chunk)
+                        conn.executemany("INSERT INTO tm_keys VALUES (?, ?, ?)", rows)
+                        alive = {r[0] for r in rows}
+                        for rid in chunk:
+                            if rid not in alive: self._drop(rid)
+                        for rid, a, c in rows:
+                            self._put(0, rid, a)
+                            self._put(1, rid, c)
+                    state = (state[0], state[1] + 1)
+                    conn.execute("UPDATE tm_state SET seq = ? WHERE name = 'sentence_pairs'", (state[1],))
+                    conn.execute("DELETE FROM tm_pending")
+                self.state = tuple(state)
+            except BaseException:
+                self.state = None  # 記憶體索引可能已部分更新：下次整份重新載入
+                conn.execute("ROLLBACK TO tm_sync")
+                conn.execute("RELEASE tm_sync")
+                raise
+            conn.execute("RELEASE tm_sync")
+
+    # ---------- 查詢 ----------
+
+    @staticmethod
+    def _sides(direction):
+        return (0, 1) if direction == "AtoZ" else (1, 0)
+
+    def exact(self, conn, text, direction="AtoZ"):
+        """正規化鍵完全相同的句型譯文 (沒有則 None)。"""
+        key = tm_key(text)
+        if not key: return None
+        src, tgt = self._sides(direction)
+        row = conn.execute(f"SELECT s.{SOURCE_COLUMNS[tgt]} FROM tm_keys k JOIN sentence_pairs s ON s.rowid = k.rid "
+                           f"WHERE k.{KEY_COLUMNS[src]} = ? ORDER BY k.rid LIMIT 1", (key,)).fetchone()
+        return row[0] if row else None
+
+    def fuzzy(self, conn, text, direction="AtoZ", min_pct=70, limit=5):
+        """
+        相似度 >= min_pct 的句型，回傳 [{"rid", "source", "target", "pct"}]，由高到低。
+        過濾條件 (長度 n、m，編輯距離上限 k = ⌊(1 - p)·max(n, m)⌋)：
+        |n - m| <= k，且共同 q-gram 數 >= max(n, m) + Q - 1 - Q·k (每次編輯最多破壞 Q 個 gram)。
+        前綴過濾：所有候選至少要共有 t 個 gram 時，只需計數最稀有的 G - t + 1 個 gram
+        (常見 gram 的長 posting list 完全不碰)，門檻也扣掉略過的 gram 數。
+        """
+        key = tm_key(text)
+        if not key: return []
+        src, tgt = self._sides(direction)
+        p, n = min_pct / 100, len(key)
+        kmax = lambda m: int((1 - p) * m + 1e-9)
+        t = min((max(n, L) + Q - 1 - Q * kmax(max(n, L)) for L in range(int(n / max(p, 0.01)) + 2)
+                 if abs(L - n) <= kmax(max(n, L))), default=1)
+        with self._lock:
+            post, lens, keys = self.postings[src], self.lens[src], self.keys[src]
+            grams = sorted(qgrams(key), key=lambda g: len(post.get(g, ())))
+            skipped = min(len(grams) - 1, max(0, t - 1))
+            lists = [np.frombuffer(post[g], dtype=np.int32) for g in grams[:len(grams) - skipped] if g in post]
+            if not lists or not len(lens): return []
+            counts = np.bincount(np.concatenate(lists), minlength=len(lens))[:len(lens)]
+            del lists  # 放掉 posting 的緩衝區檢視，否則寫入執行緒的 sync() 無法 append
+            ids = np.flatnonzero(counts)
+            cand_len = lens[ids]
+            m = np.maximum(cand_len, n)
+            k = np.floor((1 - p) * m + 1e-9).astype(np.int64)
+            ok = (cand_len >= 0) & (np.abs(cand_len - n) <= k) & (counts[ids] >= m + Q - 1 - Q * k - skipped)
+            ids, k, m = ids[ok], k[ok], m[ok]
+            order = np.argsort(-counts[ids], kind="stable")[:self.max_verify]
+            found = []
+            for i in order:
+                rid = int(ids[i])
+                d = levenshtein(key, keys[rid], int(k[i]))
+                if d is not None: found.append((round(100 * (1 - d / int(m[i])), 1), rid))
+        found.sort(key=lambda x: (-x[0], x[1]))
+        found = found[:limit]
+        if not found: return []
+        rows = {r[0]: r[1:] for r in conn.execute(
+            f"SELECT rowid, {SOURCE_COLUMNS[src]}, {SOURCE_COLUMNS[tgt]} FROM sentence_pairs WHERE rowid IN ({', '.join('?' * len(found))})",
+            [rid for _, rid in found])}
+        return [{"rid": rid, "source": rows[rid][0], "target": rows[rid][1], "pct": pct} for pct, rid in found if rid in rows]
+
+    def ready(self):
+        """已經由 sync() 載入過 (查詢只讀，尚未同步時呼叫端改走 SQL 精確比對)。"""
+        return self.state is not None
+
+    def lookup(self, conn, text, direction="AtoZ", min_pct=70, limit=5):
+        """(精確譯文或 None, 模糊比對清單)；精確命中的句子不會重複出現在模糊清單。"""
+        exact = self.exact(conn, text, direction)
+        matches = [m for m in self.fuzzy(conn, text, direction, min_pct, limit + 1) if m["pct"] < 100 or exact is None]
+        return exact, matches[:limit]
+
+    def status(self):
+        with self._lock:
+            return {"amis": len(self.keys[0]), "chinese": len(self.keys[1]),
+                    "grams": sum(len(p) for p in self.postings[0].values()) + sum(len(p) for p in self.postings[1].values())}
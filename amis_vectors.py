@@ -0,0 +1,315 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+import amis_fts
+
+# ==========================================
+# 句型語意檢索 (字元 n-gram TF-IDF 向量 + 記憶體映射矩陣，完全離線)
+# ==========================================
+# 每筆 sentence_pairs 的阿美語與中文各自轉成字元 n-gram 的 TF-IDF 向量，
+# 以雜湊投影到固定維度並做 L2 正規化，存進磁碟上的 NumPy memmap (一列 = [阿美語 | 中文])。
+# 查詢時所有探針 (整句 + 每個詞的釋義) 組成一個矩陣，與語料矩陣做一次矩陣乘法即得到全部餘弦分數。
+# 異動沿用 FTS/詞幹索引的作法：觸發器把 rowid 記到 vec_pending，下次查詢前增量寫入。
+
+DIM = 512                  # 每一側的向量維度
+BUCKETS = 1 << 20          # 文件頻率 (df) 的雜湊桶數
+BLOCK_ROWS = 65536         # 大語料分塊相乘，暫存的分數矩陣只有 BLOCK_ROWS × 探針數
+SIDES = {"amis": 0, "chinese": 1}
+SOURCE_COLUMNS = ("output_sentencepattern_amis", "output_sentencepattern_chinese")
+_HAN_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_WORD_RE = re.compile(r"[0-9a-zÀ-ɏ']+")
+
+
+def grams(text):
+    """中文：單字 + 雙字；阿美語：整個詞 + 含詞界的字元三連 (" mi", "mi'", …)。"""
+    norm = amis_fts.normalize_text(text)
+    out = []
+    for run in _HAN_RE.findall(norm):
+        out.extend(amis_fts.han_grams(run))
+    for w in _WORD_RE.findall(_HAN_RE.sub(" ", norm)):
+        if not w.strip("'"): continue
+        out.append(w)
+        p = f" {w} "
+        out.extend(p[i:i + 3] for i in range(len(p) - 2))
+    return out
+
+
+def _hashed(text):
+    """{32 位元雜湊: 出現次數}；zlib.crc32 在各程序間穩定 (內建 hash() 每次啟動都不同)。"""
+    counts = {}
+    for g in grams(text):
+        h = zlib.crc32(g.encode("utf-8"))
+        counts[h] = counts.get(h, 0) + 1
+    return counts
+
+
+def embed(texts, df, docs, dim=DIM):
+    """
+    把多段文字一次轉成 (len(texts), dim) 的 float32 矩陣 (列已 L2 正規化，空字串為零向量)。
+    權重 = (1 + log tf) × idf，idf 取自雜湊桶 df；投影維度與正負號都由同一個雜湊決定。
+    """
+    rows, hashes, tfs = [], [], []
+    for i, text in enumerate(texts):
+        for h, tf in _hashed(text).items():
+            rows.append(i); hashes.append(h); tfs.append(tf)
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    if not rows: return out
+    h = np.array(hashes, dtype=np.uint32)
+    idf = np.log((docs + 1) / (df[h & (BUCKETS - 1)] + 1.0)) + 1.0
+    sign = np.where(h >> 31, -1.0, 1.0)
+    np.add.at(out, (np.array(rows), (h >> 8) % dim), ((1 + np.log(np.array(tfs, dtype=np.float64))) * idf * sign).astype(np.float32))
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    np.divide(out, norms, out=out, where=norms > 0)
+    return out
+
+
+def count_df(df_side, texts):
+    """每段文字的不重複 n-gram 各記一次文件頻率。"""
+    buckets = [h & (BUCKETS - 1) for t in texts for h in _hashed(t)]
+    if buckets: np.add.at(df_side, np.array(buckets, dtype=np.int64), 1)
+
+
+# ---------- 觸發器與狀態表 (在 amis_data.db 內) ----------
+
+_TRIGGERS = ("sentence_pairs_vec_ai", "sentence_pairs_vec_au", "sentence_pairs_vec_ad")
+
+
+def ensure_schema(conn):
+    """建立 vec_pending、vec_state 與觸發器；回傳是否需要整批重建 (新建或觸發器遺失)。"""
+    conn.execute("CREATE TABLE IF NOT EXISTS vec_pending (rid INTEGER PRIMARY KEY)")
+    conn.execute("CREATE TABLE IF NOT EXISTS vec_state (name TEXT PRIMARY KEY, build TEXT, seq INTEGER NOT NULL DEFAULT 0)")
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    if all(t in existing for t in _TRIGGERS): return False
+    ai, au, ad = _TRIGGERS
+    for t in _TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {t}")
+    conn.execute(f"CREATE TRIGGER {ai} AFTER INSERT ON sentence_pairs BEGIN INSERT OR IGNORE INTO vec_pending VALUES (NEW.rowid); END")
+    conn.execute(f"CREATE TRIGGER {au} AFTER UPDATE OF id, {', '.join(SOURCE_COLUMNS)} ON sentence_pairs BEGIN "
+                 f"INSERT OR IGNORE INTO vec_pending VALUES (OLD.rowid); INSERT OR IGNORE INTO vec_pending VALUES (NEW.rowid); END")
+    conn.execute(f"CREATE TRIGGER {ad} AFTER DELETE ON sentence_pairs BEGIN INSERT OR IGNORE INTO vec_pending VALUES (OLD.rowid); END")
+    return True
+
+
+class SentenceVectors:
+    """
+    【句型向量索引】全程序共用 (讀寫都在同一把鎖內，重新映射檔案時不會有人讀到一半)。
+    目錄內容：
+    - matrix.f32：capacity × (2 × dim) 的 memmap，一列 = [阿美語向量 | 中文向量]
+    - rowids.i64：每一列對應的 sentence_pairs rowid (-1 為空位)
+    - df.i32：兩側各 BUCKETS 個雜湊桶的文件頻率
+    - meta.json：維度、使用列數、文件數、與資料庫 vec_state 對應的 build/seq
+    資料庫被還原或檔案與 vec_state 不一致時整批重建；增量異動累積超過建立時文件數時也會重建 (校正 idf)。
+    """
+
+    def __init__(self, path="amis_vectors", dim=DIM):
+        self.path, self.dim = path, dim
+        self._lock = threading.RLock()
+        self.meta, self.matrix, self.rowids, self.df, self.slots = None, None, None, None, {}
+        self.stats = {"rebuilds": 0, "synced_rows": 0, "searches": 0, "last_build_s": None}
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # ---------- 檔案 ----------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _map(self, capacity):
+        self.matrix = np.memmap(self._file("matrix.f32"), dtype=np.float32, mode="r+", shape=(capacity, 2 * self.dim))
+        self.rowids = np.memmap(self._file("rowids.i64"), dtype=np.int64, mode="r+", shape=(capacity,))
+        self.df = np.memmap(self._file("df.i32"), dtype=np.int32, mode="r+", shape=(2, BUCKETS))
+        used = self.meta["rows"]
+        self.slots = {int(r): i for i, r in enumerate(self.rowids[:used]) if r >= 0}
+
+    def _load(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dim") != self.dim: return
+            self.meta = meta
+            self._map(meta["capacity"])
+        except (OSError, ValueError, KeyError):
+            self.meta, self.matrix = None, None
+
+    def _save_meta(self):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _allocate(self, capacity):
+        """建立或擴充檔案 (擴充部分補零，rowid 補 -1)，然後重新映射。"""
+        old = self.meta["capacity"] if self.matrix is not None else 0
+        self.matrix = self.rowids = None
+        for name, width in (("matrix.f32", 2 * self.dim * 4), ("rowids.i64", 8)):
+            with open(self._file(name), "ab") as f:
+                f.truncate(capacity * width)
+        if not os.path.exists(self._file("df.i32")) or os.path.getsize(self._file("df.i32")) != 2 * BUCKETS * 4:
+            with open(self._file("df.i32"), "wb") as f:
+                f.truncate(2 * BUCKETS * 4)
+        self.meta["capacity"] = capacity
+        self._map(capacity)
+        self.rowids[old:] = -1
+
+    # ---------- 建立與增量同步 ----------
+
+    def _embed_rows(self, rows, docs):
+        return np.hstack([embed([r[1 + s] or "" for r in rows], self.df[s], docs, self.dim) for s in (0, 1)])
+
+    def rebuild(self, conn, batch_rows=5000):
+        """全部重算：第一輪統計 df，第二輪寫入向量 (兩輪都以游標分批讀取)。"""
+        started = time.perf_counter()
+        n = conn.execute("SELECT COUNT(*) FROM sentence_pairs").fetchone()[0]
+        self.matrix = self.rowids = self.df = None
+        for name in ("matrix.f32", "rowids.i64", "df.i32"):
+            if os.path.exists(self._file(name)): os.remove(self._file(name))
+        self.meta = {"dim": self.dim, "rows": 0, "capacity": 0, "docs": 0, "built_docs": n, "changes": 0,
+                     "build": uuid.uuid4().hex, "seq": 0}
+        self._allocate(max(1024, 1 << math.ceil(math.log2(max(1, n) * 1.25))))
+        sql = f"SELECT rowid, {', '.join(SOURCE_COLUMNS)} FROM sentence_pairs ORDER BY rowid"
+        cur = conn.execute(sql)
+        while True:
+            batch = cur.fetchmany(batch_rows)
+            if not batch: break
+            for s in (0, 1): count_df(self.df[s], [r[1 + s] or "" for r in batch])
+        cur, used = conn.execute(sql), 0
+        while True:
+            batch = cur.fetchmany(batch_rows)
+            if not batch: break
+            self.matrix[used:used + len(batch)] = self._embed_rows(batch, n)
+            self.rowids[used:used + len(batch)] = [r[0] for r in batch]
+            used += len(batch)
+        self.meta.update(rows=used, docs=used)
+        self.slots = {int(r): i for i, r in enumerate(self.rowids[:used])}
+        self._flush()
+        conn.execute("INSERT OR REPLACE INTO vec_state (name, build, seq) VALUES ('sentence_pairs', ?, 0)", (self.meta["build"],))
+        conn.execute("DELETE FROM vec_pending")
+        self.stats["rebuilds"] += 1
+        self.stats["last_build_s"] = round(time.perf_counter() - started, 3)
+
+    def _flush(self):
+        for m in (self.matrix, self.rowids, self.df):
+            m.flush()
+        self._save_meta()
+
+    def _apply(self, conn, rids):
+        """把異動的 rowid 重新向量化：已有位置的就地覆寫，新列接在尾端，已刪除的清成零向量。"""
+        rows = []
+        for i in range(0, len(rids), 500):
+            chunk = rids[i:i + 500]
+            rows += conn.execute(f"SELECT rowid, {', '.join(SOURCE_COLUMNS)} FROM sentence_pairs WHERE rowid IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+        alive = {r[0] for r in rows}
+        for rid in rids:
+            slot = self.slots.pop(rid, None) if rid not in alive else None
+            if slot is not None:
+                self.matrix[slot] = 0
+                self.rowids[slot] = -1
+                self.meta["docs"] -= 1
+        new = [r for r in rows if r[0] not in self.slots]
+        if new:
+            # 新文件計入 df；修改過的列沿用建立時的 df (累積的偏差由定期重建校正)
+            for s in (0, 1): count_df(self.df[s], [r[1 + s] or "" for r in new])
+            self.meta["docs"] += len(new)
+            need = self.meta["rows"] + len(new)
+            if need > self.meta["capacity"]: self._allocate(1 << math.ceil(math.log2(need * 1.25)))
+            for r in new:
+                self.slots[r[0]] = self.meta["rows"]
+                self.rowids[self.meta["rows"]] = r[0]
+                self.meta["rows"] += 1
+        if rows:
+            slots = [self.slots[r[0]] for r in rows]
+            self.matrix[slots] = self._embed_rows(rows, max(1, self.meta["docs"]))
+        self.meta["changes"] += len(rids)
+        self.stats["synced_rows"] += len(rids)
+
+    def sync(self, conn):
+        """
+        增量同步 vec_pending (單一 SAVEPOINT，可巢狀於外部交易)。
+        檔案先寫完再遞增資料庫的 seq：中途失敗時兩邊的 seq 不一致，下次會整批重建。
+        """
+        with self._lock:
+            # 快速路徑：觸發器齊全、狀態一致且沒有待處理異動時只有兩句唯讀查詢，不開 SAVEPOINT
+            try:
+                state = conn.execute(f"SELECT build, seq, (SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(_TRIGGERS))})) "
+                                     "FROM vec_state WHERE name = 'sentence_pairs'", _TRIGGERS).fetchone()
+            except sqlite3.OperationalError:
+                state = None  # 新資料庫，或還原了沒有向量狀態表的備份
+            if (state is not None and self.meta is not None and state == (self.meta["build"], self.meta["seq"], len(_TRIGGERS))
+                    and self.meta["changes"] <= max(1000, self.meta["built_docs"])
+                    and not conn.execute("SELECT 1 FROM vec_pending LIMIT 1").fetchone()):
+                return
+            conn.execute("SAVEPOINT vec_sync")
+            try:
+                created = ensure_schema(conn)
+                state = conn.execute("SELECT build, seq FROM vec_state WHERE name = 'sentence_pairs'").fetchone()
+                stale = (created or state is None or self.meta is None
+                         or state[0] != self.meta["build"] or state[1] != self.meta["seq"]
+                         or self.meta["changes"] > max(1000, self.meta["built_docs"]))
+                if stale:
+                    self.rebuild(conn)
+                else:
+                    rids = [r[0] for r in conn.execute("SELECT rid FROM vec_pending")]
+                    if rids:
+                        self._apply(conn, rids)
+                        self.meta["seq"] += 1
+                        self._flush()
+                        conn.execute("UPDATE vec_state SET seq = ? WHERE name = 'sentence_pairs'", (self.meta["seq"],))
+                        conn.execute("DELETE FROM vec_pending")
+            except BaseException:
+                conn.execute("ROLLBACK TO vec_sync")
+                conn.execute("RELEASE vec_sync")
+                raise
+            conn.execute("RELEASE vec_sync")
+
+    # ---------- 查詢 ----------
+
+    def ready(self):
+        """已有可查詢的向量 (由 sync() 建立，或啟動時從檔案載入)；可能比資料庫稍舊。"""
+        return self.meta is not None
+
+    def search(self, probes, k=10, min_score=0.3):
+        """
+        probes：[(side, text)]，side 為 "amis" 或 "chinese"。
+        所有探針組成一個 (探針數 × 2·dim) 的查詢矩陣，與語料矩陣一次相乘 (大語料分塊)；
+        回傳與 probes 對應的 [[(rowid, score), ...]]，每個探針最多 k 筆、分數由高到低。
+        """
+        if not probes: return []
+        with self._lock:
+            if self.meta is None or not self.meta["rows"]: return [[] for _ in probes]
+            q = np.zeros((len(probes), 2 * self.dim), dtype=np.float32)
+            used_sides = [SIDES[side] for side, _ in probes]
+            lo, hi = min(used_sides) * self.dim, (max(used_sides) + 1) * self.dim  # 只有一側時只乘那一半的欄
+            for side, idx in SIDES.items():
+                which = [i for i, (s, _) in enumerate(probes) if s == side]
+                if which:
+                    off = idx * self.dim
+                    q[which, off:off + self.dim] = embed([probes[i][1] for i in which], self.df[idx], max(1, self.meta["docs"]), self.dim)
+            best_scores = np.full((len(probes), 0), -1.0, dtype=np.float32)
+            best_rows = np.zeros((len(probes), 0), dtype=np.int64)
+            used = self.meta["rows"]
+            for start in range(0, used, BLOCK_ROWS):
+                scores = (self.matrix[start:min(used, start + BLOCK_ROWS), lo:hi] @ q[:, lo:hi].T).T   # 探針數 × 區塊列數
+                kk = min(k, scores.shape[1])
+                top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+                best_scores = np.hstack([best_scores, np.take_along_axis(scores, top, axis=1)])
+                best_rows = np.hstack([best_rows, top + start])
+            order = np.argsort(-best_scores, axis=1)[:, :k]
+            rowids = self.rowids[:used]
+            self.stats["searches"] += 1
+            return [[(int(rowids[best_rows[p, j]]), round(float(best_scores[p, j]), 3)) for j in order[p]
+                     if best_scores[p, j] >= min_score and rowids[best_rows[p, j]] >= 0] for p in range(len(probes))]
+
+    def status(self):
+        with self._lock:
+            if self.meta is None: return {"rows": 0, **self.stats}
+            return {"rows": len(self.slots), "capacity": self.meta["capacity"], "dim": self.dim, "changes": self.meta["changes"],
+                    "mb": round(self.meta["capacity"] * 2 * self.dim * 4 / 1e6, 1), **self.stats}
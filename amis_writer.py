@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# ==========================================
+# 單一寫入者佇列 (每程序一條寫入執行緒 + 分組提交)
+# ==========================================
+# 所有 session 的寫入都排進同一個佇列，由一條背景執行緒依序執行：
+# 佇列裡已經在等的工作合併成一個交易 (一次 BEGIN IMMEDIATE / COMMIT)，
+# 每個工作各自包在 SAVEPOINT 裡，失敗只回滾自己，不影響同批的其他工作。
+# session 之間不再互搶 SQLite 寫入鎖；寫入鎖只由寫入執行緒在短時間內持有。
+
+
+class WriteQueue:
+    """
+    【單一寫入者】
+    - submit(fn, *args)：排入佇列，回傳 Future；fn 在寫入執行緒上以 fn(*args) 執行，
+      可以直接使用 db.transaction() (會變成外層交易裡的 SAVEPOINT)。
+    - call(fn, *args)：排入並等待結果 (fn 的例外原樣拋回呼叫端)。
+    - version：每次成功提交遞增，供本程序的快取與其他 session 判斷資料是否更新。
+    max_batch：一個交易最多合併的工作數；linger：取到第一個工作後多等幾秒收集同批工作 (0 = 不等)。
+    after_batch：每批成功提交後在寫入執行緒上執行的維護工作 (例如同步各檢索索引的 pending 佇列)，
+    自成一個交易；在該批的 Future 完成之後才執行，寫入端不必等索引追上。失敗只記錄，不影響寫入。
+    """
+
+    def __init__(self, db, max_batch=64, linger=0.0, name="amis-writer", after_batch=None):
+        self.db, self.max_batch, self.linger, self.after_batch = db, max_batch, linger, after_batch
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self.version = 0
+        self.stats = {"jobs": 0, "batches": 0, "failed": 0, "max_batch_seen": 0,
+                      "wait_ms": 0.0, "run_ms": 0.0, "last_error": None, "maintenance": 0, "maintenance_failed": 0}
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    # ---------- 呼叫端 ----------
+
+    def submit(self, fn, *args, **kwargs):
+        fut = Future()
+        self._queue.put((fn, args, kwargs, fut, time.perf_counter()))
+        return fut
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        if threading.current_thread() is self._thread: return fn(*args, **kwargs)  # 工作內再排工作：直接執行
+        return self.submit(fn, *args, **kwargs).result(timeout)
+
+    def status(self):
+        with self._lock:
+            s = dict(self.stats, version=self.version, queued=self._queue.qsize())
+        done = max(1, s["jobs"])
+        s.update(avg_batch=round(s["jobs"] / max(1, s["batches"]), 2), avg_wait_ms=round(s["wait_ms"] / done, 3),
+                 avg_run_ms=round(s["run_ms"] / done, 3))
+        return s
+
+    # ---------- 寫入執行緒 ----------
+
+    def _take(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.linger
+        while len(batch) < self.max_batch:
+            try:
+                wait = deadline - time.perf_counter()
+                batch.append(self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take()
+            started = time.perf_counter()
+            results, failed, error = [], 0, None
+            try:
+                with self.db.transaction():
+                    for fn, args, kwargs, fut, queued_at in batch:
+                        if not fut.set_running_or_notify_cancel(): continue
+                        try:
+                            with self.db.transaction():
+                                results.append((fut, True, fn(*args, **kwargs)))
+                        except BaseException as e:
+                            failed += 1
+                            results.append((fut, False, e))
+            except BaseException as e:
+                # BEGIN / COMMIT 本身失敗 (例如其他程序長時間持有鎖)：同批工作全部失敗
+                error = e
+            ran = (time.perf_counter() - started) * 1000
+            with self._lock:
+                if error is None: self.version += 1
+                s = self.stats
+                s["jobs"] += len(batch)
+                s["batches"] += 1
+                s["failed"] += len(batch) if error is not None else failed
+                s["max_batch_seen"] = max(s["max_batch_seen"], len(batch))
+                s["wait_ms"] += sum((started - b[4]) * 1000 for b in batch)
+                s["run_ms"] += ran
+                if error is not None: s["last_error"] = f"{type(error).__name__}: {error}"
+            if error is not None:
+                for _, _, _, fut, _ in batch:
+                    if fut.running(): fut.set_exception(error)
+                continue
+            for fut, ok, value in results:
+                if ok: fut.set_result(value)
+                else: fut.set_exception(value)
+            if self.after_batch is not None and len(results) > failed: self._maintain()
+
+    def _maintain(self):
+        try:
+            with self.db.transaction():
+                self.after_batch()
+            error = None
+        except BaseException as e:
+            error = e
+        with self._lock:
+            self.stats["maintenance"] += 1
+            if error is not None:
+                self.stats["maintenance_failed"] += 1
+                self.stats["last_error"] = f"維護失敗 {type(error).__name__}: {error}"
@@ -1,15 +1,25 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import json
 import time
 import re
 import os
 from datetime import datetime
-from PIL import Image
 import io
-import google.generativeai as genai
-from github import Github
+import zlib
+import tempfile
+import uuid
+import amis_db
+from amis_index import INDEXED_FIELDS
+import amis_dedup
+from amis_backup import BackupWorker, GithubRemote
+from amis_context import estimate_tokens
+from amis_llm import GeminiBackend, ModelCatalog
+from amis_core import AmisCore, MISSING_WORD_PROTOCOL, translate_prompt, chat_prompt, analysis_prompt, pangcah_proxy_model
+from amis_import import CsvImporter, IMPORT_SPECS
+import amis_export
+import amis_metrics
+from amis_batch import BatchTranslator, parse_batch_file, job_id, checkpoint_path, load_checkpoint, ordered_jsonl
 
 # ==========================================
 # 0. 頁面配置 (物理鎖定樣式)
@@ -50,76 +60,319 @@ if not st.session_state.auth_status:
 # ==========================================
 
 @st.cache_resource(show_spinner=False)
+def get_model_catalog():
+    """模型清單存在磁碟 (amis_models.json)，過期後背景更新；TTL 可由 secrets 的 MODEL_LIST_TTL (秒) 覆寫。"""
+    return ModelCatalog('amis_models.json', ttl_seconds=int(st.secrets.get("MODEL_LIST_TTL", 24 * 3600)))
+
 def get_verified_models(api_key):
-    if not api_key: return []
-    try:
-        genai.configure(api_key=api_key)
-        ms = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-        ms.sort(key=lambda x: 0 if 'flash' in x else (1 if 'pro' in x else 2))
-        return ms if ms else ["models/gemini-1.5-flash"]
-    except: return ["models/gemini-1.5-flash"]
+    with amis_metrics.span("models"):
+        return get_model_catalog().get(api_key)
+
+def _secret_int(name):
+    v = st.secrets.get(name)
+    return int(v) if v else None
+
+@st.cache_resource(show_spinner=False)
+def get_core():
+    """
+    全程序共用的無介面核心 (amis_core)：連線、索引、快取、限流器都在這裡，本機 HTTP API 用的也是同一套。
+    所有模型共用的 RPM/TPM 上限可由 secrets 的 MODEL_RPM / MODEL_TPM 覆寫。
+    """
+    return AmisCore('amis_data.db', rpm=_secret_int("MODEL_RPM"), tpm=_secret_int("MODEL_TPM"), factory=amis_metrics.TracedConnection)
+
+def get_db():
+    """全程序共用的連線管理層 (每執行緒持久連線、WAL)。"""
+    return get_core().db
+
+def get_writer():
+    """全程序唯一的寫入執行緒 (屬於核心)：所有 session 的寫入排隊、分組提交，每批提交後順便追上檢索索引。"""
+    return get_core().writer
+
+def write(fn, *args):
+    """在寫入執行緒上執行 fn(*args) 並等待結果 (例外原樣拋出)。"""
+    with amis_metrics.span("write"):
+        return get_writer().call(fn, *args)
+
+@st.cache_resource(show_spinner=False)
+def bootstrap_schema():
+    """
+    建表、修復舊版主鍵結構、建立索引與版本追蹤觸發器：每個程序只做一次 (不再每次重跑都開寫入交易)。
+    還原資料庫後呼叫 bootstrap_schema.clear()，下次重跑重新檢查。
+    """
+    get_core().bootstrap()
+    return True
 
 def run_query(sql, params=(), fetch=False):
-    try:
-        with sqlite3.connect('amis_data.db', timeout=30) as conn:
-            c = conn.cursor()
-            c.execute(sql, params)
-            if fetch: return c.fetchall()
-            conn.commit()
-            return True
-    except: return [] if fetch else False
-
-def reorder_ids(table):
-    rows = run_query(f"SELECT rowid FROM {table} ORDER BY created_at ASC", fetch=True)
-    if not rows: return 0
-    for idx, (rid,) in enumerate(rows):
-        run_query(f"UPDATE {table} SET id = ? WHERE rowid = ?", (idx + 1, rid))
-    run_query(f"DELETE FROM sqlite_sequence WHERE name=?", (table,))
-    run_query(f"INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, len(rows)))
-    return len(rows)
+    # 錯誤直接拋出，由 Streamlit 顯示，不再默默回傳空值
+    db = get_db()
+    if fetch: return db.query(sql, params)
+    write(db.execute, sql, params)
+    return True
+
+def editor_key(name):
+    # 儲存後換一個 key，讓編輯器以新資料重新開始 (不會重放舊的編輯狀態)
+    return f"{name}_{st.session_state.get('editor_rev', 0)}"
+
+def editor_base(name, df):
+    """
+    編輯器的基準頁面：開始編輯後就固定在當時讀到的內容，
+    其他人在這期間新增/修改資料不會讓編輯中的列位置錯開，儲存時也以它做樂觀鎖比對。
+    沒有未儲存的編輯時每次重跑都換成最新內容。
+    """
+    bases = st.session_state.setdefault("editor_bases", {})
+    key = editor_key(name)
+    pending = st.session_state.get(key) or {}
+    if key not in bases or not any(pending.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")): bases[key] = df
+    return bases[key]
+
+def save_editor(table, df, name):
+    """
+    【差異儲存】只把 data_editor 的編輯狀態 (修改/新增/刪除的列) 寫回資料庫，
+    並就地更新倒排索引；耗時只與變更列數有關。
+    df 為 editor_base() 的基準頁面：修改/刪除的列若在讀取後已被別人改過，不會覆寫 (列入 conflicts)。
+    回傳 {"updated", "inserted", "deleted", "conflicts"}。
+    """
+    changes = st.session_state.get(editor_key(name)) or {}
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    base = df.astype(object).where(df.notna(), None)
+    expected = {r["_rowid"]: r for r in base.to_dict("records")}
+    with amis_metrics.span(f"save:{table}"):
+        res = write(amis_db.apply_edits, get_db(), table, df["_rowid"].tolist(), changes, {"created_at": now}, expected)
+        if table in INDEXED_FIELDS:
+            idx = get_corpus_index()
+            for rid in res["deleted"]: idx.remove(table, rid)
+            touched = res["updated"] + res["inserted"]
+            for i in range(0, len(touched), 500):
+                part = touched[i:i + 500]
+                rows = run_query(f"SELECT rowid, {', '.join(INDEXED_FIELDS[table])} FROM {table} WHERE rowid IN ({', '.join('?' * len(part))})", part, fetch=True)
+                for r in rows: idx.upsert(table, r[0], r[1:])
+    st.session_state.editor_rev = st.session_state.get("editor_rev", 0) + 1
+    st.session_state.editor_bases = {}
+    return res
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_count(table, where, params, version):
+    """符合筆數只在篩選條件或資料版本改變時重新計算。"""
+    return amis_db.count_rows(get_db(), table, where, list(params))
+
+def paged_browser(name, table, search_cols, filters=None):
+    """
+    【伺服器端分頁瀏覽】
+    搜尋與篩選都在 SQL 完成，以 id 做 keyset 分頁，每次重跑只讀取並傳送一頁。
+    回傳 (page_df, page_tag)；page_tag 隨頁碼/篩選改變，用來區分各頁的編輯器狀態。
+    """
+    c_search, c_size = st.columns([4, 1])
+    search = c_search.text_input("🔍 搜尋 (以空白分隔多個關鍵字)", key=f"{name}_search")
+    size = c_size.selectbox("每頁筆數", [25, 50, 100, 200], index=1, key=f"{name}_size")
+    where, params = amis_db.where_clause(filters, search, search_cols)
+    sig = repr((where, params, size))
+    if f"{name}_pager" not in st.session_state: st.session_state[f"{name}_pager"] = {"sig": sig, "cursors": [None]}
+    pager = st.session_state[f"{name}_pager"]
+    if pager["sig"] != sig: pager.update(sig=sig, cursors=[None])  # 條件改變就回到第一頁
+    with amis_metrics.span(f"browse:{name}"):
+        rows, cols, has_next = amis_db.fetch_page(get_db(), table, where, params, pager["cursors"][-1], size)
+        total = cached_count(table, where, tuple(params), amis_db.table_versions(get_db()).get(table))
+    page_no = len(pager["cursors"])
+    df = pd.DataFrame(rows, columns=cols)
+    c1, c2, c3, c4 = st.columns([1, 1, 1, 3])
+    c1.button("⏮ 第一頁", key=f"{name}_first", disabled=page_no == 1, on_click=lambda: pager.update(cursors=[None]))
+    c2.button("◀ 上一頁", key=f"{name}_prev", disabled=page_no == 1, on_click=lambda: pager["cursors"].pop())
+    c3.button("下一頁 ▶", key=f"{name}_next", disabled=not has_next, on_click=lambda: pager["cursors"].append(int(df["id"].iloc[-1])))
+    c4.caption(f"第 {page_no} / {max(1, -(-total // size))} 頁｜符合 {total:,} 筆")
+    return df, f"{zlib.crc32(sig.encode()):x}_{page_no}"
+
+def session_export_dir():
+    """每個 session 自己的匯出資料夾，避免同時下載時互相覆寫。"""
+    if "export_dir" not in st.session_state: st.session_state.export_dir = tempfile.mkdtemp(prefix="amis_export_")
+    return st.session_state.export_dir
+
+EXPORT_MIME = {"jsonl": "application/jsonl", "csv": "text/csv", "parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+
+def export_stats_caption(res):
+    mem = f"｜記憶體峰值 {res['peak_rss_mb']} MB (+{res['rss_growth_mb']} MB)" if res.get("peak_rss_mb") is not None else ""
+    return f"⏱️ {res['seconds']} 秒{mem}"
+
+def export_buttons(table, name, stem, formats=tuple(amis_export.EXPORT_FORMATS)):
+    """
+    【延遲匯出】按下「產生」才以游標分批串流寫檔 (JSONL / CSV / Parquet / Arrow)，
+    檔案留在 session 的匯出資料夾，重跑時只顯示下載按鈕，不再重新讀表。
+    """
+    if not amis_export.arrow_available(): formats = [f for f in formats if f not in amis_export.COLUMNAR_FORMATS]
+    c_fmt, c_go = st.columns([2, 1])
+    fmt = c_fmt.selectbox("匯出格式", formats, format_func=amis_export.EXPORT_FORMATS.get, key=f"{name}_fmt", label_visibility="collapsed")
+    if c_go.button("📦 產生下載檔", key=f"{name}_prep"):
+        with st.spinner("串流匯出中..."):
+            st.session_state[f"{name}_file"] = amis_export.export_table(get_db(), table, fmt, stem=stem, root=session_export_dir())
+    res = st.session_state.get(f"{name}_file")
+    if res and os.path.exists(res["path"]):
+        ext = os.path.splitext(res["path"])[1][1:]
+        with open(res["path"], "rb") as f:
+            st.download_button(f"📥 下載 {os.path.basename(res['path'])} ({res['rows']:,} 筆, {res['bytes'] / 1024:,.0f} KB)", f,
+                               os.path.basename(res["path"]), EXPORT_MIME.get(ext), key=f"{name}_dl")
+        st.caption(export_stats_caption(res))
+
+def finetune_panel():
+    """【微調資料集】句型雙向翻譯 + 單詞釋義的指令/回應對，去重後依來源文字雜湊做決定性切分。"""
+    st.markdown("#### 🧪 微調資料集 (第二階段)")
+    c1, c2 = st.columns(2)
+    val_ratio = c1.slider("驗證集比例", 0.0, 0.5, 0.1, 0.05, key="ft_val")
+    include_vocab = c2.checkbox("包含單詞釋義", value=True, key="ft_vocab")
+    if st.button("🧪 產生微調資料集", key="ft_go"):
+        with st.spinner("建立資料集中..."):
+            st.session_state.ft_result = amis_export.build_finetune_dataset(get_db(), session_export_dir(), val_ratio, include_vocab=include_vocab)
+    res = st.session_state.get("ft_result")
+    if not res: return
+    tasks = "、".join(f"{k} {v:,}" for k, v in res["by_task"].items())
+    st.success(f"訓練 {res['train']:,} 筆｜驗證 {res['validation']:,} 筆｜去除重複 {res['duplicates']:,} 筆 ({tasks})")
+    st.caption(export_stats_caption(res))
+    cols = st.columns(2)
+    for col, split in zip(cols, ("train", "validation")):
+        path = res["paths"][split]
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                col.download_button(f"📥 {os.path.basename(path)}", f, os.path.basename(path), "application/jsonl", key=f"ft_dl_{split}")
+
+DUP_GROUPS_SHOWN = 20
+
+IMPORT_MODE_LABELS = {"append": "➕ 追加 (全部新增)", "upsert": "🔁 合併 (相同阿美語則更新)", "replace": "🚨 取代 (清空後匯入)"}
+
+def csv_import_panel(table, noun):
+    """
+    【串流 CSV 匯入】分塊讀取與驗證、批次交易寫入；顯示進度與被拒絕的列。
+    取代模式先把整個檔案驗證並暫存，全部合格才以一個短交易換入；有任何一列不合格，舊資料不受影響。
+    """
+    with st.expander("📂 批次匯入/還原 (上傳 CSV)", expanded=False):
+        st.caption(f"必要欄位：{', '.join(IMPORT_SPECS[table]['required'])}；可選：{', '.join(c for c in IMPORT_SPECS[table]['columns'] if c not in IMPORT_SPECS[table]['required'])}")
+        uploaded = st.file_uploader(f"請選擇要上傳的 CSV 檔 ({noun})", type=["csv"], key=f"import_{table}")
+        mode = st.radio("匯入模式", list(IMPORT_MODE_LABELS), format_func=IMPORT_MODE_LABELS.get, horizontal=True, key=f"import_mode_{table}")
+        if mode == "replace": st.error(f"⚠️ 危險操作：將會【完全覆蓋】現有的{noun}資料 (任何一列不合格則整批取消)。")
+        if uploaded is None or not st.button(f"📥 開始匯入{noun}", type="primary", key=f"import_go_{table}"): return
+        bar, status = st.progress(0.0), st.empty()
+        total = max(1, uploaded.size)
+        def on_progress(stats):
+            bar.progress(min(1.0, uploaded.tell() / total))
+            status.caption(f"已讀取 {stats['read']:,} 列｜新增 {stats['inserted']:,}｜更新 {stats['updated']:,}｜拒絕 {stats['rejected']:,}")
+        imp = CsvImporter(get_db(), table, mode, runner=get_writer().call)
+        before = run_query(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}", fetch=True)[0][0]
+        try:
+            stats = imp.run(uploaded, on_progress=on_progress)
+        except Exception as e:
+            st.error(f"匯入失敗: {e}" + ("(已回滾，資料未變動)" if imp.stats["rolled_back"] else ""))
+        else:
+            bar.progress(1.0)
+            get_corpus_index().invalidate(table)
+            if table == "sentence_pairs" and stats["new_words"]: get_corpus_index().invalidate("vocabulary")
+            if mode == "replace": reorder_ids(table)
+            if stats["inserted"] or stats["updated"]: backup_to_github(f"{noun}匯入")
+            extra = f"，新增 {stats['new_words']} 個單詞" if stats["new_words"] else ""
+            st.success(f"✅ 匯入完成：新增 {stats['inserted']:,} 筆、更新 {stats['updated']:,} 筆、拒絕 {stats['rejected']:,} 筆{extra}")
+            if table == "sentence_pairs" and stats["inserted"]:
+                # 只檢查牽涉到新匯入列的群組 (取代模式整表都是新的)
+                only = None if mode == "replace" else [r[0] for r in run_query("SELECT rowid FROM sentence_pairs WHERE rowid > ?", (before,), fetch=True)]
+                with amis_metrics.span("dedup_scan"):
+                    groups = dedup_index().clusters(get_db().connection(), st.session_state.get("dup_threshold"), only=only)
+                st.session_state.dup_clusters, st.session_state.dup_scope = groups, "本次匯入"
+                if groups: st.warning(f"⚠️ 匯入的句型中有 {len(groups)} 組近似重複，請在下方「近似重複句型」檢查或合併。")
+        if imp.rejects:
+            rej = pd.DataFrame(imp.rejects)
+            st.warning(f"被拒絕的列 (顯示前 {len(rej)} 筆)：")
+            st.dataframe(rej, use_container_width=True, hide_index=True)
+            st.download_button("📥 下載被拒絕的列", rej.to_csv(index=False).encode('utf-8-sig'), f"rejected_{table}.csv", "text/csv", key=f"import_rej_{table}")
+
+def dedup_review_panel():
+    """
+    【近似重複句型】只差標點、空白、大小寫的句型 (MinHash + LSH，不必兩兩比對) 分組列出，
+    每組選一句保留，其餘刪除、備註併入保留句。掃描結果放在 session_state，合併後只移除該組。
+    """
+    groups = st.session_state.get("dup_clusters")
+    with st.expander("🧹 近似重複句型 (檢查/合併)", expanded=bool(groups)):
+        c1, c2 = st.columns([3, 1])
+        threshold = c1.slider("相似度門檻 (Jaccard)", 0.6, 1.0, get_dedup_index().threshold, 0.05, key="dup_threshold")
+        if c2.button("🔍 掃描全庫", key="dup_scan"):
+            with amis_metrics.span("dedup_scan"):
+                groups = dedup_index().clusters(get_db().connection(), threshold)
+            st.session_state.dup_clusters, st.session_state.dup_scope = groups, "全庫"
+        if groups is None: return
+        if not groups: st.success(f"✅ {st.session_state.get('dup_scope', '全庫')}沒有近似重複的句型"); return
+        st.caption(f"{st.session_state.get('dup_scope', '全庫')}：{len(groups)} 組、共 {sum(len(g) for g in groups)} 句 (顯示前 {min(len(groups), DUP_GROUPS_SHOWN)} 組)")
+        for g in groups[:DUP_GROUPS_SHOWN]:
+            gid = g[0]["rid"]
+            labels = {r["rid"]: f"#{r['id']}｜{r['amis']}｜{r['chinese']}" + (f"｜{r['note']}" if r["note"] else "") + f"｜{r['jaccard']:.0%}" for r in g}
+            keep = st.radio("保留哪一句", list(labels), format_func=labels.get, key=f"dup_keep_{gid}")
+            if st.button("🔗 合併 (刪除其他句，備註併入保留句)", key=f"dup_merge_{gid}"):
+                n = write(amis_dedup.merge, get_db(), keep, [r["rid"] for r in g])
+                get_corpus_index().invalidate("sentence_pairs")
+                st.session_state.dup_clusters = [x for x in groups if x[0]["rid"] != gid]
+                st.session_state.editor_rev = st.session_state.get("editor_rev", 0) + 1
+                st.session_state.editor_bases = {}
+                if n: backup_to_github("合併重複句型")
+                st.toast(f"已合併：刪除 {n} 句"); st.rerun()
+            st.divider()
+
+def add_sentence(amis, chinese, note):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # 追加時直接給連續 id，不必整表重排
+    write(amis_db.insert_dense, get_db(), "sentence_pairs", {"output_sentencepattern_amis": amis, "output_sentencepattern_chinese": chinese, "note": note, "created_at": now})
+    sync_vocabulary(amis); backup_to_github("新增句型")
+
+def save_summary(res):
+    msg = f"已儲存：修改 {len(res['updated'])} 筆、新增 {len(res['inserted'])} 筆、刪除 {len(res['deleted'])} 筆"
+    if res.get("conflicts"): msg += f"｜⚠️ {len(res['conflicts'])} 筆已被其他人修改，未覆寫 (已載入最新內容)"
+    return msg
+
+def saved_anything(res):
+    return bool(res["updated"] or res["inserted"] or res["deleted"])
+
+def reorder_ids(table, if_needed=False):
+    return write(amis_db.reorder_ids, get_db(), table, if_needed)
+
+def rename_tag(old_tag, new_tag):
+    """標籤更名並連動更新單詞 (同一交易)。"""
+    with get_db().transaction() as conn:
+        conn.execute("UPDATE vocabulary SET part_of_speech = ? WHERE part_of_speech = ?", (new_tag, old_tag))
+        conn.execute("INSERT OR IGNORE INTO pos_tags (tag_name) VALUES (?)", (new_tag,))
+        conn.execute("DELETE FROM pos_tags WHERE tag_name = ?", (old_tag,))
 
 def sync_vocabulary(sentence):
-    words = re.findall(r"\w+", sentence.lower())
-    for word in words:
-        exists = run_query("SELECT id FROM vocabulary WHERE LOWER(amis) = ?", (word,), fetch=True)
-        if not exists:
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            run_query("INSERT INTO vocabulary (amis, note, created_at) VALUES (?, ?, ?)", (word, f"來自句型: {sentence}", now))
-
-def is_linguistically_relevant(keyword, target_word):
-    k = keyword.lower().strip()
-    t = target_word.lower().strip()
-    if k == t: return True
-    if len(k) == 1: return False 
-    if t.startswith(k) or t.endswith(k): return True
-    if k in t and len(k) > 2: return True
-    return False
-
-def backup_to_github():
+    return write(amis_db.sync_vocabulary, get_db(), sentence)
+
+def get_corpus_index():
+    return get_core().index
+
+def corpus_index():
+    """取得全程序共用的倒排索引，並增量同步新寫入的資料列。"""
+    with amis_metrics.span("index_refresh"):
+        return get_core().corpus_index()
+
+@st.cache_resource(show_spinner=False)
+def get_backup_worker():
+    """全程序唯一的背景備份工作者 (沒有 Token 時為 None)。"""
     token = st.secrets.get("general", {}).get("GITHUB_TOKEN") or st.secrets.get("GITHUB_TOKEN")
-    if not token:
+    if not token: return None
+    remote = GithubRemote(token, "shuhsienling1002-oss", "Amis_AI_Project")
+    return BackupWorker('amis_data.db', remote, mode=st.secrets.get("BACKUP_MODE", "snapshot"))
+
+def backup_to_github(reason="update"):
+    """排入背景備份佇列後立即返回；短時間內的多次觸發會合併成一次上傳。"""
+    worker = get_backup_worker()
+    if worker is None:
         st.error("❌ 未偵測到 GitHub Token。")
         return False
-    try:
-        g = Github(token)
-        user_name = "shuhsienling1002-oss"
-        repo_name = "Amis_AI_Project"
-        repo = g.get_user(user_name).get_repo(repo_name)
-        file_path = "amis_data.db"
-        with open(file_path, "rb") as f:
-            content = f.read()
-        try:
-            contents = repo.get_contents(file_path)
-            repo.update_file(contents.path, f"Mobile update: {datetime.now()}", content, contents.sha)
-            st.toast("☁️ 雲端備份成功！資料已回傳 GitHub。", icon="✅")
-            return True
-        except Exception:
-            repo.create_file(file_path, f"Initial DB: {datetime.now()}", content)
-            st.toast("☁️ 雲端備份成功！(已建立新資料檔)", icon="✅")
-            return True
-    except Exception as e:
-        st.error(f"⚠️ 連線失敗。請確認 Token 權限。錯誤: {str(e)}")
+    worker.trigger(reason)
+    st.toast("☁️ 已排入背景備份，稍後自動回傳 GitHub。", icon="⏳")
+    return True
+
+def backup_now():
+    """手動備份：立即執行並等待結果。"""
+    worker = get_backup_worker()
+    if worker is None:
+        st.error("❌ 未偵測到 GitHub Token。")
         return False
+    with st.spinner("正在備份資料庫..."):
+        ok = worker.flush()
+    if ok: st.toast("☁️ 雲端備份成功！資料已回傳 GitHub。", icon="✅")
+    else: st.error(f"⚠️ 連線失敗。請確認 Token 權限。錯誤: {worker.status()['last_error']}")
+    return ok
 
 # ==========================================
 # 核心修改區：資料讀取優化 (壓縮 + Note)
@@ -132,126 +385,215 @@ def get_full_database_context():
     格式定義：
     單詞區：Amis,Chinese,POS|Note
     句型區：Amis||Chinese|Note
+    結果跨 session 共用，並以資料版本自動失效 (新增/修改後不必手動重新分析)。
     """
-    ctx = "Dataset:Amis-Note-Compressed\n"
-    
-    # 1. 讀取單詞 (含 Note)
-    vocab = run_query("SELECT amis, chinese, part_of_speech, note FROM vocabulary", fetch=True)
-    if vocab:
-        ctx += "==V==\n" # V = Vocabulary
-        for v in vocab:
-            a = v[0] if v[0] else ""
-            c = v[1] if v[1] else ""
-            p = v[2] if v[2] else ""
-            n = v[3] if v[3] else ""
-            
-            # 壓縮邏輯：若無 note，省去分隔符
-            line = f"{a},{c},{p}"
-            if n:
-                line += f"|{n}"
-            ctx += line + "\n"
-                
-    # 2. 讀取句型 (含 Note)
-    sents = run_query("SELECT output_sentencepattern_amis, output_sentencepattern_chinese, note FROM sentence_pairs", fetch=True)
-    if sents:
-        ctx += "==S==\n" # S = Sentences
-        for s in sents:
-            sa = s[0] if s[0] else ""
-            sc = s[1] if s[1] else ""
-            sn = s[2] if s[2] else ""
-            
-            # 壓縮邏輯
-            line = f"{sa}||{sc}"
-            if sn:
-                line += f"|{sn}"
-            ctx += line + "\n"
-            
-    return ctx
+    with amis_metrics.span("full_context"):
+        return get_core().full_context()
+
+def get_pangcah_context(user_text, budget_tokens, use_full=False):
+    """Pangcah 提示語境：預設依相關度裁剪到 Token 預算內；use_full 時回傳整庫語境。"""
+    with amis_metrics.span("full_context" if use_full else "context"):
+        return get_core().pangcah_context(user_text, budget_tokens, use_full)
+
+def context_usage_caption(info):
+    if info["kept"] is None: return f"📦 語境用量：{info['used_tokens']:,} tokens (全庫)"
+    return f"📦 語境用量：{info['used_tokens']:,} / {info['budget']:,} tokens｜收錄 {info['kept']} 筆，略過 {info['dropped']} 筆"
+
+def get_dedup_index():
+    """句型近似重複索引 (屬於核心；MinHash 桶鍵在記憶體，由寫入執行緒增量同步)。"""
+    return get_core().dedup
+
+def dedup_index():
+    """取得近似重複索引；先等寫入執行緒追上待處理的異動 (掃描與儲存前的檢查要看到最新的句型)。"""
+    with amis_metrics.span("dedup_sync"):
+        write(get_core().maintain)
+    return get_dedup_index()
 
 def get_expert_knowledge(query_text, direction="AtoZ"):
+    """標準 RAG 檢索 (實作於 amis_core / amis_retrieval，共用連線、倒排索引、句型向量索引與翻譯記憶)。"""
+    with amis_metrics.span("retrieval"):
+        return get_core().expert_knowledge(query_text, direction)
+
+def get_response_cache():
+    return get_core().responses
+
+def corpus_version():
+    """語料版本字串；任何單詞/句型異動都會讓舊的 AI 回應快取失效。"""
+    return get_core().corpus_version()
+
+def get_rate_limiter(model_name):
+    """同一模型的所有 session (以及 HTTP API) 共用一個限流器。"""
+    return get_core().limiter(model_name)
+
+def get_call_log():
+    return get_core().call_log
+
+@st.cache_resource(show_spinner=False)
+def get_run_history():
+    """全程序共用的重跑紀錄；secrets 設定 METRICS_LOG 時同時追加寫入該 JSON Lines 檔。"""
+    return amis_metrics.RunHistory(path=st.secrets.get("METRICS_LOG"))
+
+def metrics_panel():
     """
-    【標準 RAG 模式】
-    這裡也必須加入 Note 的讀取，讓一般查詢也能看到備註。
+    【效能監測】(側邊欄，管理用)
+    顯示本 session 上一次重跑各呼叫點的 SQL 數、回傳列數與耗時、提示詞大小與模型延遲，
+    以及最近的模型呼叫紀錄；紀錄可匯出成 JSON Lines 供跨部署比較。
     """
-    if not query_text: return None, [], [], "" 
-    clean_q = query_text.strip().rstrip('.?!')
-    if direction == "AtoZ":
-        sql = "SELECT output_sentencepattern_chinese FROM sentence_pairs WHERE LOWER(REPLACE(output_sentencepattern_amis, '.', '')) = ? LIMIT 1"
-    else:
-        sql = "SELECT output_sentencepattern_amis FROM sentence_pairs WHERE LOWER(output_sentencepattern_chinese) = ? LIMIT 1"
-    sentence_match = run_query(sql, (clean_q.lower(),), fetch=True)
-    full_trans = sentence_match[0][0] if sentence_match else None
-    
-    query_words = re.findall(r"\w+", query_text.lower())
-    words_data, sentences_data, rag_context_parts = [], [], []
+    with st.sidebar.expander("📈 效能監測", expanded=False):
+        st.checkbox("啟用取樣分析器 (下次重跑生效)", key="profiler_on")
+        startup = get_startup()
+        ws = get_writer().status()
+        st.caption(f"✍️ 寫入佇列：版本 {ws['version']}｜{ws['jobs']:,} 筆工作 / {ws['batches']:,} 次提交 (平均每批 {ws['avg_batch']}，最多 {ws['max_batch_seen']})｜"
+                   f"等待 {ws['avg_wait_ms']:.1f} ms｜執行 {ws['avg_run_ms']:.1f} ms｜失敗 {ws['failed']}")
+        if ws["last_error"]: st.caption(f"⚠️ 上次寫入失敗：{ws['last_error']}")
+        if startup["first_page_ms"] is not None:
+            st.caption(f"🚀 冷啟動：程序啟動 → 第一個頁面 {startup['first_page_ms']:,.0f} ms (該次重跑 {startup['first_run_ms']:,.0f} ms，{startup['page']})")
+        runs = get_run_history().recent(20, session=st.session_state.get("metrics_session"))
+        if not runs: st.caption("尚無紀錄，下一次重跑後顯示。")
+        else:
+            last = runs[-1]
+            c1, c2 = st.columns(2)
+            c1.metric("上次重跑", f"{last['total_ms']:,.0f} ms"); c2.metric("SQL", f"{last['sql']:,} 句")
+            st.caption(f"{last['label']}｜SQL 耗時 {last['sql_ms']:,.0f} ms｜回傳 {last['rows']:,} 列｜{last['at']}")
+            sites = pd.DataFrame([{"呼叫點": k, **v} for k, v in last["sites"].items()]).sort_values("ms", ascending=False)
+            st.dataframe(sites, hide_index=True, use_container_width=True)
+            if len(runs) > 1:
+                st.caption("最近重跑")
+                st.dataframe(pd.DataFrame([{"時間": r["at"][11:], "頁面": r["label"], "ms": r["total_ms"], "SQL": r["sql"], "SQL ms": r["sql_ms"]} for r in reversed(runs)]),
+                             hide_index=True, use_container_width=True)
+            if last.get("profile"):
+                prof = last["profile"]
+                st.caption(f"取樣分析：{prof['samples']} 個樣本 (每 {prof['interval_ms']:.0f} ms)，堆疊頂端前幾名")
+                st.dataframe(pd.DataFrame(prof["self"]), hide_index=True, use_container_width=True)
+        calls = get_call_log().recent(10)
+        if calls:
+            st.caption("最近模型呼叫 (秒)")
+            st.dataframe(pd.DataFrame(calls)[["site", "model", "queued_s", "ttft_s", "total_s", "prompt_tokens", "chars", "outcome"]],
+                         hide_index=True, use_container_width=True)
+        # 按下才序列化，平常重跑不必每次把整份紀錄轉成 JSON
+        if st.button("📦 產生紀錄匯出檔", key="metrics_prep"):
+            st.session_state.metrics_export = (f"amis_metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl", get_run_history().to_jsonl())
+        if st.session_state.get("metrics_export"):
+            fname, data = st.session_state.metrics_export
+            st.download_button(f"📥 下載 {fname} ({len(data) / 1024:,.0f} KB)", data, fname, "application/x-ndjson", key="metrics_dl")
+
+def _stop_stream(site):
+    st.session_state.stream_stopped = site
+
+def stream_text(api_key, model_name, prompt, site, keep=True):
+    """
+    三個 AI 呼叫點共用：先查回應快取 (模型 + 提示詞雜湊)，未命中才經由共用限流器串流呼叫 Gemini，
+    逐段顯示並可按「⏹ 停止生成」中斷；429 時依 retry-after / 指數退避重試並顯示排隊狀態。
+    完成後寫入快取並回傳全文；keep=False 時完成後清掉串流區塊，由呼叫端自行顯示結果。
+    """
+    if "stream_timings" not in st.session_state: st.session_state.stream_timings = {}
+    cache, version = get_response_cache(), corpus_version()
+    amis_metrics.note(f"model:{site}", prompt_chars=len(prompt), prompt_tokens=estimate_tokens(prompt))
+    cached = cache.get(model_name, prompt, version)
+    if cached is not None:
+        amis_metrics.note(f"model:{site}", cache_hits=1)
+        st.toast("⚡ 已使用快取回應 (未消耗 API 額度)", icon="🗄️")
+        st.session_state.stream_timings[site] = {"ttft": 0.0, "total": 0.0, "cached": True}
+        if keep: st.markdown(cached)
+        return cached
+    stop, status, out = st.empty(), st.empty(), st.empty()
+    stop.button("⏹ 停止生成", key=f"stop_{site}", on_click=_stop_stream, args=(site,))
+    def on_wait(position, seconds):
+        status.info(f"⏳ 排隊中：前方還有 {position} 個請求，預計等待 {seconds:.0f} 秒 (模型 {model_name})")
+    def on_retry(attempt, seconds, exc):
+        status.warning(f"🧊 流量滿載 (429)，第 {attempt} 次重試，{seconds:.0f} 秒後自動再試...")
+    client = get_core().client(model_name, GeminiBackend(api_key))
+    st.session_state.stream_partial = {"site": site, "text": ""}
+    text, started, ttft = "", time.perf_counter(), None
     try:
-        with sqlite3.connect('amis_data.db') as conn:
-            for word in query_words:
-                matched_definitions = [] 
-                should_use_semantic = True
-                if len(word) == 1: should_use_semantic = False
-                
-                # 修改：SQL 加入 note
-                if direction == "AtoZ":
-                    res_vocab = run_query("SELECT amis, chinese, part_of_speech, note FROM vocabulary WHERE LOWER(amis) LIKE ? LIMIT 100", (f"%{word}%",), fetch=True)
-                else:
-                    res_vocab = run_query("SELECT amis, chinese, part_of_speech, note FROM vocabulary WHERE chinese LIKE ? LIMIT 100", (f"%{word}%",), fetch=True)
-                
-                valid_vocab_count = 0
-                for w in res_vocab:
-                    if direction == "AtoZ" and not is_linguistically_relevant(word, w[0]): continue 
-                    if valid_vocab_count >= 50: break 
-                    
-                    note_content = w[3] if w[3] else ""
-                    words_data.append({"amis": w[0], "chinese": w[1], "pos": w[2]})
-                    
-                    # 提示詞包含備註
-                    rag_str = f"[單詞] {w[0]} : {w[1]} ({w[2]})"
-                    if note_content:
-                        rag_str += f" [備註: {note_content}]"
-                    rag_context_parts.append(rag_str)
-                    
-                    if w[1] and should_use_semantic: matched_definitions.append(w[1])
-                    if note_content and should_use_semantic: matched_definitions.append(note_content)
-                    valid_vocab_count += 1
-                
-                # 句型檢索 (維持原樣，但增加數量限制以防爆掉)
-                if direction == "AtoZ":
-                    res_sent_direct = run_query("SELECT output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs WHERE LOWER(output_sentencepattern_amis) LIKE ? LIMIT 20", (f"%{word}%",), fetch=True)
-                else:
-                    res_sent_direct = run_query("SELECT output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs WHERE output_sentencepattern_chinese LIKE ? LIMIT 20", (f"%{word}%",), fetch=True)
-                
-                res_sent_semantic = []
-                # ... (語意搜尋邏輯) ...
-                if direction == "AtoZ" and matched_definitions and should_use_semantic:
-                    for distinct_def in list(set(matched_definitions))[:2]: # 限制語意搜尋次數
-                        core_def = distinct_def.split('(')[0].split('（')[0].strip()
-                        if len(core_def) > 0:
-                            found = run_query("SELECT output_sentencepattern_amis, output_sentencepattern_chinese FROM sentence_pairs WHERE output_sentencepattern_chinese LIKE ? LIMIT 10", (f"%{core_def}%",), fetch=True)
-                            res_sent_semantic.extend(found)
-                            
-                all_raw_sents = res_sent_direct + res_sent_semantic
-                valid_sent_count, processed_sents = 0, set()
-                for s in all_raw_sents:
-                    amis_s, chinese_s = s[0], s[1]
-                    if (amis_s, chinese_s) in processed_sents: continue
-                    processed_sents.add((amis_s, chinese_s))
-                    # ... (相關性檢查邏輯略，保持簡潔) ...
-                    
-                    # 直接加入
-                    if {"amis": amis_s, "chinese": chinese_s} not in sentences_data:
-                        if valid_sent_count >= 15: break
-                        sentences_data.append({"amis": amis_s, "chinese": chinese_s})
-                        rag_context_parts.append(f"[例句] {amis_s} || {chinese_s}")
-                        valid_sent_count += 1
-    except: pass
-    
-    # RAG 結果截斷保護
-    if len(rag_context_parts) > 60:
-        rag_context_parts = rag_context_parts[:60]
-        rag_context_parts.append("(System: 參考資料過多，已智慧截取)")
-    rag_prompt = "\n【檢索結果 (RAG)】:\n" + "\n".join(set(rag_context_parts)) if rag_context_parts else ""
-    return full_trans, words_data, sentences_data, rag_prompt
+        with amis_metrics.span(f"model:{site}"):
+            for chunk in client.stream(model_name, prompt, on_wait=on_wait, on_retry=on_retry, site=site):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    status.empty()
+                text += chunk
+                st.session_state.stream_partial["text"] = text
+                out.markdown(text + "▌")
+    finally:
+        stop.empty(); status.empty()
+        amis_metrics.note(f"model:{site}", ttft_ms=round((ttft or 0.0) * 1000, 1), model_ms=round((time.perf_counter() - started) * 1000, 1), output_chars=len(text))
+    st.session_state.stream_partial = None
+    st.session_state.stream_timings[site] = {"ttft": ttft or 0.0, "total": time.perf_counter() - started, "cached": False}
+    if keep: out.markdown(text)
+    else: out.empty()
+    if text: cache.put(model_name, prompt, text, version)
+    return text
+
+def timing_caption(site):
+    t = st.session_state.get("stream_timings", {}).get(site)
+    if not t: return
+    if t["cached"]: st.caption("⏱️ 快取回應 (0 秒)")
+    else: st.caption(f"⏱️ 首字 {t['ttft']:.1f} 秒｜總計 {t['total']:.1f} 秒")
+
+def show_stopped_output(site):
+    """使用者按下停止後的重跑：顯示已產生的部分內容。"""
+    partial = st.session_state.get("stream_partial")
+    if st.session_state.get("stream_stopped") == site and partial and partial["site"] == site:
+        st.warning("⏹ 已停止生成，以下為已產生的部分內容：")
+        st.markdown(partial["text"])
+        st.session_state.stream_stopped = None
+        st.session_state.stream_partial = None
+
+def response_cache_panel():
+    with st.expander("🗄️ AI 回應快取", expanded=False):
+        cs = get_response_cache().stats()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("命中", cs["hits"]); c2.metric("未命中", cs["misses"])
+        c3.metric("命中率", f"{cs['hit_rate']:.0%}"); c4.metric("快取筆數", cs["entries"])
+        st.caption(f"失效 {cs['stale']}｜淘汰 {cs['evictions']}｜寫入 {cs['writes']}｜約 {cs['chars']:,} 字元")
+        if st.button("🧹 清除回應快取"):
+            get_response_cache().clear(); st.rerun()
+
+def batch_panel(api_key, model_name, protocol):
+    """
+    【批次翻譯】上傳整份課文，每行各自做 RAG 檢索 + 模型翻譯。
+    同時處理句數受模型 RPM 限制；結果逐句寫入 JSONL 檢查點，中斷後重新上傳同一檔案即可接續。
+    """
+    with st.expander("📦 批次翻譯 (上傳整份課文)", expanded=False):
+        up = st.file_uploader("上傳 .txt / .csv / .jsonl (每行一句)", type=["txt", "csv", "jsonl"], key="batch_file")
+        b_mode = st.radio("批次翻譯方向", ["阿美語 ⮕ 中文", "中文 ⮕ 阿美語"], horizontal=True, key="batch_dir")
+        direction = "AtoZ" if b_mode == "阿美語 ⮕ 中文" else "ZtoA"
+        rpm = get_rate_limiter(model_name).rpm
+        workers = st.slider("同時處理句數 (上限為模型每分鐘請求數)", 1, max(2, min(16, rpm)), min(4, rpm), key="batch_workers")
+        if not up: return
+        try:
+            items = parse_batch_file(up.name, up.getvalue())
+        except Exception as e:
+            st.error(f"檔案解析失敗：{e}"); return
+        jid = job_id(items, model_name, direction)
+        path = checkpoint_path(jid)
+        done = sum(1 for r in load_checkpoint(path).values() if r.get("source") != "error")
+        st.caption(f"共 {len(items)} 句｜已完成 {done} 句｜模型 {model_name}｜檢查點 {jid}")
+        c_run, c_stop = st.columns([3, 1])
+        run = c_run.button("▶️ 開始 / 接續批次翻譯", type="primary", key="batch_run", disabled=not items)
+        c_stop.button("⏹ 停止", key="batch_stop")  # 按下即中斷本次執行，已完成的句子保留在檢查點
+        if run:
+            if not api_key:
+                st.warning("請設定 Google API Key")
+            else:
+                bar, status, recent_box = st.progress(0.0), st.empty(), st.empty()
+                recent = []
+                def on_result(rec, sm):
+                    bar.progress(sm["done"] / max(1, sm["total"]), text=f"{sm['done']} / {sm['total']}")
+                    status.caption(f"✅ {sm['ok']}｜❌ {sm['errors']}｜略過 (先前已完成) {sm['skipped']}")
+                    recent.append({"#": rec["index"] + 1, "原文": rec["input"], "譯文": rec["output"] or rec["error"],
+                                   "來源": rec["source"], "秒": rec["latency_s"]})
+                    recent_box.dataframe(pd.DataFrame(recent[-10:]), use_container_width=True, hide_index=True)
+                client = get_core().client(model_name, GeminiBackend(api_key))
+                bt = BatchTranslator(client, model_name, get_expert_knowledge, direction, workers,
+                                     cache=get_response_cache(), corpus_version=corpus_version(), protocol=protocol)
+                sm = bt.run(items, path, on_result=on_result)
+                lat = [r["秒"] for r in recent]
+                avg = f"，平均每句 {sum(lat) / len(lat):.1f} 秒" if lat else ""
+                (st.warning if sm["errors"] else st.success)(f"批次完成：成功 {sm['ok']} 句，失敗 {sm['errors']} 句{avg} (失敗的句子可再按一次接續)")
+        if os.path.exists(path):
+            st.download_button("⬇️ 下載結果 (JSONL)", ordered_jsonl(path), file_name=f"batch_{jid}.jsonl",
+                               mime="application/jsonl", key="batch_download")
 
 # ==========================================
 # 2. 介面模組 (包含 429 錯誤處理)
@@ -259,124 +601,79 @@ def get_expert_knowledge(query_text, direction="AtoZ"):
 
 def assistant_system(api_key, model_selection):
     st.title("◎ AI 智慧翻譯機")
+    response_cache_panel()
     DREAM_MODEL_NAME = "🧬 Pangcah/'Amis_language_mode"
     available_models = get_verified_models(api_key)
     is_pangcah_mode = (model_selection == DREAM_MODEL_NAME)
     
-    missing_word_protocol = """
-    【特殊協議】
-    1. 僅限使用提供的資料庫。
-    2. 資料格式為壓縮版：
-       - 單詞區 (==V==): 阿美語,中文,詞性|備註
-       - 句型區 (==S==): 阿美語||中文|備註
-    3. 若無對應詞，請保留原文。
-    """
-    
     if is_pangcah_mode:
-        flash_models = [m for m in available_models if 'flash' in m]
-        if flash_models: proxy_model = flash_models[0]
-        else: proxy_model = available_models[0] if available_models else "models/gemini-1.5-flash"
+        proxy_model = pangcah_proxy_model(available_models)
         
         st.info(f"🦅 **Pangcah 模式 (全庫思維)**：正在使用 **{proxy_model}**。(已啟用極限資料壓縮技術)")
         
-        if "pangcah_ready" not in st.session_state: st.session_state.pangcah_ready = False
-        if "pangcah_context" not in st.session_state: st.session_state.pangcah_context = ""
         if "last_translation" not in st.session_state: st.session_state.last_translation = ""
         if "last_input_text" not in st.session_state: st.session_state.last_input_text = ""
 
-        if not st.session_state.pangcah_ready:
-            st.markdown("#### 1. 準備階段")
-            st.write("請先讓模型進行資料庫深度掃描。")
-            if st.button("🚀 執行 Pangcah 資料分析 (讀取全庫)", type="primary"):
-                with st.spinner("正在閱讀並壓縮資料庫..."):
-                    ctx = get_full_database_context()
-                    st.session_state.pangcah_context = ctx
-                    st.session_state.pangcah_ready = True
-                st.rerun()
-        else:
-            st.success("✅ 資料庫分析完成！Pangcah 模型已就緒。")
-            if st.button("🔄 重新分析資料庫 (新增資料後請按此)"):
-                st.session_state.pangcah_ready = False
-                st.rerun()
-            
-            st.divider()
-            st.markdown("#### 2. 測試與互動")
+        if "last_context_info" not in st.session_state: st.session_state.last_context_info = None
+
+        full_ctx = get_full_database_context()
+        st.success(f"✅ Pangcah 模型已就緒。(全庫語境約 {estimate_tokens(full_ctx):,} tokens，資料異動後自動更新)")
+        c_budget, c_full = st.columns([3, 1])
+        budget = c_budget.slider("語境 Token 預算 (依與輸入的相關度挑選單詞/句型)", 2000, 200000, 30000, step=1000)
+        use_full = c_full.checkbox("使用全庫語境 (不裁剪)", value=True)  # 預設與舊版相同送出全庫；取消勾選才依預算裁剪
+        
+        st.divider()
+        st.markdown("#### 測試與互動")
+        
+        user_input = st.text_area("在此輸入您要翻譯或分析的阿美語/中文內容：", height=150)
+        
+        # --- 翻譯按鈕 (含 Error Handling) ---
+        if st.button("🦅 執行翻譯 (不含分析)", type="primary"):
+            if not user_input:
+                st.warning("請輸入內容")
+            elif not api_key:
+                st.warning("請設定 Google API Key")
+            else:
+                try:
+                    with st.spinner(f"Pangcah AI 正在翻譯 (Core: {proxy_model})..."), amis_metrics.span("prompt:translate"):
+                        ctx, ctx_info = get_pangcah_context(user_input, budget, use_full)
+                        full_prompt = translate_prompt(ctx, user_input)
+                        
+                    # 串流顯示，完成後才寫入 last_translation (下方區塊負責正式顯示)
+                    response_text = stream_text(api_key, proxy_model, full_prompt, "translate", keep=False)
+
+                    if response_text:
+                        st.session_state.last_translation = response_text
+                        st.session_state.last_input_text = user_input
+                        st.session_state.last_context_info = ctx_info
+                        st.session_state.last_translation_version = corpus_version()
+                except Exception as e: st.error(f"AI 錯誤：{e}")
+        show_stopped_output("translate")
+
+        if st.session_state.last_translation:
+            st.markdown("---")
+            st.write(st.session_state.last_translation)
+            if st.session_state.last_context_info: st.caption(context_usage_caption(st.session_state.last_context_info))
+            if st.session_state.get("last_translation_version") not in (None, corpus_version()):
+                st.caption("🔄 翻譯之後語料已有更新；重新翻譯即可套用最新的單詞與句型。")
+            timing_caption("translate")
             
-            user_input = st.text_area("在此輸入您要翻譯或分析的阿美語/中文內容：", height=150)
+            st.markdown("#### 🧠 進階指令")
             
-            # --- 翻譯按鈕 (含 Error Handling) ---
-            if st.button("🦅 執行翻譯 (不含分析)", type="primary"):
-                if not user_input:
-                    st.warning("請輸入內容")
-                elif not api_key:
-                    st.warning("請設定 Google API Key")
-                else:
-                    try:
-                        with st.spinner(f"Pangcah AI 正在翻譯 (Core: {proxy_model})..."):
-                            genai.configure(api_key=api_key)
-                            m = genai.GenerativeModel(proxy_model)
-                            formatting_instruction = """
-                            【排版指令】
-                            1. 使用 `### 🦅 翻譯結果` 作為標題。
-                            2. 關鍵句請用 `### :blue[...]` 包裹。
-                            3. 請參考資料庫中的 '備註' (|Note) 來增強翻譯準確度，但不一定要顯示出來。
-                            """
-                            full_prompt = f"{st.session_state.pangcah_context}\n\n{missing_word_protocol}\n\n{formatting_instruction}\n\n使用者輸入: {user_input}"
-                            
-                            try:
-                                response = m.generate_content(full_prompt)
-                            except Exception as e:
-                                # 429 錯誤處理：自動冷卻 60 秒
-                                if "429" in str(e):
-                                    wait_time = 60
-                                    st.toast(f"⏳ 流量滿載 (429)，系統自動冷卻 {wait_time} 秒...", icon="🧊")
-                                    with st.spinner(f"引擎降溫中... 請稍候 {wait_time} 秒"):
-                                        time.sleep(wait_time)
-                                    response = m.generate_content(full_prompt)
-                                else:
-                                    raise e
-
-                            if response:
-                                st.session_state.last_translation = response.text
-                                st.session_state.last_input_text = user_input
-                    except Exception as e: st.error(f"AI 錯誤：{e}")
-
-            if st.session_state.last_translation:
-                st.markdown("---")
-                st.write(st.session_state.last_translation)
-                
-                st.markdown("#### 🧠 進階指令")
-                
-                # --- 對話按鈕 (含 Error Handling) ---
-                if st.button("💬 模擬對話回應", use_container_width=True):
-                    try:
-                        with st.spinner("Pangcah AI 正在思考回應..."):
-                            genai.configure(api_key=api_key)
-                            m = genai.GenerativeModel(proxy_model)
-                            chat_prompt = f"""
-                            {st.session_state.pangcah_context}
-                            【指令】
-                            使用者: "{st.session_state.last_input_text}"
-                            意思: "{st.session_state.last_translation}"
-                            請扮演阿美族耆老(Faki/Fayi)用阿美語回應(附中文)。
-                            排版：阿美語請用 `###` 加大。
-                            """
-                            try:
-                                response_chat = m.generate_content(chat_prompt)
-                            except Exception as e:
-                                if "429" in str(e):
-                                    wait_time = 60
-                                    st.toast(f"⏳ 流量滿載 (429)，系統自動冷卻 {wait_time} 秒...", icon="🧊")
-                                    with st.spinner(f"引擎降溫中... 請稍候 {wait_time} 秒"):
-                                        time.sleep(wait_time)
-                                    response_chat = m.generate_content(chat_prompt)
-                                else:
-                                    raise e
-
-                            if response_chat:
-                                st.markdown("### 💬 AI 對話回應：")
-                                st.write(response_chat.text)
-                    except Exception as e: st.error(f"對話錯誤：{e}")
+            # --- 對話按鈕 (含 Error Handling) ---
+            if st.button("💬 模擬對話回應", use_container_width=True):
+                try:
+                    with st.spinner("Pangcah AI 正在思考回應..."), amis_metrics.span("prompt:chat"):
+                        ctx, ctx_info = get_pangcah_context(f"{st.session_state.last_input_text}\n{st.session_state.last_translation}", budget, use_full)
+                        prompt = chat_prompt(ctx, st.session_state.last_input_text, st.session_state.last_translation)
+                    st.markdown("### 💬 AI 對話回應：")
+                    response_chat = stream_text(api_key, proxy_model, prompt, "chat")
+
+                    if response_chat:
+                        st.caption(context_usage_caption(ctx_info))
+                        timing_caption("chat")
+                except Exception as e: st.error(f"對話錯誤：{e}")
+            show_stopped_output("chat")
 
     else:
         # --- 一般模式 (Standard RAG) ---
@@ -390,51 +687,77 @@ def assistant_system(api_key, model_selection):
             q = st.text_area(f"在此輸入句子", height=150)
             submit_search = st.form_submit_button("🚀 1. 查詢語料庫", type="primary")
         if submit_search and q:
-            f, w, s, r = get_expert_knowledge(q, direction)
-            st.session_state.rag_result = (f, w, s, r)
+            st.session_state.rag_key = (q, direction, corpus_version())
+            st.session_state.rag_result = get_expert_knowledge(q, direction)
             st.session_state.last_query = q
+        elif st.session_state.rag_result and st.session_state.get("rag_key") and st.session_state.rag_key[2] != corpus_version():
+            # 語料在查詢之後被 (任何 session) 修改過：以同樣的輸入重新檢索
+            rq, rdir, _ = st.session_state.rag_key
+            st.session_state.rag_key = (rq, rdir, corpus_version())
+            st.session_state.rag_result = get_expert_knowledge(rq, rdir)
+            st.toast("🔄 語料已更新，查詢結果已重新整理")
         st.divider()
         if st.session_state.rag_result:
             f, w, s, r = st.session_state.rag_result
             if f: st.success(f"### 🏆 專家翻譯：\n**{f}**")
+            tm_hits = [item for item in s if item.get("pct") is not None]
+            if tm_hits:
+                with st.expander(f"🧠 翻譯記憶 (模糊比對 {len(tm_hits)} 筆)", expanded=True):
+                    for item in tm_hits:
+                        st.markdown(f"> **{item['amis']}**　`{item['pct']:.0f}%`\n> ({item['chinese']})")
+                s = [item for item in s if item.get("pct") is None]
             if w:
                 with st.expander(f"📚 相關單詞 ({len(w)} 筆)", expanded=True):
-                    for item in w: st.markdown(f"- **{item['amis']}** ⮕ {item['chinese']} ({item['pos']})")
+                    for item in w:
+                        reason = f"　`{item['match']}`" if item.get("match") else ""
+                        st.markdown(f"- **{item['amis']}** ⮕ {item['chinese']} ({item['pos']}){reason}")
             if s:
                 with st.expander(f"🗣️ 相關例句 ({len(s)} 筆)", expanded=True):
-                    for item in s: st.markdown(f"> **{item['amis']}**\n> ({item['chinese']})")
+                    for item in s:
+                        score = f"　`相似度 {item['score']:.2f}`" if item.get("score") is not None else ""
+                        st.markdown(f"> **{item['amis']}**{score}\n> ({item['chinese']})")
             st.divider()
             st.markdown("### 🤖 AI 協同分析")
             if st.button("🦅 執行 AI 語法分析"):
                 if not api_key: st.warning("請設定 API Key")
                 else:
                     try:
-                        with st.spinner(f"正在呼叫 {actual_model} ..."):
-                            genai.configure(api_key=api_key)
-                            m = genai.GenerativeModel(actual_model)
-                            final_prompt = f"{r}\n\n{missing_word_protocol}\n\n請根據以上提供的【阿美語語料庫】，對以下句子進行詳細語法與語意分析。\n\n使用者輸入: {st.session_state.last_query}"
-                            try:
-                                response = m.generate_content(final_prompt)
-                            except Exception as e:
-                                if "429" in str(e):
-                                    time.sleep(60) # 簡易冷卻
-                                    response = m.generate_content(final_prompt)
-                                else: raise e
-
-                            if response:
-                                st.markdown("#### 🦅 AI 分析報告：")
-                                st.write(response.text)
+                        with amis_metrics.span("prompt:analysis"):
+                            final_prompt = analysis_prompt(r, st.session_state.last_query)
+                        st.markdown("#### 🦅 AI 分析報告：")
+                        st.caption(f"正在呼叫 {actual_model} ...")
+                        response_text = stream_text(api_key, actual_model, final_prompt, "analysis")
+
+                        if response_text: timing_caption("analysis")
                     except Exception as e: st.error(f"⚠️ AI 錯誤：{e}")
+            show_stopped_output("analysis")
+
+    st.divider()
+    batch_panel(api_key, proxy_model if is_pangcah_mode else model_selection, MISSING_WORD_PROTOCOL)
 
 # ==========================================
 # 3. 主控台
 # ==========================================
 
+CORPUS_POLL_SECONDS = 10
+
+@st.fragment(run_every=CORPUS_POLL_SECONDS)
+def corpus_watch():
+    """
+    【跨 session 更新】每隔幾秒讀一次資料版本 (table_versions，由觸發器遞增，任何連線/程序寫入都會改變)。
+    本 session 的檢索結果是用舊版本算出來的就重跑整頁 (每個新版本最多一次)，讓它自動重新整理；否則什麼都不做。
+    """
+    key = st.session_state.get("rag_key")
+    if not (key and st.session_state.get("rag_result")): return
+    v = corpus_version()
+    if v == key[2] or v == st.session_state.get("watch_version"): return
+    st.session_state.watch_version = v
+    st.rerun()
+
 def main():
-    with sqlite3.connect('amis_data.db') as conn:
-        conn.execute('CREATE TABLE IF NOT EXISTS sentence_pairs (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TIMESTAMP, output_sentencepattern_amis TEXT, output_sentencepattern_chinese TEXT, note TEXT)')
-        conn.execute('CREATE TABLE IF NOT EXISTS vocabulary (id INTEGER PRIMARY KEY AUTOINCREMENT, amis TEXT, chinese TEXT, english TEXT, part_of_speech TEXT, note TEXT, created_at TIMESTAMP)')
-        conn.execute('CREATE TABLE IF NOT EXISTS pos_tags (tag_name TEXT PRIMARY KEY, sort_order INTEGER DEFAULT 0)')
+    with amis_metrics.span("bootstrap"):
+        bootstrap_schema()
+    corpus_watch()
     st.sidebar.title("🦅 系統選單")
     
     with st.sidebar.expander("📂 資料庫救援中心", expanded=True):
@@ -442,8 +765,9 @@ def main():
         uploaded_db = st.file_uploader("上傳 amis_data.db", type=["db"])
         if uploaded_db is not None:
             if st.button("🚨 確認覆蓋並還原資料庫"):
-                with open("amis_data.db", "wb") as f:
-                    f.write(uploaded_db.getbuffer())
+                get_db().restore_from_bytes(uploaded_db.getbuffer())
+                get_core().invalidate()
+                bootstrap_schema.clear()
                 st.success("✅ 資料庫還原成功！請重新整理頁面。")
                 time.sleep(2)
                 st.rerun()
@@ -451,13 +775,20 @@ def main():
     with st.sidebar.container():
         st.info("☁️ **行動同步中心**")
         if st.sidebar.button("🔄 立即將資料備份回 GitHub", type="primary"):
-            backup_to_github()
+            backup_now()
+        worker = get_backup_worker()
+        if worker:
+            bs = worker.status()
+            state = {"idle": "✅ 閒置", "waiting": "⏳ 等待合併", "running": "☁️ 上傳中"}.get(bs["state"], bs["state"])
+            st.sidebar.caption(f"備份佇列：{state}｜待處理 {bs['queued']}｜已合併 {bs['coalesced']} 次｜模式 {bs['mode']}")
+            if bs["last_ok"]: st.sidebar.caption(f"上次成功：{bs['last_ok']} ({bs['last_bytes'] / 1024:.0f} KB, {bs['last_seconds']} 秒)")
+            if bs["last_error"]: st.sidebar.caption(f"⚠️ 上次失敗：{bs['last_error']}")
     
     default_key = st.secrets.get("GOOGLE_API_KEY", "")
     key = st.sidebar.text_input("Google API Key", type="password", value=st.session_state.get("api_key", default_key))
     
     if key != st.session_state.get("api_key"): 
-        st.session_state["api_key"] = key; st.cache_resource.clear(); st.rerun()
+        st.session_state["api_key"] = key; st.rerun()
     
     raw_ms = get_verified_models(key)
     ms = []
@@ -469,6 +800,7 @@ def main():
     
     st.sidebar.divider()
     page = st.sidebar.radio("功能模式", ["🏠 系統首頁", "◎ AI 智慧助理", "🔐 句型：專家資料庫", "📖 單詞：語料庫管理", "🏷️ 語法標籤管理", "🎓 語料匯出"])
+    amis_metrics.set_label(page)
     
     if page == "🏠 系統首頁":
         st.markdown("<h1 style='text-align: center; font-size: 5rem;'>🦅</h1>", unsafe_allow_html=True)
@@ -484,48 +816,41 @@ def main():
             c1, c2, c3 = st.columns(3)
             a, c, n = c1.text_input("阿美語"), c2.text_input("中文"), c3.text_input("備註")
             if st.form_submit_button("➕ 儲存新句型"):
-                if a and c: 
-                    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    run_query("INSERT INTO sentence_pairs (output_sentencepattern_amis, output_sentencepattern_chinese, note, created_at) VALUES (?,?,?,?)", (a, c, n, now))
-                    sync_vocabulary(a); reorder_ids("sentence_pairs"); backup_to_github(); st.rerun()
-        with sqlite3.connect('amis_data.db') as conn: df = pd.read_sql("SELECT * FROM sentence_pairs ORDER BY id DESC", conn)
-        edited_df = st.data_editor(df, use_container_width=True, num_rows="dynamic", hide_index=True)
+                if a and c:
+                    # 先查近似重複：有的話列出來，由使用者決定是否仍要儲存
+                    dups = dedup_index().similar(get_db().connection(), a, c)
+                    if dups: st.session_state.pending_sentence = {"amis": a, "chinese": c, "note": n, "dups": dups}
+                    else: add_sentence(a, c, n); st.rerun()
+        pending = st.session_state.get("pending_sentence")
+        if pending:
+            st.warning(f"⚠️ 「{pending['amis']}」和既有的 {len(pending['dups'])} 個句型幾乎相同：")
+            st.dataframe(pd.DataFrame([{"id": d["id"], "阿美語": d["amis"], "中文": d["chinese"], "備註": d["note"], "相似度": d["jaccard"]} for d in pending["dups"]]),
+                         use_container_width=True, hide_index=True)
+            b1, b2, _ = st.columns([1, 1, 4])
+            if b1.button("仍要儲存", type="primary"):
+                st.session_state.pending_sentence = None
+                add_sentence(pending["amis"], pending["chinese"], pending["note"]); st.rerun()
+            if b2.button("取消"):
+                st.session_state.pending_sentence = None; st.rerun()
+        df, page_tag = paged_browser("sent", "sentence_pairs", ["output_sentencepattern_amis", "output_sentencepattern_chinese", "note"])
+        editor_name = f"sentence_editor_{page_tag}"
+        df = editor_base(editor_name, df)
+        st.data_editor(df, use_container_width=True, num_rows="dynamic", hide_index=True,
+                       column_config={"_rowid": None, "id": st.column_config.NumberColumn(disabled=True)},
+                       key=editor_key(editor_name))
         
         col_save, col_download = st.columns([1, 4])
         with col_save:
             if st.button("💾 儲存修改"):
-                with sqlite3.connect('amis_data.db') as conn: edited_df.to_sql('sentence_pairs', conn, if_exists='replace', index=False)
-                reorder_ids("sentence_pairs"); backup_to_github(); st.rerun()
+                res = save_editor('sentence_pairs', df, editor_name)
+                if saved_anything(res): backup_to_github("句型修改")
+                st.toast(save_summary(res)); st.rerun()
         with col_download:
-            csv_data = edited_df.to_csv(index=False).encode('utf-8-sig')
-            st.download_button("📥 下載 Excel/CSV", csv_data, f'amis_sentences_{datetime.now().strftime("%Y%m%d")}.csv', 'text/csv')
+            export_buttons("sentence_pairs", "sent_dl", f'amis_sentences_{datetime.now().strftime("%Y%m%d")}', formats=("csv",))
 
-        # --- 新增區塊：上傳覆蓋 ---
         st.markdown("---")
-        with st.expander("📂 批次匯入/還原 (上傳 CSV)", expanded=False):
-            st.error("⚠️ 危險操作：上傳 CSV 將會【完全覆蓋】並刪除現有的句型資料！")
-            uploaded_csv = st.file_uploader("請選擇要上傳的 CSV 檔 (句型)", type=["csv"])
-            if uploaded_csv is not None:
-                if st.button("🚨 確認覆蓋並匯入句型", type="primary"):
-                    try:
-                        df_upload = pd.read_csv(uploaded_csv)
-                        # 檢查必要欄位
-                        required = ['output_sentencepattern_amis', 'output_sentencepattern_chinese']
-                        if not all(col in df_upload.columns for col in required):
-                            st.error(f"❌ 格式錯誤！CSV 必須包含這些欄位: {required}")
-                        else:
-                            # 補齊欄位
-                            if 'note' not in df_upload.columns: df_upload['note'] = ""
-                            if 'created_at' not in df_upload.columns: df_upload['created_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            
-                            with sqlite3.connect('amis_data.db') as conn:
-                                df_upload.to_sql('sentence_pairs', conn, if_exists='replace', index=False)
-                            reorder_ids("sentence_pairs")
-                            backup_to_github()
-                            st.success(f"✅ 成功匯入 {len(df_upload)} 筆句型！(舊資料已覆蓋)")
-                            time.sleep(2); st.rerun()
-                    except Exception as e:
-                        st.error(f"匯入失敗: {e}")
+        csv_import_panel("sentence_pairs", "句型")
+        dedup_review_panel()
 
     elif page == "📖 單詞：語料庫管理":
         st.title("📖 單詞語料庫管理")
@@ -537,48 +862,29 @@ def main():
             if st.form_submit_button("➕ 儲存新單詞"):
                 if a_in:
                     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    run_query("INSERT INTO vocabulary (amis, chinese, part_of_speech, created_at) VALUES (?,?,?,?)", (a_in, c_in, p_in, now))
-                    reorder_ids("vocabulary"); backup_to_github(); st.rerun()
+                    write(amis_db.insert_dense, get_db(), "vocabulary", {"amis": a_in, "chinese": c_in, "part_of_speech": p_in, "created_at": now})
+                    backup_to_github("新增單詞"); st.rerun()
         st.divider()
-        with sqlite3.connect('amis_data.db') as conn: df = pd.read_sql("SELECT * FROM vocabulary ORDER BY id DESC", conn)
-        edited_df = st.data_editor(df, use_container_width=True, num_rows="dynamic",
-            column_config={"part_of_speech": st.column_config.SelectboxColumn("詞類 (搜尋選單)", options=raw_tags, required=True)})
+        pos_filter = st.multiselect("篩選詞類", options=raw_tags, key="vocab_pos_filter")
+        df, page_tag = paged_browser("vocab", "vocabulary", ["amis", "chinese", "english", "note"], {"part_of_speech": pos_filter})
+        editor_name = f"vocab_editor_{page_tag}"
+        df = editor_base(editor_name, df)
+        st.data_editor(df, use_container_width=True, num_rows="dynamic", hide_index=True,
+            column_config={"_rowid": None, "id": st.column_config.NumberColumn(disabled=True),
+                           "part_of_speech": st.column_config.SelectboxColumn("詞類 (搜尋選單)", options=raw_tags, required=True)},
+            key=editor_key(editor_name))
         
         col_save, col_download = st.columns([1, 4])
         with col_save:
             if st.button("💾 儲存修改"):
-                with sqlite3.connect('amis_data.db') as conn: edited_df.to_sql('vocabulary', conn, if_exists='replace', index=False)
-                reorder_ids("vocabulary"); backup_to_github(); st.rerun()
+                res = save_editor('vocabulary', df, editor_name)
+                if saved_anything(res): backup_to_github("單詞修改")
+                st.toast(save_summary(res)); st.rerun()
         with col_download:
-            csv_data = edited_df.to_csv(index=False).encode('utf-8-sig')
-            st.download_button("📥 下載 Excel/CSV", csv_data, f'amis_vocabulary_{datetime.now().strftime("%Y%m%d")}.csv', 'text/csv')
+            export_buttons("vocabulary", "vocab_dl", f'amis_vocabulary_{datetime.now().strftime("%Y%m%d")}', formats=("csv",))
 
-        # --- 新增區塊：上傳覆蓋 ---
         st.markdown("---")
-        with st.expander("📂 批次匯入/還原 (上傳 CSV)", expanded=False):
-            st.error("⚠️ 危險操作：上傳 CSV 將會【完全覆蓋】並刪除現有的單詞資料！")
-            uploaded_csv_v = st.file_uploader("請選擇要上傳的 CSV 檔 (單詞)", type=["csv"])
-            if uploaded_csv_v is not None:
-                if st.button("🚨 確認覆蓋並匯入單詞", type="primary"):
-                    try:
-                        df_upload = pd.read_csv(uploaded_csv_v)
-                        # 檢查必要欄位
-                        required = ['amis', 'chinese', 'part_of_speech']
-                        if not all(col in df_upload.columns for col in required):
-                            st.error(f"❌ 格式錯誤！CSV 必須包含這些欄位: {required}")
-                        else:
-                            # 補齊欄位
-                            if 'note' not in df_upload.columns: df_upload['note'] = ""
-                            if 'created_at' not in df_upload.columns: df_upload['created_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            
-                            with sqlite3.connect('amis_data.db') as conn:
-                                df_upload.to_sql('vocabulary', conn, if_exists='replace', index=False)
-                            reorder_ids("vocabulary")
-                            backup_to_github()
-                            st.success(f"✅ 成功匯入 {len(df_upload)} 筆單詞！(舊資料已覆蓋)")
-                            time.sleep(2); st.rerun()
-                    except Exception as e:
-                        st.error(f"匯入失敗: {e}")
+        csv_import_panel("vocabulary", "單詞")
 
     elif page == "🏷️ 語法標籤管理":
         st.title("🏷️ 標籤管理 (Tag Alignment)")
@@ -590,40 +896,39 @@ def main():
             if st.button("🔄 執行更名與連動更新"):
                 if old_tag and new_tag_name and old_tag != new_tag_name:
                     try:
-                        with sqlite3.connect('amis_data.db') as conn:
-                            conn.execute("UPDATE vocabulary SET part_of_speech = ? WHERE part_of_speech = ?", (new_tag_name, old_tag))
-                            conn.execute("INSERT OR IGNORE INTO pos_tags (tag_name) VALUES (?)", (new_tag_name,))
-                            conn.execute("DELETE FROM pos_tags WHERE tag_name = ?", (old_tag,))
+                        write(rename_tag, old_tag, new_tag_name)
+                        get_corpus_index().invalidate("vocabulary")
                         st.success(f"✅ 成功將 '{old_tag}' 更名為 '{new_tag_name}'，並更新了相關單詞！")
-                        backup_to_github(); time.sleep(1.5); st.rerun()
+                        backup_to_github("標籤更名"); time.sleep(1.5); st.rerun()
                     except Exception as e: st.error(f"更新失敗: {e}")
         st.divider()
         with st.form("t"):
             nt = st.text_input("新增標籤名稱")
             if st.form_submit_button("新增"): 
                 run_query("INSERT OR REPLACE INTO pos_tags (tag_name) VALUES (?)", (nt,)) 
-                backup_to_github(); st.rerun()
-        with sqlite3.connect('amis_data.db') as conn: 
-            df_tags = pd.read_sql("SELECT * FROM pos_tags", conn)
-        if "description" not in df_tags.columns: df_tags["description"] = "" 
-        cols_order = ["tag_name", "description", "sort_order"]
+                backup_to_github("新增標籤"); st.rerun()
+        df_tags = pd.read_sql("SELECT rowid AS _rowid, * FROM pos_tags", get_db().connection())
+        cols_order = ["_rowid", "tag_name", "description", "sort_order"]
         existing_cols = [c for c in cols_order if c in df_tags.columns]
         remaining_cols = [c for c in df_tags.columns if c not in existing_cols]
-        df_tags = df_tags[existing_cols + remaining_cols]
+        df_tags = editor_base("tag_editor", df_tags[existing_cols + remaining_cols])
         et = st.data_editor(
             df_tags, 
             use_container_width=True, 
             num_rows="dynamic",
+            hide_index=True,
+            key=editor_key("tag_editor"),
             column_config={
+                "_rowid": None,
                 "tag_name": st.column_config.TextColumn("語法標籤名稱", disabled=True), 
                 "description": st.column_config.TextColumn("備註 (LLM 定義校準)", help="在此說明此標籤與大語言模型通用定義的差異", width="large"),
                 "sort_order": st.column_config.NumberColumn("排序權重")
             }
         )
         if st.button("💾 儲存標籤與備註"):
-            with sqlite3.connect('amis_data.db') as conn: 
-                et.to_sql('pos_tags', conn, if_exists='replace', index=False)
-            backup_to_github(); st.success("已存檔！資料庫結構已自動更新。"); st.rerun()
+            res = save_editor('pos_tags', df_tags, "tag_editor")
+            if saved_anything(res): backup_to_github("標籤修改")
+            st.toast(save_summary(res)); st.rerun()
 
     elif page == "🎓 語料匯出":
         st.title("🎓 語料匯出與戰略進度")
@@ -636,16 +941,39 @@ def main():
         st.divider()
         tab1, tab2 = st.tabs(["📝 句型", "📖 單詞"])
         with tab1:
-            with sqlite3.connect('amis_data.db') as conn: df = pd.read_sql("SELECT * FROM sentence_pairs", conn)
-            st.dataframe(df, use_container_width=True)
-            c1, c2 = st.columns(2)
-            with c1: st.download_button("📥 下載 JSONL", df.to_json(orient="records", lines=True, force_ascii=False), "amis_sentences.jsonl")
-            with c2: st.download_button("📊 下載 CSV (Excel)", df.to_csv(index=False).encode('utf-8-sig'), "amis_sentences.csv", "text/csv")
+            df, _ = paged_browser("exp_sent", "sentence_pairs", ["output_sentencepattern_amis", "output_sentencepattern_chinese", "note"])
+            st.dataframe(df.drop(columns="_rowid"), use_container_width=True, hide_index=True)
+            export_buttons("sentence_pairs", "exp_sent_dl", "amis_sentences")
         with tab2:
-            with sqlite3.connect('amis_data.db') as conn: df_v = pd.read_sql("SELECT * FROM vocabulary", conn)
-            st.dataframe(df_v, use_container_width=True)
-            c1, c2 = st.columns(2)
-            with c1: st.download_button("📥 下載 JSONL", df_v.to_json(orient="records", lines=True, force_ascii=False), "amis_vocabulary.jsonl")
-            with c2: st.download_button("📊 下載 CSV (Excel)", df_v.to_csv(index=False).encode('utf-8-sig'), "amis_vocabulary.csv", "text/csv")
+            df_v, _ = paged_browser("exp_vocab", "vocabulary", ["amis", "chinese", "english", "note"])
+            st.dataframe(df_v.drop(columns="_rowid"), use_container_width=True, hide_index=True)
+            export_buttons("vocabulary", "exp_vocab_dl", "amis_vocabulary")
+        st.divider()
+        finetune_panel()
 
-if __name__ == "__main__": main()
+    metrics_panel()
+
+@st.cache_resource(show_spinner=False)
+def get_startup():
+    """程序層級的啟動紀錄 (程序啟動時間、第一個頁面完成的時間)。"""
+    return {"process_started": amis_metrics.process_started(), "first_page_ms": None, "first_run_ms": None, "page": None}
+
+def instrumented_main():
+    """每次重跑開一筆效能紀錄 (可選取樣分析器)；不論正常結束、st.rerun 或例外都會存入共用紀錄。"""
+    if "metrics_session" not in st.session_state: st.session_state.metrics_session = uuid.uuid4().hex[:8]
+    run = amis_metrics.start_run(meta={"session": st.session_state.metrics_session, **amis_metrics.deployment_meta()})
+    profiler = amis_metrics.SamplingProfiler().start() if st.session_state.get("profiler_on") else None
+    try:
+        main()
+        startup = get_startup()
+        if startup["first_page_ms"] is None:
+            # 本程序第一次完整畫出頁面：記錄冷啟動時間 (含一次性的建表檢查、模型清單、索引建立)
+            now = time.time()
+            startup.update(first_page_ms=round((now - startup["process_started"]) * 1000, 1),
+                           first_run_ms=round((now - run.at) * 1000, 1), page=run.label)
+            run.meta.update(cold_start_ms=startup["first_page_ms"], first_run_ms=startup["first_run_ms"])
+    finally:
+        if profiler: run.profile = profiler.stop()
+        get_run_history().add(amis_metrics.end_run())
+
+if __name__ == "__main__": instrumented_main()
@@ -0,0 +1,122 @@
+"""
+【HTTP API 負載測試】
+在暫存資料庫上啟動 amis_server (假後端，不呼叫外部服務)，以數百個並行客戶端 (asyncio，keep-alive 連線)
+送出 lookup / translate / analyze 的混合請求，比較開啟與關閉在飛請求合併：
+
+    python -m benchmarks.api_load                               # 100,300 個並行客戶端 × 兩種模式
+    python -m benchmarks.api_load --clients 500 --requests 3000 --distinct 50 --latency 0.5
+
+請求內容從 distinct 句中抽取 (熱門句子較常出現)，所以同一句常同時在飛。
+每次執行使用新的回應快取與檢索快取，輸出吞吐量、延遲百分位數、錯誤數、合併數、實際的模型呼叫次數
+與快取命中數 (回應/檢索)。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from amis_core import AmisCore
+from amis_llm import FakeBackend
+from amis_server import ApiServer
+from benchmarks import synth
+from benchmarks.bench import SIZES, percentile
+
+MIX = (("/lookup", 0.5), ("/translate", 0.35), ("/analyze", 0.15))
+
+
+async def request(reader, writer, path, body):
+    data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    size = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""): break
+        k, _, v = line.decode("latin-1").partition(":")
+        if k.lower() == "content-length": size = int(v)
+    await reader.readexactly(size)
+    return status
+
+
+async def run_mode(path, coalesce, clients, total, texts, latency, workers, seed=1):
+    workdir = os.path.dirname(path)
+    backend = FakeBackend(latency=latency)
+    core = AmisCore(path, backend=backend, cache_path=os.path.join(workdir, f"cache_{coalesce}_{clients}.db"),
+                    vectors_dir=os.path.join(workdir, "vectors"), rpm=10 ** 6, tpm=10 ** 12)
+    core.bootstrap()       # 寫入執行緒建立 FTS/詞幹表/翻譯記憶/向量等
+    core.lookup(texts[0])  # 暖倒排索引與連線，不計入延遲
+    server = ApiServer(core, "fake-flash", workers, coalesce=coalesce)
+    port = await server.start("127.0.0.1", 0)
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(len(texts))]
+    jobs = [(rng.choices([p for p, _ in MIX], [w for _, w in MIX])[0], rng.choices(texts, weights)[0]) for _ in range(total)]
+    queue = iter(jobs)
+    lat, statuses = [], {}
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            for p, text in queue:
+                t0 = time.perf_counter()
+                status = await request(reader, writer, p, {"text": text})
+                lat.append((time.perf_counter() - t0) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    wall = time.perf_counter() - t0
+    st = server.status()
+    await server.close()
+    core.db.close_all()
+    core.responses.db.close_all()
+    ok = statuses.get(200, 0)
+    return {"coalesce": coalesce, "clients": clients, "requests": total, "ok": ok, "errors": total - ok,
+            "seconds": round(wall, 3), "req_per_s": round(total / wall, 1), "p50_ms": round(percentile(lat, 50), 2),
+            "p95_ms": round(percentile(lat, 95), 2), "p99_ms": round(percentile(lat, 99), 2), "max_ms": round(max(lat), 2),
+            "coalesced": st["coalescer"]["coalesced"], "model_calls": backend.calls,
+            "cache_hits": st["core"]["responses"]["hits"], "retrieval_hits": st["core"]["retrieval"]["hits"]}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Amis AI HTTP API 負載測試")
+    ap.add_argument("--size", default="10k", choices=list(SIZES))
+    ap.add_argument("--clients", default="100,300", help="逗號分隔的並行客戶端數")
+    ap.add_argument("--requests", type=int, default=2000, help="每次執行的總請求數")
+    ap.add_argument("--distinct", type=int, default=40, help="不同句子的數量 (越少重複越多)")
+    ap.add_argument("--latency", type=float, default=0.2, help="假後端每次呼叫的延遲 (秒)")
+    ap.add_argument("--workers", type=int, default=32, help="伺服器執行緒池大小")
+    ap.add_argument("--mode", default="coalesce,direct")
+    ap.add_argument("--out", default="", help="另存結果 (JSON)")
+    args = ap.parse_args(argv)
+
+    rows = SIZES[args.size]
+    workdir = tempfile.mkdtemp(prefix="amis_api_load_")
+    results = []
+    try:
+        path = os.path.join(workdir, "api.db")
+        samples = synth.generate(path, rows, rows)
+        texts = (samples["sample_sentences"] + samples["sample_glosses"])[:args.distinct]
+        for clients in [int(c) for c in args.clients.split(",") if c.strip()]:
+            for mode in [m.strip() for m in args.mode.split(",") if m.strip()]:
+                r = asyncio.run(run_mode(path, mode == "coalesce", clients, args.requests, texts, args.latency, args.workers))
+                results.append(r)
+                print(f"[{mode:<8} ×{clients:>4}] {r['req_per_s']:>8.1f} 次/秒  p50 {r['p50_ms']:>8.2f} ms  p95 {r['p95_ms']:>8.2f} ms  "
+                      f"p99 {r['p99_ms']:>8.2f} ms  錯誤 {r['errors']:>4}  合併 {r['coalesced']:>5}  模型呼叫 {r['model_calls']:>5}  快取命中 {r['cache_hits']:>5}/{r['retrieval_hits']:>5}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+【基準測試】
+在暫存資料庫上 (不經過 Streamlit) 測量檢索與寫入路徑的延遲百分位數、每次呼叫的 SQL 數與記憶體峰值。
+
+    python -m benchmarks.bench                          # 10k，與 baseline 比較
+    python -m benchmarks.bench --sizes 10k,100k,1m      # 更大的合成語料
+    python -m benchmarks.bench --update                 # 以本次結果覆寫 baseline
+    python -m benchmarks.bench --only retrieval_atoz,csv_import
+
+任何指標超過 baseline × threshold (且超過最小差距) 即視為退化，程式以 exit code 1 結束。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import amis_db
+import amis_retrieval
+from amis_context import ContextCache, build_budgeted_context
+from amis_db import Database
+from amis_dedup import NearDuplicateIndex
+from amis_import import CsvImporter
+from amis_index import CorpusIndex
+from amis_tm import TranslationMemory
+from amis_vectors import SentenceVectors
+from benchmarks import synth
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# 退化判定：比值超過 threshold 且絕對差距超過下列下限 (避免微秒級雜訊誤報)
+MIN_DELTA = {"p50_ms": 2.0, "p95_ms": 5.0, "queries_per_call": 1.0, "peak_mem_mb": 2.0}
+
+
+class QueryCounter:
+    """以 sqlite3 trace callback 計算頂層 SQL 數 (觸發器內的語句以 "--" 開頭，不計入)。"""
+
+    def __init__(self, conn):
+        self.n = 0
+        conn.set_trace_callback(self._hit)
+
+    def _hit(self, sql):
+        if not sql.lstrip().startswith("--"): self.n += 1
+
+
+def percentile(values, q):
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, round(q / 100 * (len(s) - 1))))]
+
+
+def measure(fn, iterations, counter, warmup=1):
+    """
+    先暖身，再計時 iterations 次；記憶體峰值另外在 tracemalloc 下多跑一次取得
+    (tracemalloc 會拖慢執行，不與延遲一起量)。
+    """
+    for i in range(warmup): fn(-1 - i)
+    counter.n = 0
+    lat = []
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(i)
+        lat.append((time.perf_counter() - t0) * 1000)
+    queries = counter.n / iterations
+    tracemalloc.start()
+    try:
+        fn(iterations)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"n": iterations, "p50_ms": round(percentile(lat, 50), 3), "p95_ms": round(percentile(lat, 95), 3),
+            "p99_ms": round(percentile(lat, 99), 3), "max_ms": round(max(lat), 3), "mean_ms": round(statistics.fmean(lat), 3),
+            "queries_per_call": round(queries, 2), "peak_mem_mb": round(peak / 1e6, 3)}
+
+
+# ---------- 各項基準 ----------
+
+def build_cases(db, samples, rows, vectors, tm, dup):
+    """回傳 [(名稱, 次數, 呼叫函式)]；次數依語料大小縮放，重量級項目固定少量。"""
+    rng = random.Random(1)
+    index = CorpusIndex()
+    get_index = lambda: (index.refresh(lambda sql, params: db.query(sql, params), amis_db.table_versions(db)), index)[1]
+    warm = ContextCache()
+    sents, glosses = samples["sample_sentences"], samples["sample_glosses"]
+    light = 50 if rows <= 10_000 else 20
+    heavy = 3
+    fresh = iter(range(10 ** 9))
+
+    def retrieval_atoz(i): amis_retrieval.expert_knowledge(db, sents[i % len(sents)], "AtoZ", index=get_index, vectors=vectors, tm=tm)
+    def retrieval_ztoa(i): amis_retrieval.expert_knowledge(db, glosses[i % len(glosses)], "ZtoA", index=get_index, vectors=vectors, tm=tm)
+    def semantic_search(i):
+        # 一次批次：整句 + 7 個中文釋義探針
+        vectors.search([("amis", sents[i % len(sents)])] + [("chinese", glosses[(i + j) % len(glosses)]) for j in range(7)])
+    def tm_lookup(i):
+        # 整句改動幾個字元 (模擬錯字/詞綴變化) 後查精確 + 模糊兩層，兩個方向各一次
+        s = sents[i % len(sents)]
+        tm.lookup(db.connection(), s[:-4] + "ay" + s[-4:], "AtoZ")
+        tm.lookup(db.connection(), glosses[i % len(glosses)] + "的", "ZtoA")
+    def near_dup_check(i):
+        # 「➕ 儲存新句型」前的檢查：只差標點/空白的既有句型
+        dup.similar(db.connection(), sents[i % len(sents)].rstrip(".") + " !", glosses[i % len(glosses)])
+    def near_dup_scan(i): dup.clusters(db.connection())
+    def full_context_cold(i): ContextCache().get(db)
+    def full_context_warm(i): warm.get(db)
+    def budgeted_context(i): build_budgeted_context(db, sents[i % len(sents)], 30000)
+
+    def sync_vocabulary(i):
+        n = next(fresh)
+        amis_db.sync_vocabulary(db, f"Mi-bench{n}a ko-bench{n}b {sents[i % len(sents)]}")
+
+    def reorder_ids(i): amis_db.reorder_ids(db, "sentence_pairs")
+
+    def editor_save(i):
+        # 模擬分頁編輯器：一頁 50 列中修改 20 列、新增 2 列、刪除 2 列
+        page, cols, _ = amis_db.fetch_page(db, "vocabulary", page_size=50, after_id=rng.randint(100, rows))
+        rowids = [r[0] for r in page]
+        edited = {p: {"chinese": synth.gloss(rng), "note": f"bench {i}"} for p in rng.sample(range(len(page)), min(20, len(page)))}
+        changes = {"edited_rows": edited, "deleted_rows": list(range(min(2, len(page)))),
+                   "added_rows": [{"amis": f"bench{next(fresh)}", "chinese": synth.gloss(rng)} for _ in range(2)]}
+        amis_db.apply_edits(db, "vocabulary", rowids, changes, defaults={"created_at": "2030-01-01 00:00:00"})
+
+    csv_rows = min(20_000, max(1_000, rows // 10))
+    csv_data = synth.csv_bytes(csv_rows)
+    def csv_import(i): CsvImporter(db, "sentence_pairs", "append").run(io.BytesIO(csv_data))
+
+    return [
+        ("retrieval_atoz", light, retrieval_atoz),
+        ("retrieval_ztoa", light, retrieval_ztoa),
+        ("semantic_search", light, semantic_search),
+        ("tm_lookup", light, tm_lookup),
+        ("near_dup_check", light, near_dup_check),
+        ("near_dup_scan", heavy, near_dup_scan),
+        ("full_context_cold", heavy, full_context_cold),
+        ("full_context_warm", light, full_context_warm),
+        ("budgeted_context", min(light, 10), budgeted_context),
+        ("sync_vocabulary", light, sync_vocabulary),
+        ("reorder_ids", heavy, reorder_ids),
+        ("editor_save", light, editor_save),
+        ("csv_import", heavy, csv_import),
+    ]
+
+
+def run_size(label, workdir, only=None, log=print):
+    rows = SIZES[label]
+    path = os.path.join(workdir, f"bench_{label}.db")
+    t0 = time.perf_counter()
+    samples = synth.generate(path, rows, rows)
+    log(f"[{label}] 產生 {rows:,} 單詞 + {rows:,} 句型：{time.perf_counter() - t0:.1f} 秒")
+    db = Database(path)
+    counter = QueryCounter(db.connection())
+    vectors = SentenceVectors(os.path.join(workdir, f"vectors_{label}"))
+    tm = TranslationMemory()
+    dup = NearDuplicateIndex()
+    out = {}
+    # 建立 FTS 影子表、詞幹表、句型向量、翻譯記憶與近似重複索引 (正式環境由寫入執行緒在啟動時做)：單獨計時
+    t0 = time.perf_counter()
+    with db.transaction() as conn:
+        amis_db.ensure_change_tracking(conn)
+        amis_retrieval.maintain(conn, vectors, tm, dup)
+    out["index_build"] = {"n": 1, "p50_ms": round((time.perf_counter() - t0) * 1000, 3)}
+    log(f"[{label}] index_build {out['index_build']['p50_ms']:.0f} ms")
+    for name, iterations, fn in build_cases(db, samples, rows, vectors, tm, dup):
+        if only and name not in only: continue
+        out[name] = measure(fn, iterations, counter)
+        r = out[name]
+        log(f"[{label}] {name:<18} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms  "
+            f"SQL/次 {r['queries_per_call']:>7.1f}  峰值 {r['peak_mem_mb']:>8.2f} MB")
+    db.close_all()
+    return out
+
+
+# ---------- baseline 比較 ----------
+
+def compare(results, baseline, threshold):
+    """回傳退化清單 [(size, case, metric, baseline, current)]。"""
+    bad = []
+    for size, cases in results.items():
+        for case, cur in cases.items():
+            base = baseline.get("results", {}).get(size, {}).get(case)
+            if not base: continue
+            for metric, floor in MIN_DELTA.items():
+                if metric not in cur or metric not in base: continue
+                if cur[metric] > base[metric] * threshold and cur[metric] - base[metric] > floor:
+                    bad.append((size, case, metric, base[metric], cur[metric]))
+    return bad
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Amis AI 檢索/寫入路徑基準測試")
+    ap.add_argument("--sizes", default="10k", help="逗號分隔：10k,100k,1m")
+    ap.add_argument("--only", default="", help="只跑指定項目 (逗號分隔)")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--update", action="store_true", help="以本次結果覆寫 baseline")
+    ap.add_argument("--threshold", type=float, default=1.5, help="退化判定比值 (預設 1.5 倍)")
+    ap.add_argument("--out", default="", help="另存本次結果 (JSON)")
+    ap.add_argument("--keep", action="store_true", help="保留暫存資料庫")
+    args = ap.parse_args(argv)
+
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown: ap.error(f"未知的大小: {unknown}")
+    only = {s.strip() for s in args.only.split(",") if s.strip()} or None
+    workdir = tempfile.mkdtemp(prefix="amis_bench_")
+    try:
+        results = {s: run_size(s, workdir, only) for s in sizes}
+    finally:
+        if not args.keep: shutil.rmtree(workdir, ignore_errors=True)
+    report = {"meta": {"created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                       "sqlite": sqlite3.sqlite_version, "platform": platform.platform()}, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.update or not os.path.exists(args.baseline):
+        merged = report
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                merged = json.load(f)
+            merged["meta"] = report["meta"]
+            for size, cases in results.items():
+                merged.setdefault("results", {}).setdefault(size, {}).update(cases)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        print(f"baseline 已寫入 {args.baseline}")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    bad = compare(results, baseline, args.threshold)
+    for size, case, metric, base, cur in bad:
+        print(f"❌ 退化 [{size}] {case}.{metric}: {base} -> {cur} (> {args.threshold}×)")
+    if not bad: print(f"✅ 無退化 (threshold {args.threshold}×)")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+【寫入負載測試】
+多個客戶端執行緒同時寫入同一個資料庫 (模擬多個瀏覽器 session)，比較：
+    direct：每個客戶端用自己的連線與交易 (BEGIN IMMEDIATE 搶寫入鎖，靠 busy_timeout 等待)
+    queue ：所有寫入排進 WriteQueue，由單一寫入執行緒分組提交
+
+    python -m benchmarks.load                                   # 1,4,16 個客戶端 × 兩種模式
+    python -m benchmarks.load --clients 8 --ops 300 --mode queue --readers 4
+
+工作組合 (依比例)：新增句型 + 同步單詞、分頁編輯器儲存 (附樂觀鎖，客戶端之間會互相衝突)、整表重排 id。
+輸出每種組合的吞吐量 (次/秒)、延遲百分位數、失敗數 (例如 database is locked) 與樂觀鎖衝突數；
+--readers 另開唯讀執行緒，輪流做分頁讀取與完整的 RAG 檢索 (expert_knowledge，含 FTS、詞幹表、向量、翻譯記憶)，
+量測寫入壓力下的讀取延遲與失敗數。檢索索引的維護：queue 模式在每批提交後由寫入執行緒進行，
+direct 模式在各客戶端自己的寫入交易裡進行。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import amis_db
+import amis_retrieval
+from amis_db import Database
+from amis_dedup import NearDuplicateIndex
+from amis_index import CorpusIndex
+from amis_tm import TranslationMemory
+from amis_vectors import SentenceVectors
+from amis_writer import WriteQueue
+from benchmarks import synth
+from benchmarks.bench import SIZES, percentile
+
+MIX = (("add_sentence", 0.6), ("editor_save", 0.38), ("reorder_ids", 0.02))
+
+
+def add_sentence(db, rng, n):
+    s = f"Mi-load{n} {rng.choice(['ko', 'to', 'a'])} wawa."
+    amis_db.insert_dense(db, "sentence_pairs", {"output_sentencepattern_amis": s, "output_sentencepattern_chinese": synth.gloss(rng, 4, 10),
+                                                "created_at": "2030-01-01 00:00:00"})
+    amis_db.sync_vocabulary(db, s)
+
+
+def read_page(db, rng, rows):
+    """讀一頁並留下讀取時的內容 (樂觀鎖基準)；回傳 (rowids, expected)。"""
+    page, cols, _ = amis_db.fetch_page(db, "vocabulary", page_size=50, after_id=rng.randint(60, min(rows, 400)))
+    return [r[0] for r in page], {r[0]: dict(zip(cols, r)) for r in page}
+
+
+def edit_page(db, rng, rowids, expected, n):
+    edits = {p: {"chinese": synth.gloss(rng), "note": f"load {n}"} for p in rng.sample(range(len(rowids)), min(5, len(rowids)))}
+    return amis_db.apply_edits(db, "vocabulary", rowids, {"edited_rows": edits}, expected=expected)
+
+
+def run_mode(path, mode, clients, ops, readers, rows, texts, timeout=30, seed=1):
+    db = Database(path, timeout=timeout)
+    index, tm, dup = CorpusIndex(), TranslationMemory(), NearDuplicateIndex()
+    vectors = SentenceVectors(os.path.splitext(path)[0] + "_vectors")
+    get_index = lambda: (index.refresh(lambda sql, params: db.query(sql, params), amis_db.table_versions(db)), index)[1]
+    maintain = lambda: amis_retrieval.maintain(db.connection(), vectors, tm, dup)
+    with db.transaction() as conn:
+        amis_db.ensure_change_tracking(conn)
+        maintain()  # 啟動時建立版本追蹤與各檢索索引
+
+    def direct(fn, *args):
+        with db.transaction():
+            out = fn(*args)
+            maintain()
+        return out
+
+    writer = WriteQueue(db, after_batch=maintain) if mode == "queue" else None
+    run = writer.call if writer else direct
+    lat, errors, conflicts, read_lat, read_errors = [], [], [0], [], []
+    lock, stop = threading.Lock(), threading.Event()
+    counter = iter(range(10 ** 9))
+
+    def client(i):
+        rng = random.Random(seed * 1000 + i)
+        mine = []
+        for _ in range(ops):
+            op = rng.choices([m for m, _ in MIX], [w for _, w in MIX])[0]
+            n = next(counter)
+            # 編輯器：先讀頁面 (使用者「看著」舊資料編輯)，寫入時才送出
+            if op == "editor_save": page = read_page(db, rng, rows)
+            t0 = time.perf_counter()
+            try:
+                if op == "add_sentence": run(add_sentence, db, rng, n)
+                elif op == "editor_save":
+                    res = run(edit_page, db, rng, page[0], page[1], n)
+                    with lock: conflicts[0] += len(res["conflicts"])
+                else: run(amis_db.reorder_ids, db, "sentence_pairs")
+            except Exception as e:
+                with lock: errors.append(f"{type(e).__name__}: {e}")
+                continue
+            mine.append((time.perf_counter() - t0) * 1000)
+        with lock: lat.extend(mine)
+
+    def reader(i):
+        rng = random.Random(seed * 7000 + i)
+        mine, n = [], 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                if n % 2: amis_retrieval.expert_knowledge(db, rng.choice(texts), "AtoZ", index=get_index, vectors=vectors, tm=tm)
+                else: read_page(db, rng, rows)
+            except Exception as e:
+                with lock: read_errors.append(f"{type(e).__name__}: {e}")
+            else:
+                mine.append((time.perf_counter() - t0) * 1000)
+            n += 1
+        with lock: read_lat.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    rthreads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in rthreads: t.start()
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    stop.set()
+    for t in rthreads: t.join()
+    db.close_all()
+    out = {"mode": mode, "clients": clients, "ops": clients * ops, "ok": len(lat), "failed": len(errors),
+           "conflicts": conflicts[0], "seconds": round(wall, 3), "ops_per_s": round(len(lat) / wall, 1)}
+    if lat: out.update(p50_ms=round(percentile(lat, 50), 2), p95_ms=round(percentile(lat, 95), 2), p99_ms=round(percentile(lat, 99), 2), max_ms=round(max(lat), 2))
+    if readers: out["read_failed"] = len(read_errors)
+    if read_lat: out.update(read_p50_ms=round(percentile(read_lat, 50), 2), read_p95_ms=round(percentile(read_lat, 95), 2))
+    if writer:
+        ws = writer.status()
+        out.update(avg_batch=ws["avg_batch"], max_batch=ws["max_batch_seen"], commits=ws["batches"])
+    if errors: out["first_error"] = errors[0]
+    if read_errors: out["first_read_error"] = read_errors[0]
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Amis AI 多客戶端寫入負載測試")
+    ap.add_argument("--size", default="10k", choices=list(SIZES))
+    ap.add_argument("--clients", default="1,4,16", help="逗號分隔的客戶端數")
+    ap.add_argument("--ops", type=int, default=100, help="每個客戶端的寫入次數")
+    ap.add_argument("--mode", default="direct,queue")
+    ap.add_argument("--readers", type=int, default=2, help="同時進行的唯讀執行緒數")
+    ap.add_argument("--timeout", type=float, default=30, help="連線的 busy_timeout (秒)；調小可觀察 direct 模式的鎖等待失敗")
+    ap.add_argument("--out", default="", help="另存結果 (JSON)")
+    args = ap.parse_args(argv)
+
+    rows = SIZES[args.size]
+    workdir = tempfile.mkdtemp(prefix="amis_load_")
+    results = []
+    try:
+        seed_db = os.path.join(workdir, "seed.db")
+        texts = synth.generate(seed_db, rows, rows)["sample_sentences"][:50]
+        for clients in [int(c) for c in args.clients.split(",") if c.strip()]:
+            for mode in [m.strip() for m in args.mode.split(",") if m.strip()]:
+                path = os.path.join(workdir, f"{mode}_{clients}.db")
+                shutil.copyfile(seed_db, path)
+                r = run_mode(path, mode, clients, args.ops, args.readers, rows, texts, args.timeout)
+                results.append(r)
+                print(f"[{mode:<6} ×{clients:>3}] {r['ops_per_s']:>8.1f} 次/秒  p50 {r.get('p50_ms', 0):>8.2f} ms  p95 {r.get('p95_ms', 0):>8.2f} ms  "
+                      f"失敗 {r['failed']:>4}  衝突 {r['conflicts']:>4}" + (f"  每批 {r['avg_batch']}" if "avg_batch" in r else "")
+                      + (f"  讀取 p95 {r['read_p95_ms']} ms" if "read_p95_ms" in r else "")
+                      + (f"  讀取失敗 {r['read_failed']}" if "read_failed" in r else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if any(r["failed"] or r.get("read_failed") for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import amis_db
+
+# ==========================================
+# 合成阿美語語料 (基準測試用)
+# ==========================================
+# 以阿美語的音節結構 (C)V(C)、常見詞綴與重疊產生「像阿美語」的詞，
+# 搭配常用漢字組成的中文釋義與備註，分佈接近 amis_data.db。
+
+CONSONANTS = ["p", "t", "k", "'", "f", "s", "h", "m", "n", "ng", "l", "r", "w", "y", "c", "d", "b"]
+VOWELS = ["a", "i", "u", "e", "o"]
+CODAS = ["", "", "", "n", "ng", "l", "y", "w", "'", "s", "t", "c", "k", "d", "h"]
+PREFIXES = ["mi-", "ma-", "pa-", "ka-", "sa-", "pi-", "ni-", "mala-", "paka-"]
+SUFFIXES = ["-an", "-ay", "-en", "", "", ""]
+POS_TAGS = ["名詞 (noun)", "動詞詞根 (verb-root)", "om型_動詞詞根 (om-type_verb-root)", "形容詞 (adjective)",
+            "副詞 (adverb)", "代名詞 (pronoun)", "助詞 (particle)", "數詞 (numeral)"]
+HAN = ("的一是不了人我在有他這中大來上國個到說們為子和你地出道也時年得就那要下以生會自着去之過家學對可她裡後小麼心多天而能好都"
+       "然沒日於起還發成事只作當想看文無開手十用主行方又如前所本見經頭面公同三已老從動兩長知民樣現分將外但身些與高意進把法此實回二理美點"
+       "月明其種聲全工己話兒者向情部正名定女問力機給等幾很業最間新什打便位因重被走電四第門相次東政海口使教西再平真聽世氣信北少關並內加化"
+       "吃喝水山海魚米飯鳥豬狗雨風火田路家族祖先母父孩子朋友唱歌跳舞祭典部落老人年輕")
+NOTE_TEMPLATES = ["來自句型: {s}", "用法：{g}", "同義詞：{w}", "", "", "", "耆老口述 ({y} 年)"]
+
+
+def syllable(rng):
+    return rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(CODAS)
+
+
+def root(rng):
+    return "".join(syllable(rng) for _ in range(rng.choice((2, 2, 2, 3))))
+
+
+def amis_word(rng, roots):
+    """從詞根池取一個詞根，隨機加上前綴、後綴或 CV 重疊。"""
+    r = rng.choice(roots)
+    if rng.random() < 0.15: r = r[:2] + "-" + r
+    return rng.choice(PREFIXES + [""] * 6) + r + rng.choice(SUFFIXES)
+
+
+def gloss(rng, lo=1, hi=4):
+    return "".join(rng.choice(HAN) for _ in range(rng.randint(lo, hi)))
+
+
+def sentence(rng, roots, lo=3, hi=9):
+    words = [amis_word(rng, roots) for _ in range(rng.randint(lo, hi))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice(".?!.")
+
+
+def generate(path, n_vocab, n_sent, seed=42, batch=20000):
+    """
+    建立 path 的合成資料庫 (表結構與 app 相同)。
+    詞根池約為單詞數的 1/3，讓不同單詞與句子之間共享詞根 (查詢才會有真實的命中分佈)。
+    回傳 {"vocab_roots": [...], "sample_sentences": [...], "sample_glosses": [...]} 供基準查詢使用。
+    """
+    rng = random.Random(seed)
+    roots = list({root(rng) for _ in range(max(50, n_vocab // 3))})
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+    amis_db.ensure_schema(conn)
+    start = datetime(2024, 1, 1)
+    conn.execute("INSERT INTO pos_tags (tag_name, sort_order) VALUES " + ", ".join("(?, ?)" for _ in POS_TAGS),
+                 [v for i, t in enumerate(POS_TAGS) for v in (t, i)])
+    samples = {"vocab_roots": [], "sample_sentences": [], "sample_glosses": []}
+    for lo in range(0, n_vocab, batch):
+        rows = []
+        for i in range(lo, min(n_vocab, lo + batch)):
+            w = amis_word(rng, roots)
+            g = gloss(rng)
+            note = rng.choice(NOTE_TEMPLATES).format(s=sentence(rng, roots, 2, 4), g=gloss(rng, 4, 10), w=amis_word(rng, roots), y=rng.randint(1980, 2024))
+            rows.append((i + 1, w, g, None, rng.choice(POS_TAGS), note or None, (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")))
+            if len(samples["vocab_roots"]) < 200 and rng.random() < 0.05: samples["vocab_roots"].append(w)
+            if len(samples["sample_glosses"]) < 200 and rng.random() < 0.05: samples["sample_glosses"].append(g)
+        conn.executemany("INSERT INTO vocabulary (id, amis, chinese, english, part_of_speech, note, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    for lo in range(0, n_sent, batch):
+        rows = []
+        for i in range(lo, min(n_sent, lo + batch)):
+            s = sentence(rng, roots)
+            rows.append((i + 1, (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"), s, gloss(rng, 4, 16),
+                         gloss(rng, 3, 12) if rng.random() < 0.2 else None))
+            if len(samples["sample_sentences"]) < 200 and rng.random() < 0.05: samples["sample_sentences"].append(s)
+        conn.executemany("INSERT INTO sentence_pairs (id, created_at, output_sentencepattern_amis, output_sentencepattern_chinese, note) VALUES (?, ?, ?, ?, ?)", rows)
+    amis_db.ensure_vocab_index(conn)
+    conn.execute("COMMIT")
+    conn.close()
+    samples["roots"] = roots[:200]
+    return samples
+
+
+def csv_bytes(n, seed=7, table="sentence_pairs"):
+    """CSV 匯入測試用的檔案內容 (含少量不合格列)。"""
+    import csv
+    import io
+    rng = random.Random(seed)
+    roots = [root(rng) for _ in range(max(50, n // 3))]
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    if table == "sentence_pairs":
+        w.writerow(["output_sentencepattern_amis", "output_sentencepattern_chinese", "note"])
+        for i in range(n):
+            w.writerow(["" if i % 97 == 0 else sentence(rng, roots), gloss(rng, 4, 16), ""])
+    else:
+        w.writerow(["amis", "chinese", "part_of_speech", "note"])
+        for i in range(n):
+            w.writerow(["" if i % 97 == 0 else amis_word(rng, roots), gloss(rng), rng.choice(POS_TAGS), ""])
+    return buf.getvalue().encode("utf-8")